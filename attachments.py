@@ -0,0 +1,84 @@
+"""Streaming MIME construction for uploaded email attachments.
+
+Uploads arrive as spooled temporary files. write_mime_message lets the email
+package render the small parts (headers, body text, boundaries) around a
+placeholder per attachment, then streams each file into the output base64
+encoded in fixed-size chunks, so no attachment is ever held in memory whole.
+"""
+import base64
+import os
+import uuid
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from fastapi import HTTPException, Request
+
+EMAIL_MAX_UPLOAD_BYTES = int(os.getenv("EMAIL_MAX_UPLOAD_BYTES", str(60 * 1024 * 1024)))
+EMAIL_MAX_ATTACHMENT_BYTES = int(os.getenv("EMAIL_MAX_ATTACHMENT_BYTES", str(50 * 1024 * 1024)))
+
+# 57 raw bytes encode to one 76 character base64 line; read whole lines at a time.
+_RAW_CHUNK = 57 * 1024
+
+
+def limit_body(request: Request, max_bytes: int = EMAIL_MAX_UPLOAD_BYTES) -> Request:
+    """Return ``request`` with its body capped at ``max_bytes`` (413 beyond that).
+
+    A declared Content-Length is checked before anything is read; chunked
+    bodies are counted as they stream in.
+    """
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes.")
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        received += len(message.get("body", b""))
+        if received > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes.")
+        return message
+
+    return Request(request.scope, receive)
+
+
+def write_base64(source, out):
+    source.seek(0)
+    while True:
+        chunk = source.read(_RAW_CHUNK)
+        if not chunk:
+            break
+        out.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+
+
+def write_mime_message(out, sender, recipient, subject, text, attachments):
+    """Write a multipart/mixed message to the binary file ``out``.
+
+    ``attachments`` is a list of ``(maintype, subtype, filename, fileobj)``.
+    """
+    msg = MIMEMultipart()
+    msg["Subject"] = subject
+    msg["From"] = sender
+    msg["To"] = recipient
+    msg.attach(MIMEText(text, "plain"))
+
+    placeholders = {}
+    for maintype, subtype, filename, fileobj in attachments:
+        marker = f"attachment-{uuid.uuid4().hex}"
+        part = MIMEBase(maintype, subtype)
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", f'attachment; filename="{filename}"')
+        part.set_payload(marker)
+        msg.attach(part)
+        placeholders[marker.encode()] = fileobj
+
+    rendered = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+    for marker, fileobj in placeholders.items():
+        before, rendered = rendered.split(marker, 1)
+        out.write(before)
+        write_base64(fileobj, out)
+        # The generator put a line break after the marker; base64 lines already end in one.
+        rendered = rendered[2:] if rendered.startswith(b"\r\n") else rendered
+    out.write(rendered)
+    out.flush()
@@ -0,0 +1,95 @@
+"""Startup time and latency of the dimension endpoints with and without the registry.
+
+    DATABASE_URL=postgresql://... python benchmarks/dimension_bench.py --requests 500
+
+Runs the app in-process (httpx ASGITransport) once with
+DIMENSION_REGISTRY_ENABLED=0, where every call queries Postgres, and once with
+it on, where the lists are preloaded at startup, each in its own subprocess.
+Reports the lifespan startup time, then sequential p50/p99 latency and
+throughput at --concurrency for /api/products, /api/stores, /api/ppproducts
+and /api/ppstores. Rollup refreshes are switched off so they don't compete.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+ENDPOINTS = ["/api/products", "/api/stores", "/api/ppproducts", "/api/ppstores"]
+MODES = {"query": "0", "registry": "1"}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def child(requests, concurrency):
+    import httpx
+
+    from main import app
+
+    results = {}
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        results["startup_ms"] = (time.perf_counter() - started) * 1000
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for path in ENDPOINTS:
+                latencies = []
+                for _ in range(requests):
+                    request_started = time.perf_counter()
+                    response = await client.get(path, headers={"Accept-Encoding": "identity"})
+                    response.raise_for_status()
+                    latencies.append((time.perf_counter() - request_started) * 1000)
+
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def one():
+                    async with semaphore:
+                        await client.get(path, headers={"Accept-Encoding": "identity"})
+
+                burst_started = time.perf_counter()
+                await asyncio.gather(*(one() for _ in range(requests)))
+                results[path] = {
+                    "p50_ms": statistics.median(latencies),
+                    "p99_ms": percentile(latencies, 99),
+                    "rps": requests / (time.perf_counter() - burst_started),
+                    "bytes": len(response.content),
+                }
+    print(json.dumps(results))
+
+
+def main(args):
+    results = {}
+    for mode, enabled in MODES.items():
+        env = {**os.environ, "DIMENSION_REGISTRY_ENABLED": enabled, "ROLLUP_REFRESH_INTERVAL": "0"}
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", "--requests", str(args.requests), "--concurrency", str(args.concurrency)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    for mode, result in results.items():
+        print(f"{mode}: startup {result['startup_ms']:.0f} ms")
+        for path in ENDPOINTS:
+            r = result[path]
+            print(f"  {path:<16} p50 {r['p50_ms']:>7.2f} ms  p99 {r['p99_ms']:>7.2f} ms  "
+                  f"{r['rps']:>8.0f} req/s  {r['bytes']:>8} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(child(args.requests, args.concurrency))
+    else:
+        main(args)
@@ -0,0 +1,101 @@
+"""Peak RSS of building an email with a large attachment, old path vs new.
+
+    python benchmarks/email_upload_rss.py --size-mb 50
+
+"json" mimics /api/email_me: the PDF arrives base64 encoded in a JSON body,
+is parsed by pydantic, decoded and re-encoded by the email package.
+"multipart" mimics /api/email_me/upload: the PDF is already spooled to a temp
+file and attachments.write_mime_message streams it into another temp file.
+Each mode runs in its own subprocess so ru_maxrss reflects that mode only.
+"""
+import argparse
+import base64
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_json(payload_path):
+    from email import encoders
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from typing import Optional
+
+    from pydantic import BaseModel
+
+    class EmailRequest(BaseModel):
+        to: str
+        message: str
+        pdf: Optional[str] = None
+
+    with open(payload_path, "rb") as f:
+        body = f.read()
+    baseline = rss_mb()
+    start = time.perf_counter()
+    request = EmailRequest.model_validate_json(body)
+    del body
+    msg = MIMEMultipart()
+    msg["To"] = request.to
+    msg.attach(MIMEText(request.message, "plain"))
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(base64.b64decode(request.pdf))
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", 'attachment; filename="dashboard_report.pdf"')
+    msg.attach(part)
+    size = len(msg.as_bytes())
+    return baseline, time.perf_counter() - start, size
+
+
+def run_multipart(pdf_path):
+    from attachments import write_mime_message
+
+    baseline = rss_mb()
+    start = time.perf_counter()
+    with open(pdf_path, "rb") as pdf, tempfile.TemporaryFile() as out:
+        write_mime_message(out, "me@example.com", "you@example.com", "Report", "hi",
+                           [("application", "pdf", "dashboard_report.pdf", pdf)])
+        size = out.tell()
+    return baseline, time.perf_counter() - start, size
+
+
+def child(mode, path):
+    baseline, elapsed, size = (run_json if mode == "json" else run_multipart)(path)
+    print(f"{mode:<10} message {size / 2**20:7.1f} MB  {elapsed:6.2f}s  "
+          f"peak RSS {rss_mb():7.1f} MB  (+{rss_mb() - baseline:.1f} MB over start)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "report.pdf")
+        payload_path = os.path.join(tmp, "payload.json")
+        with open(pdf_path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(2**20))
+        with open(pdf_path, "rb") as src, open(payload_path, "wb") as f:
+            f.write(b'{"to": "you@example.com", "message": "hi", "pdf": "')
+            f.write(base64.b64encode(src.read()))
+            f.write(b'"}')
+        for mode, path in (("json", payload_path), ("multipart", pdf_path)):
+            subprocess.run([sys.executable, __file__, "--child", mode, path], check=True)
+
+
+if __name__ == "__main__":
+    main()
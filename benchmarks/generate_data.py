@@ -0,0 +1,221 @@
+"""Fill a local Postgres with synthetic dashboard data at a chosen scale.
+
+    DATABASE_URL=postgresql://localhost/bi_bench python benchmarks/generate_data.py --facts 1000000 --reset
+
+Creates the star schema behind /api/data (dim_date, dim_product, dim_store,
+dim_customer, fact_sales) and the orders schema behind /api/ppdata (products,
+stores, customers, orders, order_items), plus the persona_users rows the load
+driver logs in with. Rows are produced inside Postgres with generate_series
+and seeded hashes, so the same arguments always give the same data and 100M
+facts load without streaming them through Python. Facts are inserted in
+--chunk sized transactions with progress output; indexes are built and the
+tables analyzed at the end.
+
+Without --reset, tables that already exist are left alone and only missing
+ones are created and filled.
+"""
+import argparse
+import os
+import time
+
+import psycopg
+
+CATEGORIES = ["Electronics", "Clothing", "Home", "Garden", "Toys", "Sports", "Books", "Grocery"]
+# (city, state); the persona rules in personas.py scope on New York, San
+# Francisco, California and Nevada, so those all occur.
+LOCATIONS = [
+    ("New York", "New York"), ("San Francisco", "California"), ("Los Angeles", "California"),
+    ("Las Vegas", "Nevada"), ("Reno", "Nevada"), ("Chicago", "Illinois"), ("Austin", "Texas"),
+    ("Seattle", "Washington"), ("Boston", "Massachusetts"), ("Miami", "Florida"),
+]
+
+TABLES = ["fact_sales", "dim_date", "dim_product", "dim_store", "dim_customer",
+          "order_items", "orders", "products", "stores", "customers"]
+
+
+def text_array(values) -> str:
+    return "ARRAY[" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+
+def pick(seed_expr: str, salt: int, modulo: int) -> str:
+    """SQL for a reproducible value in [1, modulo] derived from ``seed_expr``."""
+    return f"(1 + mod(abs(hashint8extended({seed_expr}, %(seed)s + {salt})), {modulo}))::int"
+
+
+def dimension_ddl(args):
+    cities = text_array(city for city, _ in LOCATIONS)
+    states = text_array(state for _, state in LOCATIONS)
+    categories = text_array(CATEGORIES)
+    return {
+        "dim_date": f"""
+            CREATE TABLE dim_date AS
+            SELECT g AS date_id, (DATE '{args.start_date}' + g - 1) AS date
+            FROM generate_series(1, {args.days}) g
+        """,
+        "dim_product": f"""
+            CREATE TABLE dim_product AS
+            SELECT g AS product_id, 'Product ' || g AS product_name,
+                   ({categories})[1 + mod(g, {len(CATEGORIES)})] AS category, 'Brand ' || mod(g, 50) AS brand
+            FROM generate_series(1, {args.products}) g
+        """,
+        "dim_store": f"""
+            CREATE TABLE dim_store AS
+            SELECT g AS store_id, 'Store ' || g AS store_name,
+                   ({cities})[1 + mod(g, {len(LOCATIONS)})] AS city, ({states})[1 + mod(g, {len(LOCATIONS)})] AS state
+            FROM generate_series(1, {args.stores}) g
+        """,
+        "dim_customer": f"""
+            CREATE TABLE dim_customer AS
+            SELECT g AS customer_id, 'Customer ' || g AS customer_name
+            FROM generate_series(1, {args.customers}) g
+        """,
+        "products": f"""
+            CREATE TABLE products AS
+            SELECT 'SKU-' || lpad(g::text, 7, '0') AS SKU, 'Item ' || g AS Name,
+                   ({categories})[1 + mod(g, {len(CATEGORIES)})] AS Category,
+                   (ARRAY['S', 'M', 'L', 'XL'])[1 + mod(g, 4)] AS Size,
+                   (5 + mod(g * 37, 195))::numeric(10, 2) AS Price
+            FROM generate_series(1, {args.products}) g
+        """,
+        "stores": f"""
+            CREATE TABLE stores AS
+            SELECT g AS id, ({cities})[1 + mod(g, {len(LOCATIONS)})] AS city, ({states})[1 + mod(g, {len(LOCATIONS)})] AS state
+            FROM generate_series(1, {args.stores}) g
+        """,
+        "customers": f"""
+            CREATE TABLE customers AS
+            SELECT g AS id, 'Customer ' || g AS name
+            FROM generate_series(1, {args.customers}) g
+        """,
+    }
+
+
+def fact_tables(args):
+    """(table, create, chunk insert, total rows) for the large tables."""
+    orders = args.orders if args.orders is not None else args.facts // 4
+    units = pick("g", 4, 10)
+    return [
+        (
+            "fact_sales",
+            """
+            CREATE TABLE fact_sales (
+                sale_id BIGINT NOT NULL, date_id INT NOT NULL, product_id INT NOT NULL, store_id INT NOT NULL,
+                customer_id INT NOT NULL, units_sold INT NOT NULL, revenue NUMERIC(12, 2) NOT NULL,
+                profit NUMERIC(12, 2) NOT NULL
+            )
+            """,
+            f"""
+            INSERT INTO fact_sales
+            SELECT g, {pick("g", 0, args.days)}, p, {pick("g", 2, args.stores)}, {pick("g", 3, args.customers)},
+                   u, u * (5 + mod(p * 37, 195)), round(u * (5 + mod(p * 37, 195)) * 0.25, 2)
+            FROM generate_series(%(low)s::bigint, %(high)s::bigint) g,
+                 LATERAL (SELECT {pick("g", 1, args.products)} AS p, {units} AS u) r
+            """,
+            args.facts,
+        ),
+        (
+            "orders",
+            "CREATE TABLE orders (id BIGINT NOT NULL, orderDate DATE NOT NULL, storeId INT NOT NULL, customerId INT NOT NULL)",
+            f"""
+            INSERT INTO orders
+            SELECT g, DATE '{args.start_date}' + {pick("g", 10, args.days)} - 1, {pick("g", 11, args.stores)},
+                   {pick("g", 12, args.customers)}
+            FROM generate_series(%(low)s::bigint, %(high)s::bigint) g
+            """,
+            orders,
+        ),
+        (
+            "order_items",
+            "CREATE TABLE order_items (orderID BIGINT NOT NULL, SKU TEXT NOT NULL)",
+            f"""
+            INSERT INTO order_items
+            SELECT 1 + (g - 1) / {args.items_per_order}, 'SKU-' || lpad({pick("g", 13, args.products)}::text, 7, '0')
+            FROM generate_series(%(low)s::bigint, %(high)s::bigint) g
+            """,
+            orders * args.items_per_order,
+        ),
+    ]
+
+
+INDEXES = [
+    ("dim_date", "ALTER TABLE dim_date ADD PRIMARY KEY (date_id)"),
+    ("dim_product", "ALTER TABLE dim_product ADD PRIMARY KEY (product_id)"),
+    ("dim_store", "ALTER TABLE dim_store ADD PRIMARY KEY (store_id)"),
+    ("dim_customer", "ALTER TABLE dim_customer ADD PRIMARY KEY (customer_id)"),
+    ("fact_sales", "ALTER TABLE fact_sales ADD PRIMARY KEY (sale_id)"),
+    ("fact_sales", "CREATE INDEX ON fact_sales (date_id)"),
+    ("products", "ALTER TABLE products ADD PRIMARY KEY (SKU)"),
+    ("stores", "ALTER TABLE stores ADD PRIMARY KEY (id)"),
+    ("customers", "ALTER TABLE customers ADD PRIMARY KEY (id)"),
+    ("orders", "ALTER TABLE orders ADD PRIMARY KEY (id)"),
+    ("orders", "CREATE INDEX ON orders (orderDate)"),
+    ("order_items", "CREATE INDEX ON order_items (orderID)"),
+]
+
+PERSONA_USERS = [
+    "CREATE TABLE IF NOT EXISTS persona_users (username TEXT PRIMARY KEY, persona TEXT NOT NULL)",
+    "INSERT INTO persona_users VALUES ('srini', 'Srini'), ('venkat', 'Venkat') ON CONFLICT DO NOTHING",
+]
+
+
+def existing_tables(conn) -> set:
+    rows = conn.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema()").fetchall()
+    return {name for (name,) in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--facts", type=int, default=1_000_000, help="fact_sales rows (1M to 100M)")
+    parser.add_argument("--orders", type=int, default=None, help="orders rows (default facts / 4)")
+    parser.add_argument("--items-per-order", type=int, default=3)
+    parser.add_argument("--products", type=int, default=2_000)
+    parser.add_argument("--stores", type=int, default=200)
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--start-date", default="2024-01-01")
+    parser.add_argument("--chunk", type=int, default=2_000_000, help="rows per insert transaction")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all generated tables")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with psycopg.connect(args.database_url or "", autocommit=True) as conn:
+        if args.reset:
+            for table in TABLES:
+                conn.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+            # Rollups and their watermarks describe the old facts.
+            conn.execute("DROP TABLE IF EXISTS rollup_sales_daily, rollup_orders_daily, rollup_watermarks")
+        existing = existing_tables(conn)
+        created = []
+
+        for table, ddl in dimension_ddl(args).items():
+            if table not in existing:
+                conn.execute(ddl)
+                created.append(table)
+                print(f"{table}: created")
+
+        for table, ddl, insert, total in fact_tables(args):
+            if table in existing:
+                continue
+            conn.execute(ddl)
+            created.append(table)
+            for low in range(1, total + 1, args.chunk):
+                high = min(low + args.chunk - 1, total)
+                chunk_started = time.perf_counter()
+                conn.execute(insert, {"low": low, "high": high, "seed": args.seed})
+                rate = (high - low + 1) / (time.perf_counter() - chunk_started)
+                print(f"{table}: {high:,}/{total:,} rows ({rate:,.0f} rows/s)")
+
+        for table, statement in INDEXES:
+            if table in created:
+                conn.execute(statement)
+        for statement in PERSONA_USERS:
+            conn.execute(statement)
+        for table in created:
+            conn.execute(f"ANALYZE {table}")
+    print(f"done in {time.perf_counter() - started:.1f}s; created {', '.join(created) or 'nothing'}")
+
+
+if __name__ == "__main__":
+    main()
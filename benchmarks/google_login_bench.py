@@ -0,0 +1,82 @@
+"""Google ID token verification latency, local JWKS vs the tokeninfo endpoint.
+
+    python benchmarks/google_login_bench.py --runs 200
+    python benchmarks/google_login_bench.py --tokeninfo <real id_token>
+
+Signs tokens with a throwaway RSA key served from a local stand-in JWKS
+endpoint and times GoogleTokenVerifier cold (JWKS fetch), warm (cached keys)
+and on a repeated token. With --tokeninfo it also times the old per-login
+round-trip to oauth2.googleapis.com for comparison.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from google_auth import GoogleTokenVerifier  # noqa: E402
+
+CLIENT_ID = "bench-client.apps.googleusercontent.com"
+
+
+def stand_in_jwks():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update(kid="bench-key", alg="RS256", use="sig")
+
+    def handler(request):
+        return httpx.Response(200, json={"keys": [jwk]}, headers={"Cache-Control": "public, max-age=3600"})
+
+    return private_key, httpx.MockTransport(handler)
+
+
+def make_token(private_key, n):
+    now = int(time.time())
+    claims = {"iss": "https://accounts.google.com", "aud": CLIENT_ID, "sub": str(n),
+              "email": f"user{n}@example.com", "iat": now, "exp": now + 3600}
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": "bench-key"})
+
+
+async def timed(coro):
+    started = time.perf_counter()
+    result = await coro
+    return (time.perf_counter() - started) * 1000, result
+
+
+async def main(runs, tokeninfo_token):
+    private_key, transport = stand_in_jwks()
+    async with httpx.AsyncClient(transport=transport, base_url="https://jwks.local") as client:
+        verifier = GoogleTokenVerifier(client, CLIENT_ID, jwks_url="https://jwks.local/certs")
+        cold_ms, email = await timed(verifier.verify(make_token(private_key, 0)))
+        assert email == "user0@example.com"
+        tokens = [make_token(private_key, n) for n in range(1, runs + 1)]
+        warm = [(await timed(verifier.verify(token)))[0] for token in tokens]
+        repeat = [(await timed(verifier.verify(tokens[0])))[0] for _ in range(runs)]
+    print(f"local JWKS, cold key fetch   {cold_ms:>8.3f} ms")
+    print(f"local JWKS, cached keys      {statistics.median(warm):>8.3f} ms (median of {runs})")
+    print(f"verified-token cache hit     {statistics.median(repeat):>8.3f} ms (median of {runs})")
+
+    if tokeninfo_token:
+        async with httpx.AsyncClient(timeout=10) as client:
+            samples = []
+            for _ in range(min(runs, 20)):
+                ms, _ = await timed(client.get("https://oauth2.googleapis.com/tokeninfo",
+                                               params={"id_token": tokeninfo_token}))
+                samples.append(ms)
+        print(f"tokeninfo round-trip (old)   {statistics.median(samples):>8.3f} ms (median of {len(samples)})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--tokeninfo", help="a real Google ID token to time the tokeninfo endpoint with")
+    args = parser.parse_args()
+    asyncio.run(main(args.runs, args.tokeninfo))
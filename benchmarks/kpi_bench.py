@@ -0,0 +1,96 @@
+"""/api/kpis drill-downs on the cached frame vs the same aggregates in Postgres.
+
+    DATABASE_URL=postgresql://... python benchmarks/kpi_bench.py --runs 20
+
+Refreshes the rollups, loads each source's frame once (timed), then for each
+drill-down below times kpis.compute_kpis on the frame against the /api/data
+style queries the dashboard would otherwise need: top products, category
+breakdown, daily series and the current, previous-period and previous-year
+totals, all through the rollups.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db import pool  # noqa: E402
+from kpis import FRAME_SOURCES, compute_kpis, kpi_query_params, load_frame, year_earlier  # noqa: E402
+from queries import build_data_query  # noqa: E402
+from rollups import refresh_rollups, route_schema  # noqa: E402
+from serialization import fetch_rows  # noqa: E402
+
+DRILL_DOWNS = [
+    {},
+    {"category": {"Toys"}},
+    {"state": {"California"}, "category": {"Home", "Garden"}},
+]
+
+
+async def run_sync(function, *args):
+    return await asyncio.to_thread(function, *args)
+
+
+def options_for(filters):
+    options = kpi_query_params(None, None, None, None, None, None, None, "product_name", "revenue", 10, "category", "day")
+    options["filters"] = filters
+    return options
+
+
+async def sql_kpis(schema, date_from, date_to, filters):
+    days = (date_to - date_from).days + 1
+    windows = [
+        (date_from, date_to, "product_name"),
+        (date_from, date_to, "category"),
+        (date_from, date_to, "date"),
+        (date_from - timedelta(days=days), date_from - timedelta(days=1), "category"),
+        (year_earlier(date_from), year_earlier(date_to), "category"),
+    ]
+    for start, end, group_by in windows:
+        options = {
+            "date_from": start, "date_to": end, "filters": {name: sorted(values) for name, values in filters.items()},
+            "group_by": [group_by], "limit": None, "cursor": None,
+        }
+        query, params, _ = build_data_query(route_schema(schema, options), options)
+        await fetch_rows(query, params, "columnar")
+
+
+async def median_ms(function, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+async def main(runs):
+    await pool.open()
+    try:
+        print("refresh:", await refresh_rollups())
+        for label, source in FRAME_SOURCES.items():
+            schema = source["schema"]
+            started = time.perf_counter()
+            frame = await load_frame(source, [], run_sync)
+            print(f"\n{label}: frame of {frame.rows} rows, {frame.nbytes / 1e6:.1f} MB, "
+                  f"loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+            for filters in DRILL_DOWNS:
+                options = options_for(filters)
+                result = compute_kpis(frame, options)
+                date_from, date_to = result["period"]["from"], result["period"]["to"]
+                frame_ms = await median_ms(lambda: run_sync(compute_kpis, frame, options), runs)
+                sql_ms = await median_ms(lambda: sql_kpis(schema, date_from, date_to, filters), runs)
+                name = ";".join(f"{key}={','.join(sorted(values))}" for key, values in filters.items()) or "(all)"
+                print(f"  {name:<40} frame {frame_ms:>8.1f} ms   sql {sql_ms:>8.1f} ms")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    asyncio.run(main(parser.parse_args().runs))
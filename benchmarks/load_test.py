@@ -0,0 +1,153 @@
+"""Concurrent load driver for the dashboard API.
+
+    python benchmarks/load_test.py --base-url http://localhost:8000 \
+        --username srini --password password --concurrency 50 --requests 2000 \
+        --output results/after.json --compare results/before.json
+
+Logs in once, then fires ``--requests`` requests per endpoint with at most
+``--concurrency`` in flight and prints throughput and latency percentiles.
+Throughput and percentiles count successful responses only, so a build that
+fails fast under load doesn't look faster; errors (HTTP status >= 400 or a
+transport failure) are counted and timed separately.
+"/api/login" is measured as a POST with the same credentials; every other
+endpoint is a GET with the bearer token. ``--output`` saves the run (results,
+arguments, git commit, time) as JSON, and ``--compare`` prints the change in
+RPS and p50/p99 against an earlier saved run.
+
+Fill the database with benchmarks/generate_data.py first so runs at the same
+scale are comparable.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+DEFAULT_ENDPOINTS = ["/api/login", "/api/data", "/api/ppdata", "/api/products"]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_endpoint(client, path, total, concurrency, headers=None, json_body=None):
+    latencies = []
+    error_latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if json_body is not None:
+                    response = await client.post(path, json=json_body)
+                else:
+                    response = await client.get(path, headers=headers)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            (latencies if ok else error_latencies).append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    return {
+        "endpoint": path,
+        "requests": total,
+        "ok": len(latencies),
+        "errors": len(error_latencies),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+        "error_p50_ms": percentile(error_latencies, 50),
+        "error_p99_ms": percentile(error_latencies, 99),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {result["endpoint"]: result for result in json.load(f)["results"]}
+    print(f"\nvs {baseline_path}")
+    for result in results:
+        before = baseline.get(result["endpoint"])
+        if not before:
+            continue
+        changes = []
+        for key in ("rps", "p50_ms", "p99_ms"):
+            delta = (result[key] - before[key]) / before[key] if before[key] else 0.0
+            changes.append(f"{key} {before[key]:.1f} -> {result[key]:.1f} ({delta:+.0%})")
+        changes.append(f"errors {before['errors']} -> {result['errors']}")
+        print(f"{result['endpoint']:<20} " + "  ".join(changes))
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    credentials = {"username": args.username, "password": args.password}
+    results = []
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        response = await client.post("/api/login", json=credentials)
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for path in args.endpoints:
+            if args.warmup:
+                await run_endpoint(client, path, args.warmup, args.concurrency, headers,
+                                   credentials if path == "/api/login" else None)
+            result = await run_endpoint(client, path, args.requests, args.concurrency, headers,
+                                        credentials if path == "/api/login" else None)
+            results.append(result)
+            line = (
+                f"{result['endpoint']:<20} {result['rps']:>9.1f} ok req/s  "
+                f"p50 {result['p50_ms']:>8.1f} ms  p99 {result['p99_ms']:>8.1f} ms  "
+                f"errors {result['errors']}"
+            )
+            if result["errors"]:
+                line += f" (p50 {result['error_p50_ms']:.1f} ms, p99 {result['error_p99_ms']:.1f} ms)"
+            print(line)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                "commit": git_commit(),
+                "args": {key: value for key, value in vars(args).items() if key not in ("password", "output", "compare")},
+                "results": results,
+            }, f, indent=2)
+        print(f"\nsaved {args.output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--username", default="srini")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per endpoint first")
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="earlier --output file to compare against")
+    asyncio.run(main(parser.parse_args()))
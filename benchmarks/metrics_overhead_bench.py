@@ -0,0 +1,95 @@
+"""Overhead of the Prometheus instrumentation in metrics.py.
+
+    python benchmarks/metrics_overhead_bench.py --requests 2000 --queries 50000
+
+"middleware" sends requests to a trivial FastAPI route in-process (httpx
+ASGITransport, no network) with and without MetricsMiddleware. "cursor" runs
+execute + fetchall on a no-op cursor with and without the _Timed wrapper, so
+the difference is the wrapper alone. Both report the best per-call cost over
+--rounds alternating rounds.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+import metrics  # noqa: E402
+
+QUERY = "SELECT d.date, SUM(f.revenue) FROM fact_sales f JOIN dim_date d ON f.date_id = d.date_id GROUP BY d.date"
+
+
+def make_app(instrumented):
+    app = FastAPI()
+
+    @app.get("/api/items/{item_id}")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    if instrumented:
+        app.add_middleware(metrics.MetricsMiddleware)
+    return app
+
+
+async def time_requests(app, count):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(200):
+            await client.get(f"/api/items/{i}")
+        start = time.perf_counter()
+        for i in range(count):
+            await client.get(f"/api/items/{i}")
+        return (time.perf_counter() - start) / count
+
+
+class NoopCursor:
+    async def execute(self, query, params=None, **kwargs):
+        return self
+
+    async def fetchall(self):
+        return [(1,)]
+
+
+class TimedNoopCursor(metrics._Timed, NoopCursor):
+    pass
+
+
+async def time_queries(cursor, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        await cursor.execute(QUERY, None)
+        await cursor.fetchall()
+    return (time.perf_counter() - start) / count
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=50000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # Alternate rounds and keep the best of each, to keep scheduler noise out.
+    apps = (make_app(False), make_app(True))
+    plain = timed = float("inf")
+    for _ in range(args.rounds):
+        plain = min(plain, await time_requests(apps[0], args.requests))
+        timed = min(timed, await time_requests(apps[1], args.requests))
+    print(f"middleware  plain {plain * 1e6:8.1f} us/request  instrumented {timed * 1e6:8.1f} us/request  "
+          f"overhead {(timed - plain) * 1e6:6.1f} us ({(timed - plain) / plain:.1%})")
+
+    plain = timed = float("inf")
+    for _ in range(args.rounds):
+        plain = min(plain, await time_queries(NoopCursor(), args.queries))
+        timed = min(timed, await time_queries(TimedNoopCursor(), args.queries))
+    print(f"cursor      plain {plain * 1e6:8.2f} us/query    instrumented {timed * 1e6:8.2f} us/query    "
+          f"overhead {(timed - plain) * 1e6:6.2f} us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,151 @@
+"""Throughput of the scheduled report sender against a local SMTP stand-in.
+
+    python benchmarks/report_delivery_bench.py --messages 300 --rtt-ms 20
+
+Starts an aiosmtpd server with implicit TLS (self-signed certificate) that
+sleeps --rtt-ms per connection greeting and per message, to stand in for a
+remote server. "serial" is the old loop: build, then a fresh SMTP_SSL
+connection per message. "pipeline" is report_pipeline.DeliveryPipeline with
+the given SMTP pool sizes. Messages are built by the sender's own build_job
+with two pre-rendered 64 KB attachments standing in for the report files.
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import os
+import smtplib
+import socket
+import ssl
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("EMAIL_ADDRESS", "reports@example.com")
+
+import logging  # noqa: E402
+
+from aiosmtpd.controller import Controller  # noqa: E402
+from cryptography import x509  # noqa: E402
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec  # noqa: E402
+from cryptography.x509.oid import NameOID  # noqa: E402
+
+import scheduled_report_sender as sender  # noqa: E402
+from report_pipeline import DeliveryPipeline, SmtpPool, StageMetrics  # noqa: E402
+
+
+class SlowHandler:
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.received = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.rtt)
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.rtt)
+        self.received += 1
+        return "250 OK"
+
+
+def self_signed_context(tmp):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256()))
+    cert_path, key_path = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    server = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server.load_cert_chain(cert_path, key_path)
+    client = ssl.create_default_context()
+    client.check_hostname = False
+    client.verify_mode = ssl.CERT_NONE
+    return server, client
+
+
+class StubRenderer:
+    def __init__(self, tmp):
+        self.files = []
+        for kind in ("pdf", "xlsx"):
+            path = os.path.join(tmp, f"report.{kind}")
+            with open(path, "wb") as f:
+                f.write(os.urandom(64 * 1024))
+            self.files.append((kind, path))
+
+    def artifacts(self, owner, report_format, report_date):
+        return self.files
+
+
+def make_jobs(count):
+    slot = datetime.datetime.now(datetime.timezone.utc)
+    return [(i, f"user{i}@example.com", f"user{i}@example.com", "both", "UTC", slot) for i in range(count)]
+
+
+def run_serial(build, jobs, port, client_ctx):
+    for job in jobs:
+        from_addr, recipients, message = build(job)
+        with smtplib.SMTP_SSL("127.0.0.1", port, context=client_ctx) as smtp:
+            smtp.sendmail(from_addr, recipients, message)
+
+
+def run_pipeline(build, jobs, port, client_ctx, pool_size, workers):
+    metrics = StageMetrics()
+    pool = SmtpPool(size=pool_size, host="127.0.0.1", port=port, use_tls=True, ssl_context=client_ctx, metrics=metrics)
+    pipeline = DeliveryPipeline(build, pool, generate_workers=workers)
+    try:
+        failures = [error for _, error in pipeline.run(jobs) if error is not None]
+    finally:
+        pipeline.close()
+    if failures:
+        raise failures[0]
+    return metrics.snapshot()["stages"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--rtt-ms", type=float, default=20)
+    parser.add_argument("--pool", type=int, action="append", help="SMTP pool sizes (default 1, 4, 8)")
+    parser.add_argument("--workers", type=int, default=8, help="generate workers")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server_ctx, client_ctx = self_signed_context(tmp)
+        handler = SlowHandler(args.rtt_ms / 1000)
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        controller = Controller(handler, hostname="127.0.0.1", port=port, ssl_context=server_ctx, ready_timeout=10)
+        controller.start()
+        try:
+            jobs = make_jobs(args.messages)
+            build = functools.partial(sender.build_job, StubRenderer(tmp))
+            start = time.perf_counter()
+            run_serial(build, jobs, port, client_ctx)
+            elapsed = time.perf_counter() - start
+            print(f"{'serial':<12} {args.messages / elapsed:8.1f} msg/s  ({elapsed:.2f}s)")
+            for pool_size in args.pool or [1, 4, 8]:
+                start = time.perf_counter()
+                stages = run_pipeline(build, jobs, port, client_ctx, pool_size, args.workers)
+                elapsed = time.perf_counter() - start
+                detail = "  ".join(f"{name} n={s['count']} avg={s['avg_seconds'] * 1000:.1f}ms"
+                                   for name, s in stages.items())
+                print(f"{'pool=' + str(pool_size):<12} {args.messages / elapsed:8.1f} msg/s  ({elapsed:.2f}s)  {detail}")
+        finally:
+            controller.stop()
+        assert handler.received == args.messages * (1 + len(args.pool or [1, 4, 8]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Render time and peak RSS of scheduled-report artifacts.
+
+    python benchmarks/report_render_bench.py --rows 100000
+
+Each mode renders synthetic /api/data rows in its own subprocess, so
+ru_maxrss belongs to that mode alone:
+  xlsx-write-only  reports.write_xlsx (openpyxl write-only, rows streamed)
+  xlsx-in-memory   a regular openpyxl Workbook, for comparison
+  pdf              reports.write_pdf (totals + first REPORT_PDF_MAX_ROWS rows)
+Then "dedup" sends a batch of subscribers spread over a few personas through
+ReportRenderer and counts how many reports were actually rendered.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from serialization_bench import COLUMNS, make_rows  # noqa: E402
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def iter_rows(count):
+    # Generated in slices, as a server-side cursor would hand them over.
+    for offset in range(0, count, 5000):
+        yield from make_rows(min(5000, count - offset), decimals=True)
+
+
+def child(mode, count):
+    import reports
+    from openpyxl import Workbook
+
+    baseline = rss_mb()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "out")
+        start = time.perf_counter()
+        if mode == "xlsx-write-only":
+            reports.write_xlsx(path, COLUMNS, iter_rows(count))
+        elif mode == "xlsx-in-memory":
+            workbook = Workbook()
+            sheet = workbook.active
+            sheet.append(COLUMNS)
+            for row in iter_rows(count):
+                sheet.append(row)
+            workbook.save(path)
+        else:
+            reports.write_pdf(path, COLUMNS, iter_rows(count), "Benchmark report")
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+    print(f"{mode:<16} {elapsed:6.2f}s  file {size / 2**20:6.1f} MB  "
+          f"peak RSS {rss_mb():7.1f} MB  (+{rss_mb() - baseline:.1f} MB over start)")
+
+
+class FakeCursor:
+    def __init__(self, count):
+        self.count = count
+        self.description = [(name,) for name in COLUMNS]
+        self.itersize = None
+        self._rows = None
+
+    def execute(self, query, params):
+        self._rows = iter_rows(self.count)
+
+    def fetchmany(self, size):
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def __iter__(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, count):
+        self.count = count
+
+    def cursor(self, name=None):
+        return FakeCursor(self.count)
+
+    def close(self):
+        pass
+
+
+def dedup(count, subscribers):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import reports
+    from personas import PersonaIndex
+
+    personas = PersonaIndex()
+    personas.replace(
+        [("srini", "Srini"), ("venkat", "Venkat")],
+        [("Srini", "data", "city", ["New York"]), ("Venkat", "data", "city", ["San Francisco"])],
+    )
+    emails = [f"{['srini', 'venkat', f'user{i}'][i % 3]}@example.com" for i in range(subscribers)]
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = reports.ArtifactCache(tmp)
+        renderer = reports.ReportRenderer(lambda: FakeConnection(count), personas, 42, cache)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda email: renderer.artifacts(email, "both", date(2026, 1, 31)), emails))
+        elapsed = time.perf_counter() - start
+    print(f"{'dedup':<16} {elapsed:6.2f}s  {subscribers} subscribers x pdf+xlsx -> "
+          f"{cache.renders} renders, {cache.hits} cache hits")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--subscribers", type=int, default=300)
+    parser.add_argument("--dedup-rows", type=int, default=10_000)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.rows)
+        return
+    for mode in ("xlsx-write-only", "xlsx-in-memory", "pdf"):
+        subprocess.run([sys.executable, __file__, "--child", mode, "--rows", str(args.rows)], check=True)
+    dedup(args.dedup_rows, args.subscribers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Query latency of /api/data-style aggregations on the facts vs the rollups.
+
+    DATABASE_URL=postgresql://... python benchmarks/rollup_bench.py --runs 5
+
+Refreshes the rollups first, then times each group_by below against the base
+schema and the rollup. Run it after loading different fact volumes to see
+how latency grows with table size.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from db import pool  # noqa: E402
+from queries import ORDERS_SCHEMA, STAR_SCHEMA, build_data_query  # noqa: E402
+from rollups import refresh_rollups, route_schema  # noqa: E402
+from serialization import fetch_rows  # noqa: E402
+
+SCENARIOS = [
+    ["date"],
+    ["date", "product_name"],
+    ["date", "store_name", "city"],
+    ["category", "state"],
+]
+
+
+def options_for(group_by):
+    return {"date_from": None, "date_to": None, "filters": {}, "group_by": group_by, "limit": 100, "cursor": None}
+
+
+async def time_query(schema, options, runs):
+    query, params, _ = build_data_query(schema, options)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await fetch_rows(query, params, "columnar")
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+async def main(runs):
+    await pool.open()
+    try:
+        print("refresh:", await refresh_rollups())
+        for label, schema, table in (("fact_sales", STAR_SCHEMA, "fact_sales"), ("orders", ORDERS_SCHEMA, "order_items")):
+            columns, rows = await fetch_rows(f"SELECT count(*) FROM {table}", None, "columnar")
+            print(f"\n{label}: {rows[0][0]} fact rows")
+            for group_by in SCENARIOS:
+                options = options_for(group_by)
+                rollup = route_schema(schema, options)
+                base_ms = await time_query(schema, options, runs)
+                rollup_ms = await time_query(rollup, options, runs) if rollup is not schema else float("nan")
+                print(f"  {','.join(group_by):<28} base {base_ms:>9.1f} ms   rollup {rollup_ms:>9.1f} ms")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    asyncio.run(main(parser.parse_args().runs))
@@ -0,0 +1,75 @@
+"""Compare the old and new row serialization paths on synthetic /api/data rows.
+
+    python benchmarks/serialization_bench.py --rows 100 --rows 10000
+
+"old" is dict(zip()) + jsonable_encoder + JSONResponse as main.py used to do;
+"records" and "columnar" are the serialization.py encoders. Numeric columns are
+Decimal for the old path and int/float for the new ones, as JsonNumericLoader
+hands them over.
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import serialization  # noqa: E402
+
+COLUMNS = ["date", "product_name", "category", "store_name", "city", "customer_name", "units_sold", "revenue", "profit"]
+
+
+def make_rows(count, decimals):
+    start = date(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        units = i % 17 + 1
+        revenue = Decimal(f"{units * 19.99:.2f}")
+        profit = Decimal(f"{units * 5.25:.2f}")
+        if not decimals:
+            units, revenue, profit = int(units), float(revenue), float(profit)
+        else:
+            units = Decimal(units)
+        rows.append((start + timedelta(days=i % 365), f"Product {i % 250}", "Electronics",
+                     f"Store {i % 40}", "New York", f"Customer {i % 5000}", units, revenue, profit))
+    return rows
+
+
+def old_path(rows):
+    data = [dict(zip(COLUMNS, row)) for row in rows]
+    return JSONResponse(content=jsonable_encoder(data)).body
+
+
+def records_path(rows):
+    return serialization.dumps([dict(zip(COLUMNS, row)) for row in rows])
+
+
+def columnar_path(rows):
+    return serialization.encode_columnar(COLUMNS, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, action="append")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for count in args.rows or [100, 10000]:
+        decimal_rows = make_rows(count, decimals=True)
+        native_rows = make_rows(count, decimals=False)
+        number = max(1, 20000 // count)
+        for name, func, rows in (
+            ("old", old_path, decimal_rows),
+            ("records", records_path, native_rows),
+            ("columnar", columnar_path, native_rows),
+        ):
+            best = min(timeit.repeat(lambda: func(rows), number=number, repeat=args.repeat)) / number
+            print(f"{count:>8} rows  {name:<9} {best * 1000:>9.3f} ms  {len(func(rows)):>10} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Throughput of serve.py from 1 to N worker processes.
+
+    DATABASE_URL=postgresql://... python benchmarks/worker_scaling_bench.py --max-workers 4
+
+For each worker count, starts serve.py with WEB_CONCURRENCY set on --port,
+waits until it answers, logs in and drives every endpoint with
+load_test.run_endpoint, then stops it. Prints requests per second and the
+speedup over one worker. Rollup refreshes are switched off so they don't
+compete; the numbers only mean something on a host with that many cores.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from load_test import run_endpoint
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ENDPOINTS = ["/api/data", "/api/products", "/api/kpis"]
+
+
+async def wait_until_up(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=5) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/metrics")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"server at {base_url} did not start within {timeout}s")
+
+
+async def measure(args, base_url):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        response = await client.post("/api/login", json={"username": args.username, "password": args.password})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        for path in args.endpoints:
+            await run_endpoint(client, path, args.warmup, args.concurrency, headers)
+            results[path] = await run_endpoint(client, path, args.requests, args.concurrency, headers)
+    return results
+
+
+def main(args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    runs = {}
+    for workers in range(1, args.max_workers + 1):
+        env = {**os.environ, "WEB_CONCURRENCY": str(workers), "PORT": str(args.port), "HOST": "127.0.0.1",
+               "ROLLUP_REFRESH_INTERVAL": "0"}
+        server = subprocess.Popen([sys.executable, "serve.py"], cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            asyncio.run(wait_until_up(base_url))
+            runs[workers] = asyncio.run(measure(args, base_url))
+        finally:
+            server.send_signal(signal.SIGINT)
+            server.wait(timeout=30)
+
+    print(f"{'endpoint':<16}" + "".join(f"{f'{n} worker(s)':>22}" for n in runs))
+    for path in args.endpoints:
+        base = runs[1][path]["rps"]
+        cells = [f"{r[path]['rps']:>9.0f} req/s x{r[path]['rps'] / base:>4.2f}" for r in runs.values()]
+        print(f"{path:<16}" + "".join(f"{cell:>22}" for cell in cells))
+        errors = sum(r[path]["errors"] for r in runs.values())
+        if errors:
+            print(f"  {errors} errors")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "runs": runs}, f, indent=2)
+        print(f"\nsaved {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--username", default="srini")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    main(parser.parse_args())
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import orjson
+
+from shared import shared_store
+
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class ResultCache:
+    """TTL + LRU cache of rendered responses with single-flight loading.
+
+    Values are ``(body, headers)`` pairs unless ``sizeof`` says otherwise; the
+    memory bound is the sum of ``sizeof(value)``, by default the body lengths.
+    Concurrent misses on one key share a single ``loader`` call.
+
+    With a ``shared`` store (several workers), an invalidation in any worker
+    clears this cache, found by ``namespace``, in every worker, and with a
+    ``codec`` of ``(encode, decode)``
+    a miss is first looked up in the store and loaded values are written
+    there for the other workers.
+    """
+
+    def __init__(self, ttl=300.0, max_entries=256, max_bytes=64 * 1024 * 1024, sizeof=None, shared=None, codec=None,
+                 namespace="default"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: len(value[0]))
+        self.shared = shared
+        self.codec = codec
+        self.namespace = namespace
+        self._shared_generation = shared.generation(namespace) if shared is not None else None
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}            # key -> asyncio.Future
+        self._bytes = 0
+        self._generation = 0
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0, "shared_hits": 0}
+
+    async def get_or_load(self, key, loader):
+        """Return ``(value, hit)`` for ``key``, calling ``await loader()`` on a miss."""
+        if self.shared is not None:
+            self._follow_shared()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return value, True
+            self._remove(key)
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self._stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(future), False
+            except asyncio.CancelledError:
+                # The request doing the load went away; take over the load.
+                if future.cancelled():
+                    return await self.get_or_load(key, loader)
+                raise
+
+        self._stats["misses"] += 1
+        generation = self._generation
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load(key, loader)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved so an un-awaited future doesn't warn.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            if generation == self._generation:
+                self._store(key, value)
+            return value, False
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load(self, key, loader):
+        if self.shared is None or self.codec is None:
+            return await loader()
+        encode, decode = self.codec
+        generation = self._shared_generation
+        data = self.shared.get(key, generation)
+        if data is not None:
+            self._stats["shared_hits"] += 1
+            return decode(data)
+        value = await loader()
+        self.shared.set(key, encode(value), generation)
+        return value
+
+    def _follow_shared(self):
+        generation = self.shared.generation(self.namespace)
+        if generation != self._shared_generation:
+            self._shared_generation = generation
+            self._invalidate_local()
+
+    def invalidate(self, prefix=None):
+        """Drop every entry, or only keys whose first element equals ``prefix``.
+
+        Other workers sharing the store drop all of their entries.
+        """
+        removed = self._invalidate_local(prefix)
+        if self.shared is not None:
+            self.shared.bump(self.namespace)
+            self._shared_generation = self.shared.generation(self.namespace)
+        return removed
+
+    def _invalidate_local(self, prefix=None):
+        self._generation += 1
+        self._stats["invalidations"] += 1
+        if prefix is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            return removed
+        keys = [key for key in self._entries if key[0] == prefix]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats.update(entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+        return stats
+
+    def _store(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= self.sizeof(value)
+
+
+def encode_response(value) -> bytes:
+    body, headers = value
+    return orjson.dumps(headers) + b"\n" + body
+
+
+def decode_response(data: bytes):
+    headers, _, body = data.partition(b"\n")
+    return body, orjson.loads(headers)
+
+
+result_cache = ResultCache(
+    ttl=RESULT_CACHE_TTL,
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    shared=shared_store,
+    codec=(encode_response, decode_response),
+    namespace="result_cache",
+)
@@ -0,0 +1,53 @@
+import os
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from metrics import POOL_WAIT_SECONDS, StatsCollector, instrument_connection
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))            # seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # seconds before a connection is recycled
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "600"))        # close surplus connections idle this long
+
+# Connections run in autocommit mode: the dashboard reads are single
+# statements, so this saves the BEGIN/ROLLBACK round-trips. Code that needs a
+# transaction opens one explicitly with ``async with conn.transaction()``.
+pool = AsyncConnectionPool(
+    DATABASE_URL or "",
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    max_idle=DB_POOL_MAX_IDLE,
+    check=AsyncConnectionPool.check_connection,
+    kwargs={"autocommit": True},
+    configure=instrument_connection,
+    open=False,
+)
+REGISTRY.register(StatsCollector("db_pool", pool.get_stats))
+
+
+@asynccontextmanager
+async def connection():
+    start = time.perf_counter()
+    try:
+        conn = await pool.getconn()
+    except PoolTimeout:
+        raise HTTPException(status_code=503, detail="Database is busy, please retry.")
+    finally:
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        await pool.putconn(conn)
+
+
+async def get_db():
+    async with connection() as conn:
+        yield conn
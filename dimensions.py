@@ -0,0 +1,136 @@
+"""Dimension lists (/api/products, /api/stores and their pp* twins) served from memory.
+
+The tables behind them change rarely, so a DimensionRegistry loads each one
+at startup and keeps it as an immutable snapshot of response bodies already
+encoded in every format serialization.py offers, with their ETags. A
+background task compares a cheap per-table version (relfilenode plus the
+insert/update/delete counters from pg_stat_user_tables, which Postgres
+publishes within seconds of a commit) every DIMENSION_REFRESH_INTERVAL
+seconds and reloads only the tables that changed; a snapshot older than
+DIMENSION_MAX_AGE is reloaded regardless. Until a table has loaded, its
+endpoint queries Postgres as before.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from db import connection
+from responses import make_etag
+from serialization import FORMAT_ARROW, FORMAT_COLUMNAR, FORMAT_RECORDS, MEDIA_TYPES, encode, fetch_rows, pa
+
+logger = logging.getLogger(__name__)
+
+DIMENSION_REGISTRY_ENABLED = os.getenv("DIMENSION_REGISTRY_ENABLED", "1") == "1"
+DIMENSION_REFRESH_INTERVAL = float(os.getenv("DIMENSION_REFRESH_INTERVAL", "30"))
+DIMENSION_MAX_AGE = float(os.getenv("DIMENSION_MAX_AGE", "3600"))
+DIMENSION_STARTUP_WAIT = float(os.getenv("DIMENSION_STARTUP_WAIT", "5"))
+
+# endpoint -> (table, query)
+DIMENSION_TABLES = {
+    "/api/products": ("dim_product", "SELECT product_id, product_name, category, brand FROM dim_product ORDER BY product_name"),
+    "/api/stores": ("dim_store", "SELECT store_id, store_name, city, state FROM dim_store ORDER BY store_name"),
+    "/api/ppproducts": ("products", "SELECT SKU AS product_id, Name AS product_name, Category, Size as brand FROM products ORDER BY Name"),
+    "/api/ppstores": ("stores", "SELECT id AS store_id, id AS store_name, city, state FROM stores ORDER BY id"),
+}
+
+VERSION_SQL = """
+    SELECT t.name, c.relfilenode, s.n_tup_ins + s.n_tup_upd + s.n_tup_del
+    FROM unnest(%s::text[]) AS t(name)
+    LEFT JOIN pg_class c ON c.oid = to_regclass(t.name)
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+"""
+
+
+class DimensionSnapshot:
+    """Encoded bodies and ETags of one dimension list, per format."""
+
+    __slots__ = ("version", "rows", "bodies", "etags", "loaded_at")
+
+    def __init__(self, version, columns, rows):
+        self.version = version
+        self.rows = len(rows)
+        formats = [fmt for fmt in MEDIA_TYPES if fmt != FORMAT_ARROW or pa is not None]
+        records = [dict(zip(columns, row)) for row in rows]
+        self.bodies = {fmt: encode(columns, records if fmt == FORMAT_RECORDS else rows, fmt) for fmt in formats}
+        self.etags = {fmt: make_etag(body) for fmt, body in self.bodies.items()}
+        self.loaded_at = time.monotonic()
+
+
+class DimensionRegistry:
+    """Snapshots by endpoint; ``load`` swaps whole snapshots in, so readers need no lock."""
+
+    def __init__(self, tables: dict):
+        self.tables = tables
+        self._snapshots = {}
+        self._ready = asyncio.Event()
+        self._stats = {"loads": 0, "version_checks": 0, "load_errors": 0, "last_load_seconds": 0.0}
+
+    def get(self, endpoint: str):
+        return self._snapshots.get(endpoint)
+
+    async def versions(self) -> dict:
+        tables = sorted({table for table, _ in self.tables.values()})
+        async with connection() as db:
+            cur = db.cursor()
+            await cur.execute(VERSION_SQL, (tables,))
+            rows = await cur.fetchall()
+            await cur.close()
+        self._stats["version_checks"] += 1
+        return {name: (filenode, changes) for name, filenode, changes in rows}
+
+    async def load(self, force: bool = False) -> list:
+        """Reload the endpoints whose table changed; returns the endpoints reloaded."""
+        versions = await self.versions()
+        now = time.monotonic()
+        reloaded = []
+        for endpoint, (table, query) in self.tables.items():
+            current = self._snapshots.get(endpoint)
+            version = versions.get(table)
+            if (not force and current is not None and current.version == version
+                    and now - current.loaded_at < DIMENSION_MAX_AGE):
+                continue
+            started = time.perf_counter()
+            try:
+                columns, rows = await fetch_rows(query, None, FORMAT_COLUMNAR)
+            except Exception as e:
+                self._stats["load_errors"] += 1
+                logger.warning("Dimension load failed for %s: %s", endpoint, e)
+                continue
+            self._snapshots = {**self._snapshots, endpoint: DimensionSnapshot(version, columns, rows)}
+            self._stats["loads"] += 1
+            self._stats["last_load_seconds"] = time.perf_counter() - started
+            reloaded.append(endpoint)
+        # Ready once every list has been tried, even if a table was missing.
+        self._ready.set()
+        return reloaded
+
+    async def wait_ready(self, timeout: float = DIMENSION_STARTUP_WAIT) -> bool:
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def watch(self, interval: float = DIMENSION_REFRESH_INTERVAL):
+        while True:
+            try:
+                reloaded = await self.load()
+                if reloaded:
+                    logger.info("Dimension lists loaded: %s", ", ".join(reloaded))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Dimension version check failed, retrying: %s", e)
+            await asyncio.sleep(interval if self._ready.is_set() else min(interval, 5))
+
+    def get_stats(self) -> dict:
+        stats = dict(self._stats)
+        stats.update(
+            snapshots=len(self._snapshots),
+            bytes=sum(len(body) for snapshot in self._snapshots.values() for body in snapshot.bodies.values()),
+        )
+        return stats
+
+
+dimension_registry = DimensionRegistry(DIMENSION_TABLES)
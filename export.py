@@ -0,0 +1,197 @@
+import asyncio
+import csv
+import io
+import logging
+import os
+import uuid
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from db import connection
+from serialization import JsonNumericLoader, dumps, pa
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Each running export pins a pooled connection for its whole duration.
+_export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+
+async def stream_batches(request: Request, query: str, params=None):
+    """Yield ``(description, rows)`` batches from a server-side cursor.
+
+    Only one batch is held in memory at a time, and the next one is not
+    fetched until the previous one has been handed to the client. The
+    stream stops early once the client disconnects.
+    """
+    async with connection() as db:
+        async with db.transaction():
+            cur = db.cursor(name=f"export_{uuid.uuid4().hex}")
+            cur.adapters.register_loader("numeric", JsonNumericLoader)
+            await cur.execute(query, params)
+            description = cur.description
+            # The first batch is yielded even when empty so headers still go out.
+            rows = await cur.fetchmany(EXPORT_BATCH_SIZE)
+            yield description, rows
+            while rows:
+                if await request.is_disconnected():
+                    logger.info("Export cancelled: client disconnected")
+                    break
+                rows = await cur.fetchmany(EXPORT_BATCH_SIZE)
+                if rows:
+                    yield description, rows
+            await cur.close()
+
+
+async def encode_csv(batches):
+    header_written = False
+    async for description, rows in batches:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not header_written:
+            writer.writerow([column.name for column in description])
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def encode_ndjson(batches):
+    async for description, rows in batches:
+        columns = [column.name for column in description]
+        yield b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+
+class _Drain(io.RawIOBase):
+    # Write-only file object the Parquet writer flushes row groups into; the
+    # stream takes the bytes out after every batch.
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+_ARROW_TYPES_BY_OID = {
+    16: "bool_", 20: "int64", 21: "int64", 23: "int64",
+    700: "float64", 701: "float64", 1700: "float64",
+    1082: "date32",
+}
+
+
+def _arrow_schema(description):
+    fields = []
+    for column in description:
+        if column.type_code == 1114:
+            arrow_type = pa.timestamp("us")
+        elif column.type_code == 1184:
+            arrow_type = pa.timestamp("us", tz="UTC")
+        else:
+            arrow_type = getattr(pa, _ARROW_TYPES_BY_OID.get(column.type_code, "string"))()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+async def encode_parquet(batches):
+    import pyarrow.parquet as pq
+
+    drain = _Drain()
+    writer = None
+    try:
+        async for description, rows in batches:
+            if writer is None:
+                schema = _arrow_schema(description)
+                writer = pq.ParquetWriter(drain, schema)
+            if not rows:
+                continue
+            columns = list(zip(*rows))
+            arrays = []
+            for field, values in zip(schema, columns):
+                if pa.types.is_string(field.type):
+                    values = [None if v is None else str(v) for v in values]
+                arrays.append(pa.array(values, type=field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield drain.take()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield drain.take()
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson, "parquet": encode_parquet}
+
+
+class ExportResponse(StreamingResponse):
+    """Streams a primed export and gives its slot back however the response ends.
+
+    The slot and the cursor are released around the whole response, not in
+    the body generator, which never runs if the client is gone before the
+    response starts.
+    """
+
+    def __init__(self, chunks, first: bytes, **kwargs):
+        self.chunks = chunks
+        super().__init__(self.stream(first), **kwargs)
+
+    async def stream(self, first: bytes):
+        yield first
+        async for chunk in self.chunks:
+            if chunk:
+                yield chunk
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                await self.body_iterator.aclose()
+                await self.chunks.aclose()
+            finally:
+                _export_slots.release()
+
+
+async def export_stream(request: Request, query: str, params, fmt: str, headers=None) -> ExportResponse:
+    """Return the export response, primed with the first chunk.
+
+    Priming runs the query before the response starts, so a slot shortage or
+    a failing query still becomes a proper HTTP error instead of a truncated
+    200 body.
+    """
+    if fmt == "parquet" and pa is None:
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow on the server.")
+    if _export_slots.locked():
+        raise HTTPException(status_code=429, detail="Too many exports running, please retry.")
+    await _export_slots.acquire()
+    chunks = ENCODERS[fmt](stream_batches(request, query, params))
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except BaseException:
+        _export_slots.release()
+        await chunks.aclose()
+        raise
+    return ExportResponse(chunks, first, media_type=EXPORT_FORMATS[fmt], headers=headers)
@@ -0,0 +1,116 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+import jwt
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_JWKS_URL = os.getenv("GOOGLE_JWKS_URL", "https://www.googleapis.com/oauth2/v3/certs")
+GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+JWKS_DEFAULT_TTL = float(os.getenv("JWKS_DEFAULT_TTL", "3600"))
+JWKS_MIN_REFRESH = float(os.getenv("JWKS_MIN_REFRESH", "60"))  # floor between refetches for unknown key ids
+VERIFIED_TOKEN_TTL = float(os.getenv("VERIFIED_TOKEN_TTL", "300"))
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "10000"))
+
+
+def max_age(response: httpx.Response, default: float) -> float:
+    match = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+    if not match:
+        return default
+    age = int(response.headers.get("age", "0") or 0)
+    return max(int(match.group(1)) - age, 0)
+
+
+class GoogleTokenVerifier:
+    """Verify Google ID tokens locally against Google's published JWKS.
+
+    Signing keys are cached for as long as the JWKS response's Cache-Control
+    allows, and successfully verified tokens are remembered by hash for a few
+    minutes (never past their ``exp``), so repeat logins skip the signature
+    check too.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, client_id: Optional[str], jwks_url: str = GOOGLE_JWKS_URL):
+        self.client = client
+        self.client_id = client_id
+        self.jwks_url = jwks_url
+        self._keys = {}
+        self._keys_expire_at = 0.0
+        self._keys_fetched_at = 0.0
+        self._keys_lock = asyncio.Lock()
+        self._verified = OrderedDict()  # sha256(token) -> (expires_at, email)
+
+    async def verify(self, token: str) -> Optional[str]:
+        """Return the token's email if it is a valid ID token for our client, else None."""
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        cached = self._verified.get(digest)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            key = await self._key_for(kid)
+            if key is None:
+                return None
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=["RS256"],
+                audience=self.client_id,
+                issuer=GOOGLE_ISSUERS,
+                options={"require": ["exp", "iss", "aud"]},
+            )
+        except (jwt.PyJWTError, httpx.HTTPError, ValueError) as e:
+            logger.debug("Google token rejected: %s", e)
+            return None
+        if claims.get("email_verified") in (False, "false"):
+            logger.debug("Google token rejected: email not verified")
+            return None
+
+        email = claims.get("email")
+        if email:
+            self._verified[digest] = (min(now + VERIFIED_TOKEN_TTL, claims["exp"]), email)
+            if len(self._verified) > VERIFIED_TOKEN_CACHE_SIZE:
+                self._verified.popitem(last=False)
+        return email
+
+    async def _key_for(self, kid: Optional[str]):
+        if time.time() >= self._keys_expire_at or kid not in self._keys:
+            async with self._keys_lock:
+                now = time.time()
+                expired = now >= self._keys_expire_at
+                # Unknown kid usually means Google rotated keys; refetch, but
+                # not more often than JWKS_MIN_REFRESH so junk tokens can't
+                # turn every login into a JWKS download.
+                rotated = kid not in self._keys and now - self._keys_fetched_at >= JWKS_MIN_REFRESH
+                if expired or rotated:
+                    try:
+                        await self._fetch_keys()
+                    except httpx.HTTPError as e:
+                        if not self._keys:
+                            raise
+                        # Keep verifying with the keys we have and retry later.
+                        logger.warning("JWKS refresh failed, using cached keys: %s", e)
+                        self._keys_fetched_at = now
+                        self._keys_expire_at = now + JWKS_MIN_REFRESH
+        return self._keys.get(kid)
+
+    async def _fetch_keys(self):
+        response = await self.client.get(self.jwks_url)
+        response.raise_for_status()
+        keys = {}
+        for data in response.json().get("keys", []):
+            if data.get("kid"):
+                keys[data["kid"]] = jwt.PyJWK(data).key
+        now = time.time()
+        self._keys = keys
+        self._keys_fetched_at = now
+        self._keys_expire_at = now + max_age(response, JWKS_DEFAULT_TTL)
@@ -0,0 +1,366 @@
+"""KPIs, top-N, breakdowns and time series computed from a cached columnar frame.
+
+A frame is one source (/api/data's star schema or /api/ppdata's orders)
+aggregated to day x product x store grain for one set of persona filters and
+held as NumPy arrays, a small star schema in memory: dates sorted ascending,
+product and store keys as int32 indexes into lookup tables, measures as
+float64, and each dimension attribute (category, city, ...) dictionary
+encoded per lookup row. The facts come through COPY (from the rollups when
+they are ready) and are parsed with np.loadtxt, which is several times faster
+than fetching a million rows as Python tuples.
+
+Date ranges are binary searches on the sorted dates, drill-down filters are
+masks gathered from the lookup tables and every aggregate is a bincount, so
+drilling down never goes back to Postgres. Frames live in ``frame_cache``
+until they expire or the rollups / persona rules change.
+"""
+import io
+import os
+import time
+from datetime import date, timedelta
+from typing import List, Optional
+
+import numpy as np
+from fastapi import HTTPException, Query
+
+from cache import ResultCache
+from db import connection
+from queries import ORDERS_SCHEMA, STAR_SCHEMA, build_data_query
+from rollups import route_schema
+from serialization import FORMAT_COLUMNAR, fetch_rows
+from shared import shared_store
+
+KPI_FRAME_TTL = float(os.getenv("KPI_FRAME_TTL", "300"))
+KPI_FRAME_MAX_ENTRIES = int(os.getenv("KPI_FRAME_MAX_ENTRIES", "32"))
+KPI_FRAME_MAX_BYTES = int(os.getenv("KPI_FRAME_MAX_BYTES", str(512 * 1024 * 1024)))
+KPI_DEFAULT_DAYS = int(os.getenv("KPI_DEFAULT_DAYS", "30"))
+KPI_TOP_MAX = 100
+
+DIMENSIONS = ["product_name", "category", "store_name", "city", "state"]
+MEASURES = ["units_sold", "revenue", "profit"]
+# Query-string filter -> frame dimension, as in the schemas in queries.py.
+FILTER_DIMENSIONS = {
+    "store": "store_name",
+    "city": "city",
+    "state": "state",
+    "product": "product_name",
+    "category": "category",
+}
+BUCKETS = ("day", "week", "month")
+
+# Per source: the key expressions the facts are grouped by, and the lookup
+# queries giving each key's attributes (key first, then DIMENSIONS columns).
+FRAME_SOURCES = {
+    "data": {
+        "schema": STAR_SCHEMA,
+        "keys": {"product": "p.product_id", "store": "s.store_id"},
+        "lookups": {
+            "product": "SELECT product_id, product_name, category FROM dim_product",
+            "store": "SELECT store_id, store_name, city, state FROM dim_store",
+        },
+    },
+    "ppdata": {
+        "schema": ORDERS_SCHEMA,
+        "keys": {"product": "p.SKU", "store": "s.id"},
+        "lookups": {
+            "product": "SELECT SKU, Name AS product_name, Category AS category FROM products",
+            "store": "SELECT id, id AS store_name, city, state FROM stores",
+        },
+    },
+}
+
+_EPOCH = date(1970, 1, 1)
+
+
+class Lookup:
+    """One dimension table: sorted key bytes plus per-row attribute codes."""
+
+    def __init__(self, columns, rows):
+        keys = np.array([str(row[0]).encode() for row in rows], dtype=bytes)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.attributes = {}
+        for position, name in enumerate(columns[1:], start=1):
+            index = {}
+            codes = np.fromiter((index.setdefault(row[position], len(index)) for row in rows), dtype=np.int32, count=len(rows))
+            self.attributes[name] = (codes[order], list(index))
+
+    @property
+    def key_width(self) -> int:
+        # One byte more than the longest key, so longer fact keys can't be
+        # truncated into a false match.
+        return (self.keys.dtype.itemsize if len(self.keys) else 0) + 1
+
+    def indexes(self, keys):
+        """Return ``(positions, found)`` of ``keys`` in this lookup."""
+        positions = np.searchsorted(self.keys, keys)
+        positions[positions >= len(self.keys)] = 0
+        found = self.keys[positions] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        return positions.astype(np.int32), found
+
+
+class Frame:
+    """Columnar copy of one source at day grain, sorted by date."""
+
+    def __init__(self, data: bytes, lookups: dict):
+        self.lookups = lookups
+        dtype = [("date", "i8")] + [(key, f"S{lookup.key_width}") for key, lookup in lookups.items()] + [
+            (name, "f8") for name in MEASURES
+        ]
+        if data:
+            facts = np.loadtxt(io.BytesIO(data), delimiter="\t", dtype=dtype, comments=None,
+                               quotechar=None, ndmin=1, encoding=None)
+        else:
+            facts = np.zeros(0, dtype=dtype)
+
+        keep = np.ones(len(facts), dtype=bool)
+        keys = {}
+        for key, lookup in lookups.items():
+            keys[key], found = lookup.indexes(facts[key])
+            # Keys added after the lookups were read; picked up on the next load.
+            keep &= found
+        order = np.argsort(facts["date"][keep], kind="stable")
+        self.dates = facts["date"][keep][order].astype("datetime64[D]")
+        self.keys = {key: codes[keep][order] for key, codes in keys.items()}
+        self.measures = {name: facts[name][keep][order] for name in MEASURES}
+        self.dimensions = {
+            name: (key, codes, labels)
+            for key, lookup in lookups.items()
+            for name, (codes, labels) in lookup.attributes.items()
+        }
+        self.rows = len(self.dates)
+        self.loaded_at = time.time()
+        self.nbytes = self.dates.nbytes + sum(codes.nbytes for codes in self.keys.values()) + sum(
+            values.nbytes for values in self.measures.values()
+        ) + sum(lookup.keys.nbytes for lookup in lookups.values())
+
+    def date_slice(self, date_from: date, date_to: date) -> slice:
+        start = np.searchsorted(self.dates, np.datetime64(date_from, "D"), side="left")
+        stop = np.searchsorted(self.dates, np.datetime64(date_to, "D"), side="right")
+        return slice(int(start), int(stop))
+
+    def codes(self, dimension: str, window: slice, mask):
+        """Row-level codes of ``dimension`` and its labels."""
+        key, codes, labels = self.dimensions[dimension]
+        rows = self.keys[key][window]
+        return codes[rows if mask is None else rows[mask]], labels
+
+    def filter_mask(self, window: slice, filters: dict):
+        """Boolean mask over ``window`` for the drill-down filters, or None for all rows."""
+        mask = None
+        for name, values in filters.items():
+            key, codes, labels = self.dimensions[FILTER_DIMENSIONS[name]]
+            wanted = [code for code, label in enumerate(labels) if str(label) in values]
+            matches = np.isin(codes, wanted)[self.keys[key][window]]
+            mask = matches if mask is None else mask & matches
+        return mask
+
+    def measure(self, name: str, window: slice, mask):
+        values = self.measures[name][window]
+        return values if mask is None else values[mask]
+
+    def totals(self, window: slice, mask) -> dict:
+        totals = {name: float(self.measure(name, window, mask).sum()) for name in MEASURES}
+        totals["rows"] = int(window.stop - window.start if mask is None else np.count_nonzero(mask))
+        return totals
+
+    def group(self, dimension: str, window: slice, mask):
+        """Return ``(labels, {measure: sums})`` for every value of ``dimension``."""
+        codes, labels = self.codes(dimension, window, mask)
+        sums = {
+            name: np.bincount(codes, weights=self.measure(name, window, mask), minlength=len(labels))
+            for name in MEASURES
+        }
+        return labels, sums
+
+    def series(self, bucket: str, window: slice, mask):
+        """Return ``(bucket start dates, {measure: sums})`` in date order."""
+        dates = self.dates[window] if mask is None else self.dates[window][mask]
+        if bucket == "month":
+            dates = dates.astype("datetime64[M]").astype("datetime64[D]")
+        elif bucket == "week":
+            # Epoch day 0 was a Thursday; shift so weeks start on Monday.
+            days = dates.astype(np.int64)
+            dates = ((days + 3) // 7 * 7 - 3).astype("datetime64[D]")
+        starts, codes = np.unique(dates, return_inverse=True)
+        sums = {
+            name: np.bincount(codes, weights=self.measure(name, window, mask), minlength=len(starts))
+            for name in MEASURES
+        }
+        return starts, sums
+
+    @property
+    def first_date(self) -> Optional[date]:
+        return self.dates[0].item() if self.rows else None
+
+    @property
+    def last_date(self) -> Optional[date]:
+        return self.dates[-1].item() if self.rows else None
+
+
+frame_cache = ResultCache(
+    ttl=KPI_FRAME_TTL,
+    max_entries=KPI_FRAME_MAX_ENTRIES,
+    max_bytes=KPI_FRAME_MAX_BYTES,
+    sizeof=lambda frame: frame.nbytes,
+    # Frames stay per worker; only invalidations are shared.
+    shared=shared_store,
+    namespace="kpi_frames",
+)
+
+
+def frame_query(source: dict, persona_filters):
+    """COPY statement and params for the source's facts at key grain."""
+    options = {
+        "date_from": None,
+        "date_to": None,
+        "filters": {},
+        "group_by": ["date"] + DIMENSIONS,
+        "limit": None,
+        "cursor": None,
+    }
+    schema = route_schema(source["schema"], options, persona_filters)
+    keys = {f"{key}_key": expr for key, expr in source["keys"].items()}
+    schema = {**schema, "dimensions": {**schema["dimensions"], **keys}}
+    query, params, _ = build_data_query(schema, {**options, "group_by": ["date"] + list(keys)}, persona_filters)
+    columns = [f"q.date::date - DATE '{_EPOCH}'"] + [f"q.{name}" for name in keys] + [
+        f"COALESCE(q.{name}, 0)" for name in MEASURES
+    ]
+    return f"COPY (SELECT {', '.join(columns)} FROM ({query}) q) TO STDOUT", params
+
+
+async def load_frame(source: dict, persona_filters, run_sync) -> Frame:
+    """Read the lookups and facts; ``run_sync`` runs the parsing off the event loop."""
+    lookups = {}
+    for key, sql in source["lookups"].items():
+        columns, rows = await fetch_rows(sql, None, FORMAT_COLUMNAR)
+        lookups[key] = await run_sync(Lookup, columns, rows)
+    statement, params = frame_query(source, persona_filters)
+    data = bytearray()
+    async with connection() as db:
+        cur = db.cursor()
+        async with cur.copy(statement, params) as copy:
+            async for chunk in copy:
+                data += chunk
+        await cur.close()
+    return await run_sync(Frame, bytes(data), lookups)
+
+
+def kpi_query_params(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    store: Optional[List[str]] = Query(None),
+    city: Optional[List[str]] = Query(None),
+    state: Optional[List[str]] = Query(None),
+    product: Optional[List[str]] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    top_by: str = "product_name",
+    top_measure: str = "revenue",
+    top: int = Query(10, ge=1, le=KPI_TOP_MAX),
+    breakdown_by: str = "category",
+    bucket: str = "day",
+) -> dict:
+    """Query-string options for /api/kpis."""
+    for value, allowed, name in (
+        (top_by, DIMENSIONS, "top_by"),
+        (breakdown_by, DIMENSIONS, "breakdown_by"),
+        (top_measure, MEASURES, "top_measure"),
+        (bucket, BUCKETS, "bucket"),
+    ):
+        if value not in allowed:
+            raise HTTPException(status_code=400, detail=f"{name} must be one of: {', '.join(allowed)}")
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from is after date_to")
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "filters": {
+            name: set(values)
+            for name, values in (("store", store), ("city", city), ("state", state),
+                                 ("product", product), ("category", category))
+            if values
+        },
+        "top_by": top_by,
+        "top_measure": top_measure,
+        "top": top,
+        "breakdown_by": breakdown_by,
+        "bucket": bucket,
+    }
+
+
+def year_earlier(day: date) -> date:
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:  # 29 February
+        return day.replace(year=day.year - 1, day=28)
+
+
+def change(current: dict, previous: dict) -> dict:
+    return {
+        name: (current[name] - previous[name]) / previous[name] if previous[name] else None
+        for name in MEASURES
+    }
+
+
+def with_margin(totals: dict) -> dict:
+    totals["margin"] = totals["profit"] / totals["revenue"] if totals["revenue"] else None
+    return totals
+
+
+def compute_kpis(frame: Frame, options: dict) -> dict:
+    date_from = options["date_from"]
+    # An open-ended range runs to the last loaded day, but never ends before it starts.
+    date_to = options["date_to"] or max(frame.last_date or date.today(), date_from or date.min)
+    date_from = date_from or date_to - timedelta(days=KPI_DEFAULT_DAYS - 1)
+    days = (date_to - date_from).days + 1
+    filters = options["filters"]
+
+    window = frame.date_slice(date_from, date_to)
+    mask = frame.filter_mask(window, filters)
+    totals = with_margin(frame.totals(window, mask))
+
+    comparisons = {}
+    for name, (start, end) in (
+        ("previous_period", (date_from - timedelta(days=days), date_from - timedelta(days=1))),
+        ("previous_year", (year_earlier(date_from), year_earlier(date_to))),
+    ):
+        earlier = frame.date_slice(start, end)
+        earlier_totals = with_margin(frame.totals(earlier, frame.filter_mask(earlier, filters)))
+        comparisons[name] = {"from": start, "to": end, "totals": earlier_totals, "change": change(totals, earlier_totals)}
+
+    labels, sums = frame.group(options["top_by"], window, mask)
+    present = np.flatnonzero(sums["units_sold"] != 0)
+    top = present[np.argsort(-sums[options["top_measure"]][present], kind="stable")[:options["top"]]]
+    top_rows = [
+        {options["top_by"]: labels[i], **{name: float(sums[name][i]) for name in MEASURES}}
+        for i in top.tolist()
+    ]
+
+    labels, sums = frame.group(options["breakdown_by"], window, mask)
+    breakdown = [
+        {
+            options["breakdown_by"]: labels[i],
+            **{name: float(sums[name][i]) for name in MEASURES},
+            "revenue_share": float(sums["revenue"][i] / totals["revenue"]) if totals["revenue"] else None,
+        }
+        for i in np.flatnonzero(sums["units_sold"] != 0).tolist()
+    ]
+    breakdown.sort(key=lambda row: row["revenue"], reverse=True)
+
+    starts, sums = frame.series(options["bucket"], window, mask)
+
+    return {
+        "period": {"from": date_from, "to": date_to, "days": days},
+        "filters": {name: sorted(values) for name, values in filters.items()},
+        "totals": totals,
+        **comparisons,
+        "top": {"by": options["top_by"], "measure": options["top_measure"], "rows": top_rows},
+        "breakdown": {"by": options["breakdown_by"], "rows": breakdown},
+        "series": {
+            "bucket": options["bucket"],
+            "date": starts.tolist(),
+            **{name: sums[name].tolist() for name in MEASURES},
+        },
+        "frame": {"rows": frame.rows, "first_date": frame.first_date, "last_date": frame.last_date,
+                  "loaded_at": frame.loaded_at},
+    }
@@ -1,23 +1,88 @@
+import asyncio
+import logging
 import os
-import psycopg2
-from fastapi import FastAPI, HTTPException, Depends, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from prometheus_client import REGISTRY
 from pydantic import BaseModel
+from starlette.datastructures import UploadFile
 import jwt
-from typing import Optional
-import smtplib
+from typing import List, Optional
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 import base64
+import hmac
 import re
-import requests
-
-app = FastAPI()
+import tempfile
+from datetime import datetime, timezone
+import httpx
+from attachments import EMAIL_MAX_ATTACHMENT_BYTES, limit_body, write_mime_message
+from cache import result_cache
+from db import get_db, pool
+from dimensions import DIMENSION_REGISTRY_ENABLED, DIMENSION_TABLES, dimension_registry
+from export import EXPORT_FORMATS, export_stream
+from google_auth import GoogleTokenVerifier
+from kpis import FRAME_SOURCES, compute_kpis, frame_cache, kpi_query_params, load_frame
+from metrics import ENCODE_SECONDS, MetricsMiddleware, StatsCollector, render_metrics
+from migrations import migrate_until_done, require_migrations
+from outbox import enqueue, enqueue_file, job_status, outbox_workers
+from personas import persona_index, watch_persona_rules
+from queries import ORDERS_SCHEMA, STAR_SCHEMA, build_data_query, data_query_params, next_cursor
+from responses import json_response, make_etag
+from rollups import ROLLUP_REFRESH_INTERVAL, ROLLUPS_ENABLED, refresh_periodically, refresh_rollups, route_schema
+from schedules import SUBSCRIPTION_KEY, next_run_after
+from serialization import MEDIA_TYPES, dumps, encode, fetch_rows, negotiate_format
+from session_auth import SessionTokenVerifier
+from shared import shared_store
+
+# Module loggers (logging.getLogger(__name__)) go through the root logger;
+# LOG_LEVEL=DEBUG adds per-request detail such as rejected tokens.
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+http_client = httpx.AsyncClient(timeout=httpx.Timeout(5.0))
+
+def invalidate_caches():
+    result_cache.invalidate()
+    frame_cache.invalidate()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await pool.open(wait=False)
+    migration_task = asyncio.create_task(migrate_until_done())
+    rollup_task = None
+    if ROLLUPS_ENABLED and ROLLUP_REFRESH_INTERVAL > 0:
+        rollup_task = asyncio.create_task(refresh_periodically(on_change=invalidate_caches))
+    persona_task = asyncio.create_task(watch_persona_rules(on_change=invalidate_caches))
+    dimension_task = None
+    if DIMENSION_REGISTRY_ENABLED:
+        dimension_task = asyncio.create_task(dimension_registry.watch())
+        # Start serving with the dimension lists in memory, unless the
+        # database is slow to answer; they are then served from queries.
+        if not await dimension_registry.wait_ready():
+            logger.warning("Dimension lists not loaded yet, serving them from the database")
+    outbox_workers.start()
+    yield
+    await outbox_workers.stop()
+    if dimension_task:
+        dimension_task.cancel()
+    persona_task.cancel()
+    migration_task.cancel()
+    if rollup_task:
+        rollup_task.cancel()
+    await http_client.aclose()
+    await pool.close()
+
+app = FastAPI(lifespan=lifespan)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -34,37 +99,97 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Cache", "X-Next-Cursor"],
 )
+app.add_middleware(MetricsMiddleware)
+REGISTRY.register(StatsCollector("result_cache", result_cache.get_stats))
+REGISTRY.register(StatsCollector("kpi_frame_cache", frame_cache.get_stats))
+REGISTRY.register(StatsCollector("dimension_registry", dimension_registry.get_stats))
 
 SECRET = os.getenv("SECRET", "CHANGE_ME")
-DATABASE_URL = os.getenv("DATABASE_URL")
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
-EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
-def get_db():
-    conn = psycopg2.connect(DATABASE_URL)
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-def get_persona_for_username(username: str, db_conn) -> Optional[str]:
-    cur = db_conn.cursor()
-    cur.execute("SELECT persona FROM persona_users WHERE username = %s", (username.lower(),))
-    row = cur.fetchone()
-    cur.close()
-    if row:
-        return row[0]
-    return None
-
-def get_current_user(token: str = Depends(oauth2_scheme)):
+google_verifier = GoogleTokenVerifier(http_client, GOOGLE_CLIENT_ID)
+session_verifier = SessionTokenVerifier(SECRET, shared=shared_store)
+REGISTRY.register(StatsCollector("session_tokens", session_verifier.get_stats))
+if shared_store is not None:
+    REGISTRY.register(StatsCollector("shared_store", shared_store.get_stats))
+
+async def get_persona_for_username(username: str) -> Optional[str]:
+    return await persona_index.persona_for(username)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        payload = jwt.decode(token, SECRET, algorithms=["HS256"])
-        return payload
+        return session_verifier.verify(token)
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def load_page(query: str, params, fmt: str, keys=None, limit=None):
+    columns, rows = await fetch_rows(query, params, fmt)
+    headers = {}
+    if keys and len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = next_cursor(rows[-1], columns, keys)
+    with ENCODE_SECONDS.labels(fmt).time():
+        body = encode(columns, rows, fmt)
+    # Kept with the cached entry so hits don't hash the body again.
+    headers["ETag"] = make_etag(body)
+    return body, headers
+
+async def query_response(request: Request, query: str, params=None, cache_key=None, keys=None, limit=None):
+    fmt = negotiate_format(request.headers.get("accept"))
+    load = lambda: load_page(query, params, fmt, keys, limit)
+    if cache_key is None:
+        body, headers = await load()
+    else:
+        (body, headers), hit = await result_cache.get_or_load(cache_key + (dumps(params), fmt), load)
+        headers = {**headers, "X-Cache": "HIT" if hit else "MISS"}
+    return json_response(request, body, headers, media_type=MEDIA_TYPES[fmt], etag=headers.get("ETag"))
+
+async def dimension_response(request: Request, endpoint: str):
+    snapshot = dimension_registry.get(endpoint)
+    if snapshot is None:
+        return await query_response(request, DIMENSION_TABLES[endpoint][1])
+    fmt = negotiate_format(request.headers.get("accept"))
+    return json_response(request, snapshot.bodies[fmt], {"X-Cache": "HIT"}, media_type=MEDIA_TYPES[fmt], etag=snapshot.etags[fmt])
+
+@app.get("/api/pool_stats")
+async def pool_stats(user=Depends(get_current_user)):
+    return pool.get_stats()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def require_metrics_token(authorization: Optional[str] = Header(None)):
+    # Scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>" when one is set.
+    if METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=403, detail="Metrics token required")
+
+@app.get("/metrics")
+async def prometheus_metrics(_=Depends(require_metrics_token)):
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+@app.post("/api/cache/invalidate")
+async def invalidate_cache(endpoint: Optional[str] = None, _=Depends(require_admin)):
+    # Called by the data load jobs once new facts have landed.
+    removed = result_cache.invalidate(endpoint) + frame_cache.invalidate(endpoint)
+    if DIMENSION_REGISTRY_ENABLED and (endpoint is None or endpoint in DIMENSION_TABLES):
+        await dimension_registry.load(force=True)
+    return {"invalidated": removed, "stats": result_cache.get_stats()}
+
+@app.post("/api/rollups/refresh")
+async def refresh_rollup_tables(_=Depends(require_admin)):
+    # Called by the data load jobs after new facts are committed.
+    results = await refresh_rollups()
+    if any(results.values()):
+        invalidate_caches()
+    return {"upserted": results}
+
 class EmailRequest(BaseModel):
     to: str
     message: str
@@ -72,8 +197,8 @@ class EmailRequest(BaseModel):
     pdf: Optional[str] = None    # PDF report as base64
     excel: Optional[str] = None  # Excel data as base64
 
-@app.post("/api/email_me")
-def email_me(request: EmailRequest, user=Depends(get_current_user)):
+@app.post("/api/email_me", status_code=202)
+async def email_me(request: EmailRequest, user=Depends(get_current_user), _=Depends(require_migrations)):
     recipient_email = request.to
     if not recipient_email or "@" not in recipient_email:
         raise HTTPException(status_code=400, detail="Valid recipient email is required.")
@@ -99,17 +224,15 @@ def email_me(request: EmailRequest, user=Depends(get_current_user)):
             part.add_header("Content-Disposition", f'attachment; filename="dashboard_chart.{ext}"')
             msg.attach(part)
             attachments_count += 1
-            print(f"Image attachment added successfully: dashboard_chart.{ext}")
+            logger.debug("Image attachment added: dashboard_chart.%s", ext)
         else:
-            print("Image field is not a valid data URL")
+            logger.warning("Image field is not a valid data URL")
 
     # Handle PDF attachment (base64 without data: prefix)
     if request.pdf:
         try:
-            # Debug: Check if PDF data exists and its length
-            print(f"PDF data received, length: {len(request.pdf) if request.pdf else 0}")
             pdf_data = base64.b64decode(request.pdf)
-            print(f"PDF decoded data size: {len(pdf_data)} bytes")
+            logger.debug("PDF data received: %d base64 chars, %d bytes decoded", len(request.pdf), len(pdf_data))
             
             part = MIMEBase("application", "octet-stream")
             part.set_payload(pdf_data)
@@ -121,17 +244,15 @@ def email_me(request: EmailRequest, user=Depends(get_current_user)):
             part.add_header("Content-Type", "application/pdf")
             msg.attach(part)
             attachments_count += 1
-            print("PDF attachment added successfully: dashboard_report.pdf")
+            logger.debug("PDF attachment added: dashboard_report.pdf")
         except Exception as e:
-            print(f"Failed to process PDF attachment: {e}")
+            logger.warning("Failed to process PDF attachment: %s", e)
 
     # Handle Excel attachment (base64 without data: prefix)
     if request.excel:
         try:
-            # Debug: Check if Excel data exists and its length
-            print(f"Excel data received, length: {len(request.excel) if request.excel else 0}")
             excel_data = base64.b64decode(request.excel)
-            print(f"Excel decoded data size: {len(excel_data)} bytes")
+            logger.debug("Excel data received: %d base64 chars, %d bytes decoded", len(request.excel), len(excel_data))
             
             part = MIMEBase("application", "octet-stream")
             part.set_payload(excel_data)
@@ -143,220 +264,269 @@ def email_me(request: EmailRequest, user=Depends(get_current_user)):
             part.add_header("Content-Type", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
             msg.attach(part)
             attachments_count += 1
-            print("Excel attachment added successfully: dashboard_data.xlsx")
+            logger.debug("Excel attachment added: dashboard_data.xlsx")
         except Exception as e:
-            print(f"Failed to process Excel attachment: {e}")
-
-    print(f"Total attachments prepared: {attachments_count}")
-
+            logger.warning("Failed to process Excel attachment: %s", e)
+
+    logger.debug("Total attachments prepared: %d", attachments_count)
+
+    job_id = await enqueue(EMAIL_ADDRESS, [recipient_email], msg.as_bytes(), requested_by=user.get("sub"))
+    logger.info("Email job %s queued", job_id)
+
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "message": f"Email queued with {attachments_count} attachments",
+    }
+
+@app.post("/api/email_me/upload", status_code=202)
+async def email_me_upload(request: Request, user=Depends(get_current_user), _=Depends(require_migrations)):
+    # Multipart variant of email_me: fields "to" and "message", optional files
+    # "image", "pdf" and "excel". Files are spooled to disk and the message is
+    # built and queued by streaming from there.
+    form = await limit_body(request).form(max_files=3, max_fields=5)
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            smtp.sendmail(EMAIL_ADDRESS, [recipient_email], msg.as_string())
-            print("Email sent successfully with all attachments")
-    except Exception as e:
-        print(f"Email sending failed: {e}")
-        raise HTTPException(status_code=500, detail="Failed to send email.")
-
-    return {"success": True, "message": f"Email sent successfully with {attachments_count} attachments"}
+        recipient_email = form.get("to")
+        if not isinstance(recipient_email, str) or "@" not in recipient_email or "\n" in recipient_email or "\r" in recipient_email:
+            raise HTTPException(status_code=400, detail="Valid recipient email is required.")
+        message = form.get("message")
+        message = message if isinstance(message, str) else ""
+
+        attachments = []
+        for field, (maintype, subtype, filename) in (
+            ("image", ("image", None, "dashboard_chart")),
+            ("pdf", ("application", "pdf", "dashboard_report.pdf")),
+            ("excel", ("application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet", "dashboard_data.xlsx")),
+        ):
+            upload = form.get(field)
+            if not isinstance(upload, UploadFile):
+                continue
+            if upload.size is not None and upload.size > EMAIL_MAX_ATTACHMENT_BYTES:
+                raise HTTPException(status_code=413, detail=f"{field} exceeds {EMAIL_MAX_ATTACHMENT_BYTES} bytes.")
+            if field == "image":
+                match = re.fullmatch(r"image/(?P<ext>\w+)", upload.content_type or "")
+                if not match:
+                    logger.warning("Image upload is not an image content type")
+                    continue
+                subtype = match.group("ext")
+                filename = f"{filename}.{subtype}"
+            attachments.append((maintype, subtype, filename, upload.file))
+            logger.debug("Attachment received: %s, %s bytes", filename, upload.size)
+
+        with tempfile.TemporaryFile() as message_file:
+            await run_in_threadpool(
+                write_mime_message, message_file, EMAIL_ADDRESS, recipient_email,
+                "Message from BI Dashboard", message, attachments,
+            )
+            job_id = await enqueue_file(EMAIL_ADDRESS, [recipient_email], message_file, requested_by=user.get("sub"))
+    finally:
+        await form.close()
+    logger.info("Email job %s queued", job_id)
+
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "message": f"Email queued with {len(attachments)} attachments",
+    }
+
+@app.get("/api/email_jobs/{job_id}")
+async def email_job_status(job_id: int, user=Depends(get_current_user), _=Depends(require_migrations)):
+    job = await job_status(job_id)
+    if not job or job.pop("requested_by") != user.get("sub"):
+        raise HTTPException(status_code=404, detail="Email job not found")
+    return job
 
 class User(BaseModel):
     username: Optional[str] = None
     password: Optional[str] = None
     credential: Optional[str] = None
 
-def verify_google_token(token: str) -> Optional[str]:
-    try:
-        response = requests.get("https://oauth2.googleapis.com/tokeninfo", params={"id_token": token})
-        data = response.json()
-        if response.status_code == 200 and data.get("aud") == GOOGLE_CLIENT_ID:
-            return data.get("email")
-    except Exception:
-        pass
-    return None
+async def verify_google_token(token: str) -> Optional[str]:
+    return await google_verifier.verify(token)
 
 @app.post("/api/login")
-async def login(user: User, db=Depends(get_db)):
+async def login(user: User):
     # 1. Traditional username/password login
     if user.username and user.password:
-        persona = get_persona_for_username(user.username, db)
+        persona = await get_persona_for_username(user.username)
         if persona and user.password == "password":
             token = jwt.encode({"sub": user.username, "persona": persona}, SECRET, algorithm="HS256")
             return {"access_token": token}
         raise HTTPException(status_code=401, detail="Auth failed")
     # 2. Google OAuth credential login
     if user.credential:
-        user_email = verify_google_token(user.credential)
+        user_email = await verify_google_token(user.credential)
         if not user_email:
             raise HTTPException(status_code=401, detail="Invalid Google token")
         persona = None
         # Optionally map persona for Google users (by prefix, domain, etc.)
-        persona = get_persona_for_username(user_email.split('@')[0], db)
+        persona = await get_persona_for_username(user_email.split('@')[0])
         token = jwt.encode({"sub": user_email, "persona": persona}, SECRET, algorithm="HS256")
         return {"access_token": token}
     raise HTTPException(status_code=400, detail="Missing login payload")
 
 @app.get("/api/data")
-def get_data(user=Depends(get_current_user), db=Depends(get_db)):
+async def get_data(request: Request, options=Depends(data_query_params), user=Depends(get_current_user)):
     persona = user.get("persona")
-    cur = db.cursor()
-    persona_filter = ""
-    if persona == "Srini":
-        persona_filter = "WHERE s.city = 'New York'"
-    elif persona == "Venkat":
-        persona_filter = "WHERE s.city = 'San Francisco'"
-    query = f"""
-        SELECT
-            d.date,
-            p.product_name,
-            p.category,
-            s.store_name,
-            s.city,
-            c.customer_name,
-            SUM(f.units_sold) AS units_sold,
-            SUM(f.revenue) AS revenue,
-            SUM(f.profit) AS profit
-        FROM fact_sales f
-        JOIN dim_date d ON f.date_id = d.date_id
-        JOIN dim_product p ON f.product_id = p.product_id
-        JOIN dim_customer c ON f.customer_id = c.customer_id
-        JOIN dim_store s ON f.store_id = s.store_id
-        {persona_filter}
-        GROUP BY d.date, p.product_name, p.category, s.store_name, s.city, c.customer_name
-        ORDER BY d.date DESC, p.product_name
-        LIMIT 100
-    """
-    cur.execute(query)
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    data = [dict(zip(columns, row)) for row in rows]
-    cur.close()
-    json_compatible_data = jsonable_encoder(data)
-    return JSONResponse(content=json_compatible_data)
+    persona_filters = await persona_index.filters_for(persona, "data")
+    schema = route_schema(STAR_SCHEMA, options, persona_filters)
+    query, params, keys = build_data_query(schema, options, persona_filters)
+    return await query_response(request, query, params, cache_key=("/api/data", persona), keys=keys, limit=options["limit"])
+
+EXPORT_SOURCES = {"data": STAR_SCHEMA, "ppdata": ORDERS_SCHEMA}
+
+@app.get("/api/export")
+async def export_data(
+    request: Request,
+    source: str = "data",
+    format: str = "csv",
+    options=Depends(data_query_params),
+    user=Depends(get_current_user),
+):
+    if source not in EXPORT_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {source}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    options = {**options, "limit": None, "cursor": None}
+    persona_filters = await persona_index.filters_for(user.get("persona"), source)
+    schema = route_schema(EXPORT_SOURCES[source], options, persona_filters)
+    query, params, _ = build_data_query(schema, options, persona_filters)
+    filename = f"{source}_export.{format}"
+    return await export_stream(
+        request, query, params, format,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/api/kpis")
+async def get_kpis(request: Request, source: str = "data", options=Depends(kpi_query_params), user=Depends(get_current_user)):
+    # Totals, period-over-period and year-over-year changes, top-N, breakdown
+    # and a time series for the persona's slice of ``source``. Drill-down
+    # filters are applied to the cached frame, not in Postgres.
+    if source not in FRAME_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {source}")
+    persona_filters = await persona_index.filters_for(user.get("persona"), source)
+    frame, hit = await frame_cache.get_or_load(
+        ("/api/kpis", source, dumps(persona_filters)),
+        lambda: load_frame(FRAME_SOURCES[source], persona_filters, run_in_threadpool),
+    )
+    result = await run_in_threadpool(compute_kpis, frame, options)
+    body = dumps({"source": source, **result})
+    return json_response(request, body, {"X-Cache": "HIT" if hit else "MISS"})
 
 @app.get("/api/products")
-def get_products(db=Depends(get_db)):
-    cur = db.cursor()
-    cur.execute("SELECT product_id, product_name, category, brand FROM dim_product ORDER BY product_name")
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    data = [dict(zip(columns, row)) for row in rows]
-    cur.close()
-    json_compatible_data = jsonable_encoder(data)
-    return JSONResponse(content=json_compatible_data)
+async def get_products(request: Request):
+    return await dimension_response(request, "/api/products")
 
 @app.get("/api/stores")
-def get_stores(db=Depends(get_db)):
-    cur = db.cursor()
-    cur.execute("SELECT store_id, store_name, city, state FROM dim_store ORDER BY store_name")
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    data = [dict(zip(columns, row)) for row in rows]
-    cur.close()
-    json_compatible_data = jsonable_encoder(data)
-    return JSONResponse(content=json_compatible_data)
+async def get_stores(request: Request):
+    return await dimension_response(request, "/api/stores")
 
 @app.get("/api/ppdata")
-def get_data(user=Depends(get_current_user), db=Depends(get_db)):
+async def get_data(request: Request, options=Depends(data_query_params), user=Depends(get_current_user)):
     persona = user.get("persona")
-    cur = db.cursor()
-    persona_filter = ""
-    if persona == "Srini":
-        persona_filter = "WHERE s.state = 'California'"
-    elif persona == "Venkat":
-        persona_filter = "WHERE s.state = 'Nevada'"
-    query = f"""
-        SELECT
-            o.orderDate AS date,
-            p.SKU AS product_id,
-            p.Name AS product_name,
-            p.Category AS category,
-            s.id AS store_name,
-            s.city,
-            o.customerId AS customer_name,
-            COUNT(oi.SKU) AS units_sold,
-            SUM(p.Price) AS revenue,
-            SUM(p.Price * 0.3) AS profit  -- Assuming 30% profit margin
-        FROM orders o
-        JOIN order_items oi ON o.id = oi.orderID
-        JOIN products p ON oi.SKU = p.SKU
-        JOIN stores s ON o.storeId = s.id
-        JOIN customers c ON o.customerId = c.id  -- Optional if you want to enrich customer info
-        {persona_filter} -- Optional filter placeholder
-        GROUP BY o.orderDate, p.SKU, p.Name, p.Category, s.id, s.city, o.customerId
-        ORDER BY o.orderDate DESC, p.Name
-        LIMIT 100;
-    """
-    cur.execute(query)
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    data = [dict(zip(columns, row)) for row in rows]
-    cur.close()
-    json_compatible_data = jsonable_encoder(data)
-    return JSONResponse(content=json_compatible_data)
+    persona_filters = await persona_index.filters_for(persona, "ppdata")
+    schema = route_schema(ORDERS_SCHEMA, options, persona_filters)
+    query, params, keys = build_data_query(schema, options, persona_filters)
+    return await query_response(request, query, params, cache_key=("/api/ppdata", persona), keys=keys, limit=options["limit"])
 
 @app.get("/api/ppproducts")
-def get_products(db=Depends(get_db)):
-    cur = db.cursor()
-    cur.execute("SELECT SKU AS product_id, Name AS product_name, Category, Size as brand FROM products ORDER BY Name")
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    data = [dict(zip(columns, row)) for row in rows]
-    cur.close()
-    json_compatible_data = jsonable_encoder(data)
-    return JSONResponse(content=json_compatible_data)
+async def get_products(request: Request):
+    return await dimension_response(request, "/api/ppproducts")
 
 @app.get("/api/ppstores")
-def get_stores(db=Depends(get_db)):
-    cur = db.cursor()
-    cur.execute("SELECT id AS store_id, id AS store_name, city, state FROM stores ORDER BY id")
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    data = [dict(zip(columns, row)) for row in rows]
-    cur.close()
-    json_compatible_data = jsonable_encoder(data)
-    return JSONResponse(content=json_compatible_data)
+async def get_stores(request: Request):
+    return await dimension_response(request, "/api/ppstores")
 class ScheduleRequest(BaseModel):
     repeatFrequency: str
     scheduledTime: str
     reportFormat: str
     email: str
+    timezone: str = "UTC"
+
+SUBSCRIPTION_COLUMNS = "id, email, repeat_frequency, scheduled_time, report_format, timezone, next_run_at"
+SUBSCRIPTIONS_BULK_MAX = int(os.getenv("SUBSCRIPTIONS_BULK_MAX", "500"))
+
+def schedule_next_run(request: ScheduleRequest, now: datetime) -> datetime:
+    try:
+        return next_run_after(request.repeatFrequency, request.scheduledTime, request.timezone, now)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/api/schedule_report")
-def schedule_report(request: ScheduleRequest, user=Depends(get_current_user), db=Depends(get_db)):
-    email = user.get("sub")
+async def schedule_report(request: ScheduleRequest, user=Depends(get_current_user), _=Depends(require_migrations), db=Depends(get_db)):
+    next_run_at = schedule_next_run(request, datetime.now(timezone.utc))
     cur = db.cursor()
-
-    # Ensure the subscriptions table exists
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            id SERIAL PRIMARY KEY,
-            email TEXT NOT NULL,
-            repeat_frequency TEXT NOT NULL,
-            scheduled_time TEXT NOT NULL,
-            report_format TEXT NOT NULL
-        )
-    """)
-    db.commit()
-
-    # Check if a matching subscription already exists
-    cur.execute("""
-        SELECT 1 FROM subscriptions
-        WHERE email = %s AND repeat_frequency = %s AND scheduled_time = %s AND report_format = %s
-    """, (request.email, request.repeatFrequency, request.scheduledTime, request.reportFormat))
-
-    if cur.fetchone():
-        cur.close()
+    # The unique index on SUBSCRIPTION_KEY makes duplicate requests, even
+    # concurrent ones, a no-op.
+    await cur.execute(f"""
+        INSERT INTO subscriptions (created_by, email, repeat_frequency, scheduled_time, report_format, timezone, next_run_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT ({", ".join(SUBSCRIPTION_KEY)}) DO NOTHING
+        RETURNING id
+    """, (user.get("sub"), request.email, request.repeatFrequency, request.scheduledTime, request.reportFormat, request.timezone, next_run_at))
+    created = await cur.fetchone()
+    await cur.close()
+
+    if not created:
         return {"message": "Subscription already exists."}
+    return {"message": "Subscription created successfully.", "id": created[0]}
 
-    # Insert new subscription
-    cur.execute("""
-        INSERT INTO subscriptions (email, repeat_frequency, scheduled_time, report_format)
-        VALUES (%s, %s, %s, %s)
-    """, (request.email, request.repeatFrequency, request.scheduledTime, request.reportFormat))
-    db.commit()
-    cur.close()
-
-    return {"message": "Subscription created successfully."}
+@app.get("/api/subscriptions")
+async def list_subscriptions(user=Depends(get_current_user), _=Depends(require_migrations), db=Depends(get_db)):
+    cur = db.cursor()
+    await cur.execute(f"SELECT {SUBSCRIPTION_COLUMNS} FROM subscriptions WHERE created_by = %s ORDER BY id", (user.get("sub"),))
+    columns = [desc[0] for desc in cur.description]
+    rows = await cur.fetchall()
+    await cur.close()
+    return [dict(zip(columns, row)) for row in rows]
+
+class BulkSubscriptionsRequest(BaseModel):
+    create: List[ScheduleRequest] = []
+    delete: List[int] = []
+
+@app.post("/api/subscriptions/bulk")
+async def bulk_subscriptions(request: BulkSubscriptionsRequest, user=Depends(get_current_user), _=Depends(require_migrations), db=Depends(get_db)):
+    # Creates and deletes many subscriptions in one transaction and one
+    # statement each. Deletes only touch the caller's own subscriptions.
+    if len(request.create) + len(request.delete) > SUBSCRIPTIONS_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {SUBSCRIPTIONS_BULK_MAX} items per request.")
+    now = datetime.now(timezone.utc)
+    next_runs = [schedule_next_run(item, now) for item in request.create]
+
+    created, deleted = [], []
+    async with db.transaction():
+        cur = db.cursor()
+        if request.delete:
+            await cur.execute(
+                "DELETE FROM subscriptions WHERE id = ANY(%s) AND created_by = %s RETURNING id",
+                (request.delete, user.get("sub")),
+            )
+            deleted = [row[0] for row in await cur.fetchall()]
+        if request.create:
+            await cur.execute(f"""
+                INSERT INTO subscriptions (created_by, email, repeat_frequency, scheduled_time, report_format, timezone, next_run_at)
+                SELECT %s, * FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::timestamptz[])
+                ON CONFLICT ({", ".join(SUBSCRIPTION_KEY)}) DO NOTHING
+                RETURNING {SUBSCRIPTION_COLUMNS}
+            """, (
+                user.get("sub"),
+                [item.email for item in request.create],
+                [item.repeatFrequency for item in request.create],
+                [item.scheduledTime for item in request.create],
+                [item.reportFormat for item in request.create],
+                [item.timezone for item in request.create],
+                next_runs,
+            ))
+            columns = [desc[0] for desc in cur.description]
+            created = [dict(zip(columns, row)) for row in await cur.fetchall()]
+        await cur.close()
+
+    return {
+        "created": created,
+        "existing": len(request.create) - len(created),
+        "deleted": deleted,
+    }
 
 # Updated email functionality to handle multiple attachment types
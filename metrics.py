@@ -0,0 +1,226 @@
+"""Prometheus metrics for the API.
+
+MetricsMiddleware records per-route request latency. The pool's connections
+use TimedCursor / TimedServerCursor, which time execute and fetch calls per
+query and count rows; a query is labelled with the route that ran it (or
+"background") and a short statement name such as "select fact_sales", or the
+name given with ``named_query``. Queries slower than SLOW_QUERY_SECONDS are
+logged. Pool waits, serialization and SMTP time are recorded too, pool and
+result cache statistics are read at scrape time, and /metrics renders
+everything in the Prometheus text format.
+
+Under serve.py with several workers PROMETHEUS_MULTIPROC_DIR is set, counters
+and histograms are summed over all workers, and the statistics gauges are
+those of the worker answering the scrape.
+"""
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from psycopg import AsyncCursor, AsyncServerCursor
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "1.0"))
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ["method", "route", "status"],
+)
+QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Time in cursor calls by query and phase.", ["route", "query", "phase"],
+)
+QUERY_ROWS = Counter("db_query_rows_total", "Rows fetched by query.", ["route", "query"])
+SLOW_QUERIES = Counter("db_slow_queries_total", "Executions slower than SLOW_QUERY_SECONDS.", ["route", "query"])
+POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time waiting for a pooled connection.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+ENCODE_SECONDS = Histogram("response_encode_seconds", "Time serializing query results.", ["format"])
+SMTP_SEND_SECONDS = Histogram("smtp_send_duration_seconds", "Time per SMTP send, including reconnects.")
+EMAIL_JOBS = Counter("email_jobs_total", "Outbox delivery attempts by outcome.", ["outcome"])
+
+_request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+_query_name: ContextVar[Optional[str]] = ContextVar("query_name", default=None)
+
+_STATEMENT = re.compile(
+    r"^\s*(?:WITH\b.*?\)\s*)?(SELECT|INSERT|UPDATE|DELETE|COPY|CREATE|ALTER|DROP|LISTEN)\b"
+    r"(?:.*?\b(?:FROM|INTO|UPDATE|TABLE|JOIN)\s+([\w.]+))?",
+    re.IGNORECASE | re.DOTALL,
+)
+_statement_names = {}
+
+
+def statement_name(query) -> str:
+    """``"select fact_sales"`` style name: verb plus the first table mentioned."""
+    if not isinstance(query, str):
+        return "composed"
+    name = _statement_names.get(query)
+    if name is None:
+        match = _STATEMENT.match(query)
+        if match:
+            verb, table = match.group(1).lower(), match.group(2)
+            name = f"{verb} {table.lower()}" if table else verb
+        else:
+            name = "other"
+        if len(_statement_names) < 10000:
+            _statement_names[query] = name
+    return name
+
+
+@contextmanager
+def named_query(name: str):
+    """Label queries run inside the block as ``name``."""
+    token = _query_name.set(name)
+    try:
+        yield
+    finally:
+        _query_name.reset(token)
+
+
+_query_metrics = {}
+
+
+def _metrics_for(query):
+    """Return ``(labels, execute histogram, fetch histogram, rows counter)``.
+
+    ``labels()`` takes a lock and builds a key on every call, so the bound
+    children are cached per label pair.
+    """
+    scope = _request_scope.get()
+    route = "background"
+    if scope is not None:
+        route = getattr(scope.get("route"), "path", "unmatched")
+    labels = (route, _query_name.get() or statement_name(query))
+    bound = _query_metrics.get(labels)
+    if bound is None:
+        bound = _query_metrics[labels] = (
+            labels,
+            QUERY_SECONDS.labels(*labels, "execute"),
+            QUERY_SECONDS.labels(*labels, "fetch"),
+            QUERY_ROWS.labels(*labels),
+        )
+    return bound
+
+
+class _Timed:
+    _query_metrics = None
+
+    async def execute(self, query, params=None, **kwargs):
+        self._query_metrics = bound = _metrics_for(query)
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            bound[1].observe(elapsed)
+            if elapsed >= SLOW_QUERY_SECONDS:
+                route, name = bound[0]
+                SLOW_QUERIES.labels(route, name).inc()
+                logger.warning("Slow query %s on %s took %.3fs: %s", name, route, elapsed, " ".join(str(query).split())[:500])
+
+    async def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = await fetch(*args)
+        bound = self._query_metrics
+        if bound is not None:
+            bound[2].observe(time.perf_counter() - start)
+            if result is not None:
+                bound[3].inc(len(result) if isinstance(result, list) else 1)
+        return result
+
+    async def fetchone(self):
+        return await self._timed_fetch(super().fetchone)
+
+    async def fetchmany(self, size=0):
+        return await self._timed_fetch(super().fetchmany, size)
+
+    async def fetchall(self):
+        return await self._timed_fetch(super().fetchall)
+
+
+class TimedCursor(_Timed, AsyncCursor):
+    pass
+
+
+class TimedServerCursor(_Timed, AsyncServerCursor):
+    pass
+
+
+async def instrument_connection(conn):
+    """Pool ``configure`` hook."""
+    conn.cursor_factory = TimedCursor
+    conn.server_cursor_factory = TimedServerCursor
+
+
+_stats_collectors = []
+
+
+class StatsCollector:
+    """Exposes a ``get_stats()`` dict (pool, result cache) as gauges at scrape time."""
+
+    def __init__(self, prefix: str, get_stats):
+        self.prefix = prefix
+        self.get_stats = get_stats
+        _stats_collectors.append(self)
+
+    def collect(self):
+        for key, value in self.get_stats().items():
+            if isinstance(value, (int, float)):
+                yield GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.prefix} statistic {key}.", value=value)
+
+
+_request_metrics = {}
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware, so streaming responses pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_scope.set(scope)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_scope.reset(token)
+            labels = (scope["method"], getattr(scope.get("route"), "path", "unmatched"), status)
+            histogram = _request_metrics.get(labels)
+            if histogram is None:
+                histogram = _request_metrics[labels] = REQUEST_SECONDS.labels(labels[0], labels[1], str(status))
+            histogram.observe(time.perf_counter() - start)
+
+
+_multiprocess_registry = None
+
+
+def render_metrics():
+    global _multiprocess_registry
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    if _multiprocess_registry is None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in _stats_collectors:
+            registry.register(collector)
+        _multiprocess_registry = registry
+    return generate_latest(_multiprocess_registry), CONTENT_TYPE_LATEST
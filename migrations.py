@@ -0,0 +1,99 @@
+"""Schema migrations applied once at startup instead of on request paths.
+
+Each entry is a name and a list of statements. An entry runs once per
+database, in one transaction under an advisory lock (so several app processes
+starting together apply it one at a time), and is then recorded in
+schema_migrations; later changes go in new entries. Until they have succeeded
+(the database may be unreachable at startup) ``ready`` stays False and the
+endpoints that depend on them answer 503. The cron sender applies the same
+list with apply_migrations_sync.
+"""
+import asyncio
+import logging
+
+from fastapi import HTTPException
+
+from db import connection
+from outbox import OUTBOX_DDL
+from personas import PERSONA_DDL, PERSONA_SEED
+from schedules import SCHEDULE_DDL, SCHEDULE_OWNER_DDL, SCHEDULE_RETRY_DDL
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    ("subscriptions", SCHEDULE_DDL),
+    ("persona_filters", PERSONA_DDL),
+    ("persona_filters_seed", PERSONA_SEED),
+    ("subscriptions_retry_at", SCHEDULE_RETRY_DDL),
+    ("subscriptions_created_by", SCHEDULE_OWNER_DDL),
+    ("email_outbox", OUTBOX_DDL),
+]
+
+MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        name TEXT PRIMARY KEY,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+APPLIED_SQL = "SELECT 1 FROM schema_migrations WHERE name = %s"
+RECORD_SQL = "INSERT INTO schema_migrations (name) VALUES (%s)"
+
+ready = False
+
+
+async def apply_migrations():
+    global ready
+    async with connection() as db:
+        async with db.transaction():
+            cur = db.cursor()
+            await cur.execute(LOCK_SQL, ("schema_migrations",))
+            await cur.execute(MIGRATIONS_DDL)
+            await cur.close()
+        for name, statements in MIGRATIONS:
+            async with db.transaction():
+                cur = db.cursor()
+                await cur.execute(LOCK_SQL, (name,))
+                await cur.execute(APPLIED_SQL, (name,))
+                if not await cur.fetchone():
+                    for statement in statements:
+                        await cur.execute(statement)
+                    await cur.execute(RECORD_SQL, (name,))
+                    logger.info("Applied migration %s", name)
+                await cur.close()
+    ready = True
+
+
+def apply_migrations_sync(conn):
+    """apply_migrations for a sync psycopg connection (the cron sender)."""
+    with conn.cursor() as cur:
+        cur.execute(LOCK_SQL, ("schema_migrations",))
+        cur.execute(MIGRATIONS_DDL)
+    conn.commit()
+    for name, statements in MIGRATIONS:
+        with conn.cursor() as cur:
+            cur.execute(LOCK_SQL, (name,))
+            cur.execute(APPLIED_SQL, (name,))
+            if not cur.fetchone():
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(RECORD_SQL, (name,))
+        conn.commit()
+
+
+async def migrate_until_done(retry_interval: float = 5.0):
+    while True:
+        try:
+            await apply_migrations()
+            logger.info("Schema migrations applied")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Schema migrations failed, retrying: %s", e)
+            await asyncio.sleep(retry_interval)
+
+
+def require_migrations():
+    if not ready:
+        raise HTTPException(status_code=503, detail="Database schema is not ready yet, please retry.")
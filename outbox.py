@@ -0,0 +1,309 @@
+"""Durable email outbox.
+
+/api/email_me stores the finished MIME message in email_outbox and returns
+right away; OutboxWorkers claim queued jobs with FOR UPDATE SKIP LOCKED (so any
+number of app processes can run workers), send them over long-lived SMTP
+connections and retry transient failures with exponential backoff. A job left
+in 'sending' by a crashed worker is picked up again once its lease expires.
+A claim only reserves ids; each message body is read just before it is sent,
+so a batch of large messages never sits in a worker's memory at once.
+The table is created by migrations.py.
+"""
+import asyncio
+import logging
+import os
+
+import aiosmtplib
+
+from db import connection
+from metrics import EMAIL_JOBS, SMTP_SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "1") == "1"
+EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "10"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "30"))     # seconds, doubled per attempt
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "3600"))
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# Seconds a claimed job stays ours; renewed just before each send, so it only
+# has to outlast one send (two connects, logins and sendmails at worst).
+OUTBOX_LEASE = int(os.getenv("OUTBOX_LEASE", "300"))
+OUTBOX_COPY_CHUNK = 1024 * 1024
+
+OUTBOX_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        requested_by TEXT,
+        sender TEXT NOT NULL,
+        recipients TEXT[] NOT NULL,
+        message BYTEA NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INT NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        locked_until TIMESTAMPTZ,
+        last_error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        sent_at TIMESTAMPTZ
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS email_outbox_due ON email_outbox (next_attempt_at)
+    WHERE status IN ('queued', 'sending')
+    """,
+]
+
+CLAIM_SQL = """
+    UPDATE email_outbox
+    SET status = 'sending', attempts = attempts + 1, locked_until = now() + make_interval(secs => %s)
+    WHERE id IN (
+        SELECT id FROM email_outbox
+        WHERE (status = 'queued' AND next_attempt_at <= now())
+           OR (status = 'sending' AND locked_until < now())
+        ORDER BY next_attempt_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, attempts
+"""
+
+# Extends the lease and reads the message only if the claim is still ours: a
+# job whose lease ran out while it waited in our batch may have been claimed
+# (attempts + 1) elsewhere.
+RENEW_SQL = """
+    UPDATE email_outbox SET locked_until = now() + make_interval(secs => %s)
+    WHERE id = %s AND attempts = %s AND status = 'sending'
+    RETURNING sender, recipients, message
+"""
+
+
+async def enqueue(sender: str, recipients: list, message: bytes, requested_by=None) -> int:
+    async with connection() as db:
+        cur = db.cursor()
+        await cur.execute("""
+            INSERT INTO email_outbox (requested_by, sender, recipients, message)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id
+        """, (requested_by, sender, recipients, message))
+        job_id = (await cur.fetchone())[0]
+        await cur.close()
+    outbox_workers.wake()
+    return job_id
+
+
+def _copy_text(value) -> bytes:
+    if value is None:
+        return b"\\N"
+    escaped = str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return escaped.encode()
+
+
+def _array_literal(values) -> str:
+    return "{" + ",".join('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values) + "}"
+
+
+async def enqueue_file(sender: str, recipients: list, message_file, requested_by=None) -> int:
+    """Queue a message stored in the binary file ``message_file``.
+
+    The file is streamed into the bytea column through COPY in
+    OUTBOX_COPY_CHUNK pieces, so large messages never sit in memory whole.
+    """
+    async with connection() as db:
+        async with db.transaction():
+            cur = db.cursor()
+            await cur.execute("SELECT nextval(pg_get_serial_sequence('email_outbox', 'id'))")
+            job_id = (await cur.fetchone())[0]
+            columns = "id, requested_by, sender, recipients, message"
+            async with cur.copy(f"COPY email_outbox ({columns}) FROM STDIN") as copy:
+                prefix = [str(job_id).encode(), _copy_text(requested_by), _copy_text(sender),
+                          _copy_text(_array_literal(recipients))]
+                # bytea hex input is \x...; the backslash itself is escaped for COPY.
+                await copy.write(b"\t".join(prefix) + b"\t\\\\x")
+                message_file.seek(0)
+                while True:
+                    chunk = message_file.read(OUTBOX_COPY_CHUNK)
+                    if not chunk:
+                        break
+                    await copy.write(chunk.hex().encode())
+                await copy.write(b"\n")
+            await cur.close()
+    outbox_workers.wake()
+    return job_id
+
+
+async def job_status(job_id: int):
+    async with connection() as db:
+        cur = db.cursor()
+        await cur.execute("""
+            SELECT id, requested_by, status, attempts, last_error, created_at, next_attempt_at, sent_at
+            FROM email_outbox WHERE id = %s
+        """, (job_id,))
+        row = await cur.fetchone()
+        columns = [desc[0] for desc in cur.description]
+        await cur.close()
+    return dict(zip(columns, row)) if row else None
+
+
+def is_permanent(error: Exception) -> bool:
+    # 5xx replies (bad recipient, message rejected) won't succeed on retry.
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and 500 <= code < 600 and not isinstance(error, aiosmtplib.SMTPAuthenticationError)
+
+
+class SmtpSender:
+    """One authenticated SMTP connection, reused for every message it sends."""
+
+    def __init__(self):
+        self.smtp = None
+
+    async def send(self, sender: str, recipients: list, message: bytes):
+        with SMTP_SEND_SECONDS.time():
+            await self._send(sender, recipients, message)
+
+    async def _send(self, sender: str, recipients: list, message: bytes):
+        for retry in (False, True):
+            if self.smtp is None or not self.smtp.is_connected:
+                await self._connect()
+            try:
+                await self.smtp.sendmail(sender, recipients, message)
+                return
+            except aiosmtplib.SMTPServerDisconnected:
+                # The server dropped an idle connection; reconnect once.
+                self.smtp = None
+                if retry:
+                    raise
+
+    async def _connect(self):
+        smtp = aiosmtplib.SMTP(hostname=SMTP_HOST, port=SMTP_PORT, use_tls=SMTP_USE_TLS, timeout=SMTP_TIMEOUT)
+        await smtp.connect()
+        if EMAIL_ADDRESS and EMAIL_PASSWORD:
+            await smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+        self.smtp = smtp
+
+    async def close(self):
+        if self.smtp is not None and self.smtp.is_connected:
+            try:
+                await self.smtp.quit()
+            except aiosmtplib.SMTPException:
+                self.smtp.close()
+        self.smtp = None
+
+
+class OutboxWorkers:
+    def __init__(self, count: int = OUTBOX_WORKERS):
+        self.count = count
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.count)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        sender = SmtpSender()
+        try:
+            while True:
+                # Cleared before claiming so a wake() during the claim isn't lost.
+                self._wakeup.clear()
+                try:
+                    jobs = await self._claim()
+                except Exception as e:
+                    logger.warning("Outbox claim failed: %s", e)
+                    jobs = []
+                if not jobs:
+                    await sender.close()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                for job_id, attempts in jobs:
+                    try:
+                        await self._process(sender, job_id, attempts)
+                    except Exception as e:
+                        # Usually the database or a pool timeout; the job is
+                        # picked up again once its lease expires.
+                        logger.exception("Email job %s not processed, retrying after its lease expires", job_id)
+                        await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+        finally:
+            await sender.close()
+
+    async def _process(self, sender, job_id, attempts):
+        job = await self._renew(job_id, attempts)
+        if job is None:
+            logger.warning("Email job %s lease lost before sending, skipped", job_id)
+            return
+        from_addr, recipients, message = job
+        await self._deliver(sender, job_id, from_addr, recipients, bytes(message), attempts)
+
+    async def _claim(self):
+        async with connection() as db:
+            cur = db.cursor()
+            await cur.execute(CLAIM_SQL, (OUTBOX_LEASE, OUTBOX_BATCH_SIZE))
+            jobs = await cur.fetchall()
+            await cur.close()
+        return jobs
+
+    async def _renew(self, job_id, attempts):
+        async with connection() as db:
+            cur = db.cursor()
+            await cur.execute(RENEW_SQL, (OUTBOX_LEASE, job_id, attempts))
+            job = await cur.fetchone()
+            await cur.close()
+        return job
+
+    async def _deliver(self, sender, job_id, from_addr, recipients, message, attempts):
+        try:
+            await sender.send(from_addr, recipients, message)
+        except Exception as e:
+            await sender.close()
+            permanent = is_permanent(e) or attempts >= OUTBOX_MAX_ATTEMPTS
+            delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+            EMAIL_JOBS.labels("failed" if permanent else "retry").inc()
+            if permanent:
+                logger.error("Email job %s attempt %s failed, giving up: %s", job_id, attempts, e)
+            else:
+                logger.warning("Email job %s attempt %s failed, retry in %.0fs: %s", job_id, attempts, delay, e)
+            await self._finish(job_id, "failed" if permanent else "queued", str(e), delay)
+            return
+        EMAIL_JOBS.labels("sent").inc()
+        logger.info("Email job %s sent", job_id)
+        try:
+            await self._finish(job_id, "sent")
+        except Exception as e:
+            logger.error("Email job %s sent but not marked sent, it may be resent after its lease expires: %s", job_id, e)
+
+    async def _finish(self, job_id, status, error=None, delay=0.0):
+        async with connection() as db:
+            cur = db.cursor()
+            await cur.execute("""
+                UPDATE email_outbox
+                SET status = %s,
+                    last_error = %s,
+                    locked_until = NULL,
+                    next_attempt_at = now() + make_interval(secs => %s),
+                    sent_at = CASE WHEN %s = 'sent' THEN now() END
+                WHERE id = %s
+            """, (status, error, delay, status, job_id))
+            await cur.close()
+
+
+outbox_workers = OutboxWorkers()
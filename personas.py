@@ -0,0 +1,195 @@
+"""Persona lookups and row-level filters, served from memory.
+
+persona_users maps usernames to personas and persona_filters holds the rows
+each persona may see, as (source, filter_name, filter_value) where filter_name
+is one of the filters in queries.py (city, state, ...). Both tables are loaded
+into a PersonaIndex that reloads every PERSONA_REFRESH_INTERVAL seconds and
+whenever a trigger on either table sends a NOTIFY on PERSONA_CHANNEL.
+A persona without rules for a source sees all of it.
+
+With several workers each load is also published to the shared store, and a
+worker that has not loaded yet (just started, or the database is slow) takes
+its index from there instead of querying.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+import orjson
+import psycopg
+
+from db import DATABASE_URL, connection
+from shared import shared_store
+
+logger = logging.getLogger(__name__)
+
+PERSONA_REFRESH_INTERVAL = float(os.getenv("PERSONA_REFRESH_INTERVAL", "300"))
+PERSONA_CHANNEL = "persona_rules_changed"
+
+PERSONA_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS persona_filters (
+        persona TEXT NOT NULL,
+        source TEXT NOT NULL,
+        filter_name TEXT NOT NULL,
+        filter_value TEXT NOT NULL,
+        PRIMARY KEY (persona, source, filter_name, filter_value)
+    )
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION notify_persona_rules_changed() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{PERSONA_CHANNEL}', TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS persona_filters_changed ON persona_filters",
+    """
+    CREATE TRIGGER persona_filters_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON persona_filters
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_persona_rules_changed()
+    """,
+    "DROP TRIGGER IF EXISTS persona_users_changed ON persona_users",
+    """
+    CREATE TRIGGER persona_users_changed AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON persona_users
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_persona_rules_changed()
+    """,
+]
+
+# The rules that used to be hard-coded in the data endpoints. Applied once
+# (see migrations.py) and only into an empty table, so rules an admin has
+# since deleted stay deleted.
+PERSONA_SEED = [
+    """
+    INSERT INTO persona_filters (persona, source, filter_name, filter_value)
+    SELECT * FROM (VALUES
+        ('Srini', 'data', 'city', 'New York'),
+        ('Venkat', 'data', 'city', 'San Francisco'),
+        ('Srini', 'ppdata', 'state', 'California'),
+        ('Venkat', 'ppdata', 'state', 'Nevada')
+    ) AS seed (persona, source, filter_name, filter_value)
+    WHERE NOT EXISTS (SELECT 1 FROM persona_filters)
+    """,
+]
+
+PERSONA_SHARED_KEY = ("persona_index",)
+
+PERSONA_USERS_SQL = "SELECT username, persona FROM persona_users"
+PERSONA_RULES_SQL = """
+    SELECT persona, source, filter_name, array_agg(filter_value ORDER BY filter_value)
+    FROM persona_filters
+    GROUP BY persona, source, filter_name
+    ORDER BY persona, source, filter_name
+"""
+PERSONA_FILTERS_SQL = """
+    SELECT filter_name, array_agg(filter_value ORDER BY filter_value)
+    FROM persona_filters
+    WHERE persona = %s AND source = %s
+    GROUP BY filter_name
+    ORDER BY filter_name
+"""
+
+
+class PersonaIndex:
+    """Immutable snapshots of persona_users and persona_filters.
+
+    ``load`` builds new dicts and swaps them in, so readers never see a half
+    loaded index and never need a lock.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._users = {}
+        self._rules = {}
+
+    async def load(self) -> bool:
+        """Reload both tables; returns True when an already loaded index changed."""
+        async with connection() as db:
+            cur = db.cursor()
+            await cur.execute(PERSONA_USERS_SQL)
+            user_rows = await cur.fetchall()
+            await cur.execute(PERSONA_RULES_SQL)
+            rule_rows = await cur.fetchall()
+            await cur.close()
+        if shared_store is not None:
+            shared_store.set(PERSONA_SHARED_KEY, orjson.dumps([user_rows, rule_rows]))
+        return self.replace(user_rows, rule_rows)
+
+    def load_shared(self) -> bool:
+        """Take the index another worker published; returns True if there was one."""
+        data = shared_store.get(PERSONA_SHARED_KEY, ttl=2 * PERSONA_REFRESH_INTERVAL) if shared_store else None
+        if data is None:
+            return False
+        user_rows, rule_rows = orjson.loads(data)
+        self.replace(user_rows, rule_rows)
+        return True
+
+    def replace(self, user_rows, rule_rows) -> bool:
+        """Swap in rows from PERSONA_USERS_SQL and PERSONA_RULES_SQL."""
+        users = {username.lower(): persona for username, persona in user_rows}
+        rules = {}
+        for persona, source, filter_name, values in rule_rows:
+            rules.setdefault((persona, source), []).append((filter_name, values))
+        # The first load only fills an empty index (endpoints asked the
+        # database until then), so there is nothing cached to invalidate.
+        changed = self.loaded and (users != self._users or rules != self._rules)
+        self._users, self._rules = users, rules
+        self.loaded = True
+        return changed
+
+    def lookup(self, username: str) -> Optional[str]:
+        return self._users.get(username.lower())
+
+    async def persona_for(self, username: str) -> Optional[str]:
+        if self.loaded or self.load_shared():
+            return self.lookup(username)
+        # Index not loaded yet (database was down at startup): ask directly.
+        async with connection() as db:
+            cur = db.cursor()
+            await cur.execute("SELECT persona FROM persona_users WHERE username = %s", (username.lower(),))
+            row = await cur.fetchone()
+            await cur.close()
+        return row[0] if row else None
+
+    def lookup_filters(self, persona: Optional[str], source: str) -> list:
+        """Return ``[(filter_name, values), ...]`` scoping ``persona`` on ``source``."""
+        return self._rules.get((persona, source), [])
+
+    async def filters_for(self, persona: Optional[str], source: str) -> list:
+        # An empty list means "sees everything", so an index that has not
+        # loaded must not answer; ask the database (an error fails closed).
+        if self.loaded or self.load_shared():
+            return self.lookup_filters(persona, source)
+        async with connection() as db:
+            cur = db.cursor()
+            await cur.execute(PERSONA_FILTERS_SQL, (persona, source))
+            rows = await cur.fetchall()
+            await cur.close()
+        return [(filter_name, values) for filter_name, values in rows]
+
+
+persona_index = PersonaIndex()
+
+
+async def watch_persona_rules(on_change=None):
+    """Keep ``persona_index`` current from LISTEN/NOTIFY plus a periodic reload.
+
+    The tables and triggers are created by migrations.py; until then loads
+    fail and are retried.
+    """
+    persona_index.load_shared()
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(DATABASE_URL or "", autocommit=True) as conn:
+                await conn.execute(f"LISTEN {PERSONA_CHANNEL}")
+                while True:
+                    if await persona_index.load() and on_change:
+                        on_change()
+                    async for _ in conn.notifies(timeout=PERSONA_REFRESH_INTERVAL, stop_after=1):
+                        pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Persona rules watcher failed, retrying: %s", e)
+            await asyncio.sleep(5)
@@ -0,0 +1,196 @@
+import base64
+from datetime import date, timedelta
+from typing import List, Optional
+
+import orjson
+from fastapi import HTTPException, Query
+
+DATA_LIMIT_DEFAULT = 100
+DATA_LIMIT_MAX = 5000
+
+# Star schema behind /api/data.
+STAR_SCHEMA = {
+    "from": """
+        FROM fact_sales f
+        JOIN dim_date d ON f.date_id = d.date_id
+        JOIN dim_product p ON f.product_id = p.product_id
+        JOIN dim_customer c ON f.customer_id = c.customer_id
+        JOIN dim_store s ON f.store_id = s.store_id
+    """,
+    "dimensions": {
+        "date": "d.date",
+        "product_id": "p.product_id",
+        "product_name": "p.product_name",
+        "category": "p.category",
+        "brand": "p.brand",
+        "store_name": "s.store_name",
+        "city": "s.city",
+        "state": "s.state",
+        "customer_name": "c.customer_name",
+    },
+    "measures": [
+        "SUM(f.units_sold) AS units_sold",
+        "SUM(f.revenue) AS revenue",
+        "SUM(f.profit) AS profit",
+    ],
+    "filters": {
+        "store": "s.store_name",
+        "city": "s.city",
+        "state": "s.state",
+        "product": "p.product_name",
+        "category": "p.category",
+    },
+    "default_group_by": ["date", "product_name", "category", "store_name", "city", "customer_name"],
+}
+
+# Orders schema behind /api/ppdata.
+ORDERS_SCHEMA = {
+    "from": """
+        FROM orders o
+        JOIN order_items oi ON o.id = oi.orderID
+        JOIN products p ON oi.SKU = p.SKU
+        JOIN stores s ON o.storeId = s.id
+        JOIN customers c ON o.customerId = c.id
+    """,
+    "dimensions": {
+        "date": "o.orderDate",
+        "product_id": "p.SKU",
+        "product_name": "p.Name",
+        "category": "p.Category",
+        "store_name": "s.id",
+        "city": "s.city",
+        "state": "s.state",
+        "customer_name": "o.customerId",
+    },
+    "measures": [
+        "COUNT(oi.SKU) AS units_sold",
+        "SUM(p.Price) AS revenue",
+        "SUM(p.Price * 0.3) AS profit",  # Assuming 30% profit margin
+    ],
+    "filters": {
+        "store": "s.id::text",
+        "city": "s.city",
+        "state": "s.state",
+        "product": "p.Name",
+        "category": "p.Category",
+    },
+    "default_group_by": ["date", "product_id", "product_name", "category", "store_name", "city", "customer_name"],
+}
+
+
+def data_query_params(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    store: Optional[List[str]] = Query(None),
+    city: Optional[List[str]] = Query(None),
+    state: Optional[List[str]] = Query(None),
+    product: Optional[List[str]] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    group_by: Optional[List[str]] = Query(None),
+    limit: int = Query(DATA_LIMIT_DEFAULT, ge=1, le=DATA_LIMIT_MAX),
+    cursor: Optional[str] = None,
+) -> dict:
+    """Query-string options shared by /api/data and /api/ppdata."""
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "filters": {
+            name: values
+            for name, values in (("store", store), ("city", city), ("state", state),
+                                 ("product", product), ("category", category))
+            if values
+        },
+        "group_by": group_by,
+        "limit": limit,
+        "cursor": cursor,
+    }
+
+
+def sort_keys(group_by: List[str]) -> List[str]:
+    # Newest first, then product name, then the remaining group columns so the
+    # ordering is total and keyset pagination never skips or repeats a row.
+    leading = [name for name in ("date", "product_name") if name in group_by]
+    return leading + [name for name in group_by if name not in leading]
+
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode().rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> list:
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Cursor does not match group_by")
+    return values
+
+
+def build_data_query(schema: dict, options: dict, persona_filters=None):
+    """Return ``(sql, params, keys)`` for an aggregated, filtered page.
+
+    Every user-supplied value is a bind parameter, so the SQL text only varies
+    with which options are present and Postgres can reuse its plans. The query
+    fetches ``limit + 1`` rows; the extra row tells the caller there is a next
+    page, and a ``limit`` of None returns everything (exports).
+    ``persona_filters`` is a list of ``(filter_name, values)`` pairs.
+    """
+    dimensions = schema["dimensions"]
+    group_by = options["group_by"] or schema["default_group_by"]
+    unknown = [name for name in group_by if name not in dimensions]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by column(s): {', '.join(unknown)}")
+    group_by = list(dict.fromkeys(group_by))
+    keys = sort_keys(group_by)
+
+    conditions = []
+    params = []
+    # Persona scoping goes first and is bound like every other value, so all
+    # personas scoped on the same filters share one statement.
+    for name, values in persona_filters or ():
+        conditions.append(f"{schema['filters'][name]} = ANY(%s)")
+        params.append(values)
+    if options["date_from"]:
+        conditions.append(f"{dimensions['date']} >= %s")
+        params.append(options["date_from"])
+    if options["date_to"]:
+        # Inclusive end date that also holds when the column is a timestamp.
+        conditions.append(f"{dimensions['date']} < %s")
+        params.append(options["date_to"] + timedelta(days=1))
+    for name, values in options["filters"].items():
+        conditions.append(f"{schema['filters'][name]} = ANY(%s)")
+        params.append(values)
+
+    if options["cursor"]:
+        last = decode_cursor(options["cursor"], len(keys))
+        alternatives = []
+        for i, name in enumerate(keys):
+            parts = [f"{dimensions[keys[j]]} = %s" for j in range(i)]
+            params.extend(last[:i])
+            operator = "<" if name == "date" else ">"
+            parts.append(f"{dimensions[name]} {operator} %s")
+            params.append(last[i])
+            alternatives.append("(" + " AND ".join(parts) + ")")
+        conditions.append("(" + " OR ".join(alternatives) + ")")
+
+    select = [f"{dimensions[name]} AS {name}" for name in group_by] + schema["measures"]
+    order = [f"{dimensions[name]} DESC" if name == "date" else dimensions[name] for name in keys]
+    sql = f"""
+        SELECT
+            {", ".join(select)}
+        {schema["from"]}
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        GROUP BY {", ".join(dimensions[name] for name in group_by)}
+        ORDER BY {", ".join(order)}
+    """
+    if options["limit"] is not None:
+        sql += "LIMIT %s\n"
+        params.append(options["limit"] + 1)
+    return sql, params, keys
+
+
+def next_cursor(row, columns: List[str], keys: List[str]) -> str:
+    if isinstance(row, dict):
+        return encode_cursor([row[name] for name in keys])
+    return encode_cursor([row[columns.index(name)] for name in keys])
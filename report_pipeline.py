@@ -0,0 +1,169 @@
+"""Concurrent delivery for the scheduled report sender.
+
+A batch of jobs flows through two stages: ``generate`` builds each message on
+a bounded thread pool, and ``send`` hands finished messages to a small pool of
+long-lived SMTP connections, each of which logs in once and sends many
+messages. StageMetrics records per-stage counts, failures and timings.
+"""
+import logging
+import os
+import queue
+import smtplib
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "1") == "1"
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MESSAGES_PER_CONNECTION", "100"))
+REPORT_GENERATE_WORKERS = int(os.getenv("REPORT_GENERATE_WORKERS", "8"))
+
+
+class StageMetrics:
+    """Thread-safe count / failures / busy time / max latency per stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self.started_at = time.perf_counter()
+
+    def record(self, stage: str, seconds: float, ok: bool = True):
+        with self._lock:
+            stats = self._stages.setdefault(stage, {"count": 0, "failed": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stats["count"] += 1
+            stats["failed"] += not ok
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def timed(self, stage: str, fn, *args):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            self.record(stage, time.perf_counter() - start, ok=False)
+            raise
+        self.record(stage, time.perf_counter() - start)
+        return result
+
+    def snapshot(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at
+        with self._lock:
+            stages = {name: dict(stats) for name, stats in self._stages.items()}
+        for stats in stages.values():
+            stats["avg_seconds"] = stats["seconds"] / stats["count"] if stats["count"] else 0.0
+            stats["per_second"] = stats["count"] / elapsed if elapsed else 0.0
+        return {"elapsed_seconds": elapsed, "stages": stages}
+
+    def log_summary(self):
+        snapshot = self.snapshot()
+        for name, stats in snapshot["stages"].items():
+            logging.info(
+                f"Stage {name}: {stats['count']} done, {stats['failed']} failed, "
+                f"avg {stats['avg_seconds'] * 1000:.1f} ms, max {stats['max_seconds'] * 1000:.1f} ms, "
+                f"{stats['per_second']:.1f}/s over {snapshot['elapsed_seconds']:.1f}s"
+            )
+
+
+class SmtpPool:
+    """Up to ``size`` authenticated SMTP connections shared by sender threads.
+
+    A connection is reused for SMTP_MESSAGES_PER_CONNECTION messages and then
+    replaced; one the server has dropped is reopened and the send retried once.
+    """
+
+    def __init__(self, size=SMTP_POOL_SIZE, host=SMTP_HOST, port=SMTP_PORT, use_tls=SMTP_USE_TLS,
+                 username=None, password=None, ssl_context=None, metrics=None):
+        self.size = size
+        self.host, self.port, self.use_tls = host, port, use_tls
+        self.username, self.password = username, password
+        self.ssl_context = ssl_context
+        self.metrics = metrics or StageMetrics()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        if self.use_tls:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=30, context=self.ssl_context or ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        return [smtp, 0]
+
+    def send(self, sender: str, recipients: list, message: bytes):
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self.metrics.timed("connect", self._connect)
+            try:
+                try:
+                    conn[0].sendmail(sender, recipients, message)
+                except smtplib.SMTPServerDisconnected:
+                    self._close(conn)
+                    conn = self.metrics.timed("connect", self._connect)
+                    conn[0].sendmail(sender, recipients, message)
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # The server rejected this message; the connection is still usable.
+                self._idle.put(conn)
+                raise
+            except BaseException:
+                self._close(conn)
+                raise
+            conn[1] += 1
+            if conn[1] >= SMTP_MESSAGES_PER_CONNECTION:
+                self._close(conn)
+            else:
+                self._idle.put(conn)
+
+    def _close(self, conn):
+        try:
+            conn[0].quit()
+        except (smtplib.SMTPException, OSError):
+            conn[0].close()
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class DeliveryPipeline:
+    """Run ``build(job) -> (sender, recipients, message_bytes)`` then send, concurrently."""
+
+    def __init__(self, build, smtp_pool: SmtpPool, generate_workers=REPORT_GENERATE_WORKERS, metrics=None):
+        self.build = build
+        self.smtp_pool = smtp_pool
+        self.metrics = metrics or smtp_pool.metrics
+        self._generate = ThreadPoolExecutor(generate_workers, thread_name_prefix="report-generate")
+        self._send = ThreadPoolExecutor(smtp_pool.size, thread_name_prefix="report-send")
+
+    def run(self, jobs):
+        """Deliver ``jobs``, yielding ``(job, error or None)`` as each one finishes."""
+        done = queue.Queue()
+
+        def generated(index, future):
+            # Runs on the generate thread; queues the send as soon as the message is ready.
+            error = future.exception()
+            if error is not None:
+                done.put((index, error))
+                return
+            sent = self._send.submit(self.metrics.timed, "send", self.smtp_pool.send, *future.result())
+            sent.add_done_callback(lambda f: done.put((index, f.exception())))
+
+        for index, job in enumerate(jobs):
+            future = self._generate.submit(self.metrics.timed, "generate", self.build, job)
+            future.add_done_callback(lambda f, i=index: generated(i, f))
+        for _ in jobs:
+            index, error = done.get()
+            yield jobs[index], error
+
+    def close(self):
+        self._generate.shutdown()
+        self._send.shutdown()
+        self.smtp_pool.close()
@@ -0,0 +1,214 @@
+"""Server-side PDF and XLSX reports for scheduled emails.
+
+A report is the /api/data query (STAR_SCHEMA, persona scoping, the last
+REPORT_DAYS days) rendered straight from a server-side cursor: the workbook is
+written in openpyxl's write-only mode and the PDF holds the totals and the
+first REPORT_PDF_MAX_ROWS rows. Rendered files are kept in an ArtifactCache
+keyed by (persona, kind, data version, report date, persona rules), so every
+subscriber who would get the same report shares one rendering.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from fpdf import FPDF
+from openpyxl import Workbook
+
+from queries import STAR_SCHEMA, build_data_query
+from rollups import SALES_ROLLUP
+
+REPORT_DAYS = int(os.getenv("REPORT_DAYS", "30"))
+REPORT_PDF_MAX_ROWS = int(os.getenv("REPORT_PDF_MAX_ROWS", "500"))
+REPORT_FETCH_SIZE = int(os.getenv("REPORT_FETCH_SIZE", "5000"))
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "bi-report-cache"))
+REPORT_CACHE_MAX_AGE = float(os.getenv("REPORT_CACHE_MAX_AGE", str(2 * 24 * 3600)))
+
+DATA_VERSION_SQL = SALES_ROLLUP["high_watermark"]
+
+# kind -> (maintype, subtype, extension)
+ARTIFACTS = {
+    "pdf": ("application", "pdf", "pdf"),
+    "xlsx": ("application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+MEASURES = ("units_sold", "revenue", "profit")
+
+
+def artifact_kinds(report_format: str) -> list:
+    report_format = report_format.lower()
+    kinds = []
+    if "pdf" in report_format or "both" in report_format:
+        kinds.append("pdf")
+    if "excel" in report_format or "both" in report_format:
+        kinds.append("xlsx")
+    return kinds
+
+
+def report_query(persona_filters, report_date):
+    options = {
+        "date_from": report_date - timedelta(days=REPORT_DAYS - 1),
+        "date_to": report_date,
+        "filters": {},
+        "group_by": None,
+        "limit": None,
+        "cursor": None,
+    }
+    query, params, _ = build_data_query(STAR_SCHEMA, options, persona_filters)
+    return query, params
+
+
+def write_xlsx(path, columns, rows):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Data")
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def _cell(value) -> str:
+    if isinstance(value, (Decimal, float)):
+        return f"{value:,.2f}"
+    return "" if value is None else str(value)
+
+
+def write_pdf(path, columns, rows, title):
+    """Totals plus the first REPORT_PDF_MAX_ROWS rows; ``rows`` is read to the end."""
+    totals = dict.fromkeys((name for name in MEASURES if name in columns), 0)
+    positions = {name: columns.index(name) for name in totals}
+    shown = []
+    count = 0
+    for row in rows:
+        count += 1
+        for name, index in positions.items():
+            totals[name] += row[index] or 0
+        if len(shown) < REPORT_PDF_MAX_ROWS:
+            shown.append(row)
+
+    pdf = FPDF(orientation="L")
+    pdf.set_auto_page_break(True, margin=10)
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 14)
+    pdf.cell(0, 10, title, new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", size=10)
+    summary = [f"{count:,} rows"] + [f"{name.replace('_', ' ')}: {_cell(value)}" for name, value in totals.items()]
+    pdf.cell(0, 8, "   ".join(summary), new_x="LMARGIN", new_y="NEXT")
+    if count > len(shown):
+        pdf.cell(0, 8, f"First {len(shown):,} rows shown; the workbook has them all.", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(2)
+    pdf.set_font("Helvetica", size=7)
+    with pdf.table(text_align="LEFT", first_row_as_headings=True) as table:
+        table.row([name.replace("_", " ") for name in columns])
+        for row in shown:
+            table.row([_cell(value) for value in row])
+    pdf.output(path)
+
+
+class ArtifactCache:
+    """Rendered report files on disk, rendered at most once per key.
+
+    Concurrent requests for the same key wait for the first renderer instead
+    of rendering again; files are written under a temporary name and renamed
+    into place so readers never see a partial file.
+    """
+
+    def __init__(self, directory: str = REPORT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.renders = 0
+
+    def path_for(self, key: tuple, extension: str) -> str:
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{digest}.{extension}")
+
+    def get_or_render(self, key: tuple, extension: str, render) -> str:
+        """Return the cached file for ``key``, calling ``render(path)`` if missing."""
+        path = self.path_for(key, extension)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(path, threading.Lock())
+        with key_lock:
+            if os.path.exists(path):
+                with self._lock:
+                    self.hits += 1
+                return path
+            partial = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                render(partial)
+                os.replace(partial, path)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            with self._lock:
+                self.renders += 1
+        return path
+
+    def prune(self, max_age: float = REPORT_CACHE_MAX_AGE):
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class ReportRenderer:
+    """Render (or reuse) the report files a subscriber should receive.
+
+    ``connect`` returns a new sync psycopg connection;
+    ``personas`` is a loaded personas.PersonaIndex.
+    """
+
+    def __init__(self, connect, personas, data_version, cache: ArtifactCache):
+        self.connect = connect
+        self.personas = personas
+        self.data_version = data_version
+        self.cache = cache
+
+    def artifacts(self, owner: str, report_format: str, report_date) -> list:
+        """Return ``[(kind, path), ...]`` for ``report_format``.
+
+        ``owner`` is the subscription's created_by (a login token's sub); the
+        report is scoped by that user's persona, never by the recipient's
+        address, which anyone can choose.
+        """
+        # Same persona mapping as login in main.py: the username, or the
+        # local part of a Google address.
+        persona = self.personas.lookup(owner.split("@")[0])
+        persona_filters = self.personas.lookup_filters(persona, "data")
+        results = []
+        for kind in artifact_kinds(report_format):
+            key = (persona, kind, self.data_version, report_date.isoformat(), repr(persona_filters))
+            path = self.cache.get_or_render(
+                key, ARTIFACTS[kind][2],
+                lambda partial, kind=kind: self.render(partial, kind, persona, persona_filters, report_date),
+            )
+            results.append((kind, path))
+        return results
+
+    def render(self, path, kind, persona, persona_filters, report_date):
+        query, params = report_query(persona_filters, report_date)
+        conn = self.connect()
+        try:
+            cur = conn.cursor(name=f"report_{uuid.uuid4().hex}")
+            cur.itersize = REPORT_FETCH_SIZE
+            cur.execute(query, params)
+            columns = [desc[0] for desc in cur.description]
+            rows = cur
+            if kind == "xlsx":
+                write_xlsx(path, columns, rows)
+            else:
+                title = f"BI Dashboard Report, {report_date - timedelta(days=REPORT_DAYS - 1)} to {report_date}"
+                write_pdf(path, columns, rows, title + (f" ({persona})" if persona else ""))
+            cur.close()
+        finally:
+            conn.close()
@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Optional
+
+import brotli
+from fastapi import Request
+from fastapi.responses import Response
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESSED_CACHE_SIZE = int(os.getenv("COMPRESSED_CACHE_SIZE", "64"))
+
+ENCODINGS = ("br", "gzip")  # server preference when weights are equal
+
+# (etag, encoding) -> compressed body, so cached results are compressed once
+_compressed = OrderedDict()
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the supported encoding the client weights highest (br on a tie).
+
+    ``q=0`` refuses an encoding, ``*`` weights the ones not listed, and an
+    explicitly preferred ``identity`` means no compression.
+    """
+    offered = {}
+    for item in (accept_encoding or "").split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.lower().startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        offered[name.lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = offered.get(encoding, offered.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    if offered.get("identity", 0.0) > best_quality:
+        return None
+    return best
+
+
+def compress(body: bytes, encoding: str, etag: str) -> bytes:
+    key = (etag, encoding)
+    cached = _compressed.get(key)
+    if cached is not None:
+        _compressed.move_to_end(key)
+        return cached
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=5)
+    else:
+        compressed = gzip.compress(body, compresslevel=6)
+    _compressed[key] = compressed
+    if len(_compressed) > COMPRESSED_CACHE_SIZE:
+        _compressed.popitem(last=False)
+    return compressed
+
+
+def json_response(request: Request, body: bytes, headers: Optional[dict] = None,
+                  media_type: str = "application/json", etag: Optional[str] = None) -> Response:
+    """Serve a rendered body with a strong ETag, 304 handling and compression.
+
+    ``etag`` may be passed in when the body's ETag was computed ahead of time.
+    Each encoding is its own representation with a "-gzip"/"-br" suffix on the
+    body's ETag, and a 304 carries the ETag the 200 would have sent.
+    """
+    etag = etag or make_etag(body)
+    headers = dict(headers or {})
+    headers["Cache-Control"] = "private, no-cache"
+    headers["Vary"] = "Authorization, Accept, Accept-Encoding"
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    if len(body) < COMPRESS_MIN_SIZE:
+        encoding = None
+    representation = etag[:-1] + "-" + encoding + '"' if encoding else etag
+    headers["ETag"] = representation
+    if etag_matches(request.headers.get("if-none-match"), representation):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        body = compress(body, encoding, etag)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,240 @@
+"""Pre-aggregated rollups of the fact tables at day x store x product grain.
+
+Each rollup is a plain table kept up to date incrementally: a refresh
+aggregates only the facts whose watermark column (an increasing id) is above
+the last recorded watermark and adds them onto the existing rows. Facts are
+assumed to be append-only, with ids drawn from their sequence by the INSERT or
+COPY that writes them (refreshes run on a timer and via /api/rollups/refresh
+after loads).
+
+Ids are handed out before their rows commit, so max(id) alone can sit above
+a fact that is still in flight. The high watermark is therefore read under a
+SHARE lock on the fact table, which waits for open writes to commit; the lock
+is only held for that read. When loads keep it busy past ROLLUP_LOCK_TIMEOUT
+the refresh is skipped and the union below keeps answering from the facts.
+
+A rollup has the same shape as the schemas in queries.py, so build_data_query
+can run against it unchanged. Its FROM clause unions the rollup with the facts
+above the watermark, which keeps results exact between refreshes.
+"""
+import asyncio
+import logging
+import os
+
+import psycopg
+
+from db import connection
+from queries import ORDERS_SCHEMA, STAR_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") == "1"
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "300"))
+FACT_SALES_WATERMARK = os.getenv("FACT_SALES_WATERMARK", "sale_id")
+ORDERS_WATERMARK = os.getenv("ORDERS_WATERMARK", "id")
+ROLLUP_LOCK_TIMEOUT = os.getenv("ROLLUP_LOCK_TIMEOUT", "5s")
+
+MIN_WATERMARK = -(2 ** 63 - 1)
+
+WATERMARKS_DDL = """
+    CREATE TABLE IF NOT EXISTS rollup_watermarks (
+        rollup_name TEXT PRIMARY KEY,
+        watermark BIGINT,
+        refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+_SALES_FACTS = f"""
+    SELECT f.date_id, f.product_id, f.store_id,
+           SUM(f.units_sold) AS units_sold, SUM(f.revenue) AS revenue, SUM(f.profit) AS profit
+    FROM fact_sales f
+    JOIN dim_customer c ON f.customer_id = c.customer_id
+    WHERE f.{FACT_SALES_WATERMARK} > {{low}} AND f.{FACT_SALES_WATERMARK} <= {{high}}
+    GROUP BY f.date_id, f.product_id, f.store_id
+"""
+
+SALES_ROLLUP = {
+    "name": "rollup_sales_daily",
+    "source": STAR_SCHEMA,
+    "create": [
+        f"CREATE TABLE IF NOT EXISTS rollup_sales_daily AS {_SALES_FACTS.format(low=0, high=0)} WITH NO DATA",
+        "CREATE UNIQUE INDEX IF NOT EXISTS rollup_sales_daily_key ON rollup_sales_daily (date_id, store_id, product_id)",
+    ],
+    "fact_table": "fact_sales",
+    "high_watermark": f"SELECT max({FACT_SALES_WATERMARK}) FROM fact_sales",
+    "refresh": f"""
+        INSERT INTO rollup_sales_daily AS r (date_id, product_id, store_id, units_sold, revenue, profit)
+        {_SALES_FACTS.format(low="%(low)s", high="%(high)s")}
+        ON CONFLICT (date_id, store_id, product_id) DO UPDATE SET
+            units_sold = r.units_sold + EXCLUDED.units_sold,
+            revenue = r.revenue + EXCLUDED.revenue,
+            profit = r.profit + EXCLUDED.profit
+    """,
+    "from": f"""
+        FROM (
+            SELECT date_id, product_id, store_id, units_sold, revenue, profit FROM rollup_sales_daily
+            UNION ALL
+            SELECT f.date_id, f.product_id, f.store_id, f.units_sold, f.revenue, f.profit
+            FROM fact_sales f
+            JOIN dim_customer c ON f.customer_id = c.customer_id
+            WHERE f.{FACT_SALES_WATERMARK} > COALESCE(
+                (SELECT watermark FROM rollup_watermarks WHERE rollup_name = 'rollup_sales_daily'), {MIN_WATERMARK})
+        ) f
+        JOIN dim_date d ON f.date_id = d.date_id
+        JOIN dim_product p ON f.product_id = p.product_id
+        JOIN dim_store s ON f.store_id = s.store_id
+    """,
+    "dimensions": {name: expr for name, expr in STAR_SCHEMA["dimensions"].items() if name != "customer_name"},
+    "measures": STAR_SCHEMA["measures"],
+    "filters": STAR_SCHEMA["filters"],
+    "default_group_by": STAR_SCHEMA["default_group_by"],
+}
+
+_ORDERS_FACTS = f"""
+    SELECT o.orderDate AS order_date, o.storeId AS store_id, oi.SKU AS sku,
+           COUNT(oi.SKU) AS units_sold, SUM(p.Price) AS revenue, SUM(p.Price * 0.3) AS profit
+    FROM orders o
+    JOIN order_items oi ON o.id = oi.orderID
+    JOIN products p ON oi.SKU = p.SKU
+    JOIN customers c ON o.customerId = c.id
+    WHERE o.{ORDERS_WATERMARK} > {{low}} AND o.{ORDERS_WATERMARK} <= {{high}}
+    GROUP BY o.orderDate, o.storeId, oi.SKU
+"""
+
+ORDERS_ROLLUP = {
+    "name": "rollup_orders_daily",
+    "source": ORDERS_SCHEMA,
+    "create": [
+        f"CREATE TABLE IF NOT EXISTS rollup_orders_daily AS {_ORDERS_FACTS.format(low=0, high=0)} WITH NO DATA",
+        "CREATE UNIQUE INDEX IF NOT EXISTS rollup_orders_daily_key ON rollup_orders_daily (order_date, store_id, sku)",
+    ],
+    "fact_table": "orders",
+    "high_watermark": f"SELECT max({ORDERS_WATERMARK}) FROM orders",
+    "refresh": f"""
+        INSERT INTO rollup_orders_daily AS r (order_date, store_id, sku, units_sold, revenue, profit)
+        {_ORDERS_FACTS.format(low="%(low)s", high="%(high)s")}
+        ON CONFLICT (order_date, store_id, sku) DO UPDATE SET
+            units_sold = r.units_sold + EXCLUDED.units_sold,
+            revenue = r.revenue + EXCLUDED.revenue,
+            profit = r.profit + EXCLUDED.profit
+    """,
+    "from": f"""
+        FROM (
+            SELECT order_date, store_id, sku, units_sold, revenue, profit FROM rollup_orders_daily
+            UNION ALL
+            {_ORDERS_FACTS.format(
+                low=f"COALESCE((SELECT watermark FROM rollup_watermarks WHERE rollup_name = 'rollup_orders_daily'), {MIN_WATERMARK})",
+                high=2 ** 63 - 1,
+            )}
+        ) r
+        JOIN products p ON r.sku = p.SKU
+        JOIN stores s ON r.store_id = s.id
+    """,
+    "dimensions": {
+        "date": "r.order_date",
+        "product_id": "p.SKU",
+        "product_name": "p.Name",
+        "category": "p.Category",
+        "store_name": "s.id",
+        "city": "s.city",
+        "state": "s.state",
+    },
+    "measures": [
+        "SUM(r.units_sold) AS units_sold",
+        "SUM(r.revenue) AS revenue",
+        "SUM(r.profit) AS profit",
+    ],
+    "filters": ORDERS_SCHEMA["filters"],
+    "default_group_by": ORDERS_SCHEMA["default_group_by"],
+}
+
+ROLLUPS = [SALES_ROLLUP, ORDERS_ROLLUP]
+
+# Rollups whose tables are known to exist in this process.
+_ready = set()
+
+
+def route_schema(schema: dict, options: dict, persona_filters=None) -> dict:
+    """Return the rollup that can answer this query, or ``schema`` itself."""
+    if not ROLLUPS_ENABLED:
+        return schema
+    group_by = options["group_by"] or schema["default_group_by"]
+    for rollup in ROLLUPS:
+        if rollup["source"] is not schema or rollup["name"] not in _ready:
+            continue
+        if any(name not in rollup["dimensions"] for name in group_by):
+            continue
+        if any(name not in rollup["filters"] for name, _ in persona_filters or ()):
+            continue
+        return rollup
+    return schema
+
+
+async def committed_high_watermark(db, rollup: dict):
+    """Return the fact table's max id once every smaller id has committed.
+
+    Raises LockNotAvailable when open writes hold the table past
+    ROLLUP_LOCK_TIMEOUT.
+    """
+    async with db.transaction():
+        cur = db.cursor()
+        await cur.execute("SELECT set_config('lock_timeout', %s, true)", (ROLLUP_LOCK_TIMEOUT,))
+        # Waits for open writes to commit and holds off new ones, which draw
+        # their ids after this, until the max is read.
+        await cur.execute(f"LOCK TABLE {rollup['fact_table']} IN SHARE MODE")
+        await cur.execute(rollup["high_watermark"])
+        high = (await cur.fetchone())[0]
+        await cur.close()
+    return high
+
+
+async def refresh_rollup(rollup: dict) -> int:
+    """Fold facts above the watermark into ``rollup``; returns rows upserted."""
+    name = rollup["name"]
+    upserted = 0
+    async with connection() as db:
+        try:
+            high = await committed_high_watermark(db, rollup)
+        except psycopg.errors.LockNotAvailable:
+            logger.info("Rollup refresh for %s skipped: %s is busy with loads", name, rollup["fact_table"])
+            high = None
+        async with db.transaction():
+            cur = db.cursor()
+            # Serialize refreshes across workers so no fact is counted twice.
+            await cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (name,))
+            await cur.execute(WATERMARKS_DDL)
+            for statement in rollup["create"]:
+                await cur.execute(statement)
+            await cur.execute("SELECT watermark FROM rollup_watermarks WHERE rollup_name = %s", (name,))
+            row = await cur.fetchone()
+            low = row[0] if row and row[0] is not None else MIN_WATERMARK
+            if high is not None and high > low:
+                await cur.execute(rollup["refresh"], {"low": low, "high": high})
+                upserted = cur.rowcount
+                await cur.execute("""
+                    INSERT INTO rollup_watermarks (rollup_name, watermark, refreshed_at)
+                    VALUES (%s, %s, now())
+                    ON CONFLICT (rollup_name) DO UPDATE SET watermark = EXCLUDED.watermark, refreshed_at = now()
+                """, (name, high))
+            await cur.close()
+    _ready.add(name)
+    return upserted
+
+
+async def refresh_rollups() -> dict:
+    results = {}
+    for rollup in ROLLUPS:
+        try:
+            results[rollup["name"]] = await refresh_rollup(rollup)
+        except Exception as e:
+            logger.error("Rollup refresh failed for %s: %s", rollup["name"], e)
+            results[rollup["name"]] = None
+    return results
+
+
+async def refresh_periodically(on_change=None):
+    while True:
+        results = await refresh_rollups()
+        if on_change and any(results.values()):
+            on_change()
+        await asyncio.sleep(ROLLUP_REFRESH_INTERVAL)
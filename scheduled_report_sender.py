@@ -1,16 +1,22 @@
 import os
 import sys
 import logging
-import psycopg2
-import smtplib
-import jwt
-import base64
-from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+import psycopg
 import time
+import jwt
+import functools
+import io
+from datetime import datetime, timedelta, timezone
+
+from attachments import write_mime_message
+from migrations import apply_migrations_sync
+from personas import PERSONA_RULES_SQL, PERSONA_USERS_SQL, PersonaIndex
+from report_pipeline import DeliveryPipeline, SmtpPool, StageMetrics
+from reports import ARTIFACTS, DATA_VERSION_SQL, ArtifactCache, ReportRenderer
+from schedules import (
+    ADVANCE_SQL, CLAIM_DUE_SQL, FINISH_RUN_SQL, HOLD_SQL, START_RUN_SQL, UNSCHEDULED_SQL, next_run_after,
+    parse_timezone,
+)
 
 # Ensure stdout is line-buffered for GitHub Actions
 sys.stdout.reconfigure(line_buffering=True)
@@ -22,165 +28,206 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 
-logging.info("Starting scheduled report sender script...")
-
 # Load environment variables
 DATABASE_URL = os.getenv("DATABASE_URL")
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 SECRET = os.getenv("SECRET", "CHANGE_ME")
 
-try:
-    # Connect to the PostgreSQL database
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-
-    # Get current time
-    now = datetime.now()
-    current_time = now.strftime("%H:%M")
-    current_day = now.strftime("%A")
-    current_day_of_month = now.day
-
-    # Fetch subscriptions matching the current time
-    cur.execute("SELECT email, repeat_frequency, report_format FROM subscriptions WHERE scheduled_time = %s", (current_time,))
-    #cur.execute("SELECT email, repeat_frequency, report_format FROM subscriptions")
-    subscriptions = cur.fetchall()
-    logging.info(f"Found {subscriptions} subscriptions")
-    logging.info(f"Found {len(subscriptions)} subscriptions scheduled for {current_time}")
-
-    # Function to determine if a report should be sent today
-    def should_send_today(frequency):
-        if frequency.lower() == "daily":
-            return True
-        elif frequency.lower() == "weekly":
-            return current_day == "Monday"
-        elif frequency.lower() == "monthly":
-            return current_day_of_month == 1
-        return False
-
-    # Function to generate report files from dashboard
-    def generate_report_files(login_url, report_format):
-        """
-        Generate PDF and/or Excel files from the dashboard URL
-        Returns a dictionary with generated files as base64 strings
-        
-        TODO: Implement actual report generation using:
-        - Playwright/Selenium for browser automation
-        - Navigate to login_url and wait for dashboard to load
-        - Use browser's print to PDF feature for PDF generation
-        - Export data tables to Excel format
-        - Return actual binary file data
-        """
-        attachments = {}
-        
-        try:
-            logging.info(f"Generating reports for format: {report_format}")
-            
-            if 'pdf' in report_format.lower() or 'both' in report_format.lower():
-                # Simulate PDF generation - Replace with actual implementation
-                logging.info("Generating PDF report...")
-                # TODO: Use headless browser to:
-                # 1. Navigate to login_url
-                # 2. Wait for dashboard to fully load
-                # 3. Use page.pdf() to generate PDF
-                # 4. Return binary PDF data
-                
-                # Temporary simulation
-                pdf_content = f"BI Dashboard Report\nGenerated: {datetime.now()}\nAccess URL: {login_url}\n\n[Dashboard content would be here]"
-                attachments['pdf'] = base64.b64encode(pdf_content.encode()).decode()
-                logging.info("PDF report generated successfully")
-                
-            if 'excel' in report_format.lower() or 'both' in report_format.lower():
-                # Simulate Excel generation - Replace with actual implementation
-                logging.info("Generating Excel report...")
-                # TODO: Use headless browser to:
-                # 1. Navigate to login_url
-                # 2. Extract data from dashboard tables/charts
-                # 3. Use pandas/openpyxl to create Excel file
-                # 4. Return binary Excel data
-                
-                # Temporary simulation
-                excel_content = f"Report Type,Value,Timestamp\nDashboard Report,Generated,{datetime.now()}\nAccess URL,{login_url},N/A"
-                attachments['excel'] = base64.b64encode(excel_content.encode()).decode()
-                logging.info("Excel report generated successfully")
-                
-        except Exception as e:
-            logging.error(f"Failed to generate reports: {e}")
-            
-        return attachments
-
-    # Send emails
-    for email, frequency, report_format in subscriptions:
-        if should_send_today(frequency):
-            token = jwt.encode({"sub": email}, SECRET, algorithm="HS256")
-            login_url = f"https://bi-dashboard-frontend.vercel.app/?token={token}"
-
-            # Generate report files based on format
-            attachments = generate_report_files(login_url, report_format)
-
-            msg = MIMEMultipart()
-            msg["Subject"] = "Your Scheduled BI Dashboard Report"
-            msg["From"] = EMAIL_ADDRESS
-            msg["To"] = email
-            
-            # Create email body
-            attachment_info = ""
-            if attachments:
-                formats = []
-                if 'pdf' in attachments:
-                    formats.append("PDF")
-                if 'excel' in attachments:
-                    formats.append("Excel")
-                attachment_info = f"\n\nAttached: {', '.join(formats)} report(s)"
-            
-            body = f"Hello,\n\nYour scheduled BI Dashboard report is ready!{attachment_info}\n\nClick the link below to access your live dashboard:\n{login_url}\n\nThis link logs you in automatically.\n\nRegards,\nBI Dashboard Team"
-            msg.attach(MIMEText(body, "plain"))
-
-            # Add PDF attachment if generated
-            if 'pdf' in attachments:
-                try:
-                    pdf_data = base64.b64decode(attachments['pdf'])
-                    part = MIMEBase("application", "octet-stream")
-                    part.set_payload(pdf_data)
-                    encoders.encode_base64(part)
-                    part.add_header(
-                        "Content-Disposition",
-                        f'attachment; filename="dashboard_report_{now.strftime("%Y%m%d_%H%M")}.pdf"'
-                    )
-                    part.add_header("Content-Type", "application/pdf")
-                    msg.attach(part)
-                    logging.info(f"PDF attachment added for {email}")
-                except Exception as e:
-                    logging.error(f"Failed to attach PDF for {email}: {e}")
-
-            # Add Excel attachment if generated
-            if 'excel' in attachments:
-                try:
-                    excel_data = base64.b64decode(attachments['excel'])
-                    part = MIMEBase("application", "octet-stream")
-                    part.set_payload(excel_data)
-                    encoders.encode_base64(part)
-                    part.add_header(
-                        "Content-Disposition",
-                        f'attachment; filename="dashboard_data_{now.strftime("%Y%m%d_%H%M")}.xlsx"'
-                    )
-                    part.add_header("Content-Type", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                    msg.attach(part)
-                    logging.info(f"Excel attachment added for {email}")
-                except Exception as e:
-                    logging.error(f"Failed to attach Excel for {email}: {e}")
-
+# A slot missed by more than this (sender down, repeated failures) is skipped
+# rather than delivered late.
+SCHEDULE_CATCHUP_HOURS = float(os.getenv("SCHEDULE_CATCHUP_HOURS", "24"))
+SCHEDULE_MAX_ATTEMPTS = int(os.getenv("SCHEDULE_MAX_ATTEMPTS", "3"))
+SCHEDULE_MAX_RUNS = int(os.getenv("SCHEDULE_MAX_RUNS", "500"))  # per invocation
+SCHEDULE_BATCH_SIZE = int(os.getenv("SCHEDULE_BATCH_SIZE", "50"))  # claimed and delivered together
+SCHEDULE_LEASE_SECONDS = float(os.getenv("SCHEDULE_LEASE_SECONDS", "1800"))  # claimed rows hidden while sending
+SCHEDULE_RETRY_SECONDS = float(os.getenv("SCHEDULE_RETRY_SECONDS", "300"))  # doubled after each failed attempt
+
+
+def generate_report_files(renderer, owner, report_format, slot):
+    """Return ``[(maintype, subtype, filename, path), ...]`` for the subscriber's format.
+
+    Reports are rendered from the /api/data query by reports.ReportRenderer,
+    scoped like the subscription owner's dashboard, once per distinct
+    (persona, format, data version, date) in a run. ``slot`` is in the
+    subscription's timezone, so the report covers the subscriber's day.
+    """
+    stamp = slot.strftime("%Y%m%d_%H%M")
+    files = []
+    for kind, path in renderer.artifacts(owner, report_format, slot.date()):
+        maintype, subtype, extension = ARTIFACTS[kind]
+        name = "dashboard_report" if kind == "pdf" else "dashboard_data"
+        files.append((maintype, subtype, f"{name}_{stamp}.{extension}", path))
+    return files
+
+
+def build_message(renderer, email, owner, report_format, slot):
+    token = jwt.encode({"sub": email}, SECRET, algorithm="HS256")
+    login_url = f"https://bi-dashboard-frontend.vercel.app/?token={token}"
+
+    # Generate report files based on format
+    files = generate_report_files(renderer, owner, report_format, slot)
+
+    # Create email body
+    attachment_info = ""
+    if files:
+        formats = ["PDF" if subtype == "pdf" else "Excel" for _, subtype, _, _ in files]
+        attachment_info = f"\n\nAttached: {', '.join(formats)} report(s)"
+
+    body = f"Hello,\n\nYour scheduled BI Dashboard report is ready!{attachment_info}\n\nClick the link below to access your live dashboard:\n{login_url}\n\nThis link logs you in automatically.\n\nRegards,\nBI Dashboard Team"
+
+    handles = [open(path, "rb") for _, _, _, path in files]
+    try:
+        out = io.BytesIO()
+        write_mime_message(
+            out, EMAIL_ADDRESS, email, "Your Scheduled BI Dashboard Report", body,
+            [(maintype, subtype, filename, handle) for (maintype, subtype, filename, _), handle in zip(files, handles)],
+        )
+    finally:
+        for handle in handles:
+            handle.close()
+    return out.getvalue()
+
+
+def schedule_unscheduled(conn, now):
+    # Rows created before next_run_at existed, or by older API versions.
+    with conn.cursor() as cur:
+        cur.execute(UNSCHEDULED_SQL)
+        for sub_id, frequency, scheduled_time, tz in cur.fetchall():
             try:
-                with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-                    smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                    smtp.sendmail(EMAIL_ADDRESS, [email], msg.as_string())
+                next_run = next_run_after(frequency, scheduled_time, tz, now)
+            except ValueError as e:
+                logging.error(f"Subscription {sub_id} has an invalid schedule: {e}")
+                continue
+            cur.execute(ADVANCE_SQL, (next_run, sub_id))
+    conn.commit()
+
+
+def build_job(renderer, job):
+    sub_id, email, owner, report_format, tz, slot = job
+    local_slot = slot.astimezone(parse_timezone(tz))
+    return EMAIL_ADDRESS, [email], build_message(renderer, email, owner, report_format, local_slot)
+
+
+def load_renderer(conn):
+    personas = PersonaIndex()
+    with conn.cursor() as cur:
+        cur.execute(PERSONA_USERS_SQL)
+        user_rows = cur.fetchall()
+        cur.execute(PERSONA_RULES_SQL)
+        rule_rows = cur.fetchall()
+        cur.execute(DATA_VERSION_SQL)
+        data_version = cur.fetchone()[0]
+    conn.commit()
+    cache = ArtifactCache()
+    cache.prune()
+    personas.replace(user_rows, rule_rows)
+    return ReportRenderer(lambda: psycopg.connect(DATABASE_URL), personas, data_version, cache)
+
+
+def next_run_for(sub_id, frequency, scheduled_time, tz, after):
+    try:
+        return next_run_after(frequency, scheduled_time, tz, after)
+    except ValueError as e:
+        logging.error(f"Subscription {sub_id} has an invalid schedule: {e}")
+        return None
+
+
+def claim_due(cur):
+    cur.execute(CLAIM_DUE_SQL, (SCHEDULE_BATCH_SIZE,))
+    return cur.fetchall()
+
+
+def run_due_batch(conn, pipeline, metrics):
+    """Claim and deliver up to SCHEDULE_BATCH_SIZE due subscriptions.
+
+    Returns how many were claimed (0 when none are due). The claim, the runs
+    it starts and a SCHEDULE_LEASE_SECONDS lease on the rows are committed
+    before anything is rendered, so no row lock is held while sending, and
+    each outcome is committed as soon as its message is sent. A sender that
+    dies mid-batch leaves only its unfinished slots, due again once the
+    lease runs out.
+    """
+    with conn.cursor() as cur:
+        rows = metrics.timed("claim", claim_due, cur)
+        if not rows:
+            conn.rollback()
+            return 0
+        now = datetime.now(timezone.utc)
+
+        schedules = {}  # sub_id -> (frequency, scheduled_time, tz, attempts)
+        jobs = []
+        for sub_id, email, owner, frequency, scheduled_time, report_format, tz, slot in rows:
+            cur.execute(START_RUN_SQL, (sub_id, slot))
+            started = cur.fetchone()
+            if started is None:
+                logging.info(f"Subscription {sub_id} slot {slot} was already sent")
+                after = max(now, slot)
+            elif now - slot > timedelta(hours=SCHEDULE_CATCHUP_HOURS):
+                logging.warning(f"Skipping subscription {sub_id} slot {slot}: older than {SCHEDULE_CATCHUP_HOURS}h")
+                cur.execute(FINISH_RUN_SQL, ("skipped", "missed catch-up window", sub_id, slot))
+                # Missed slots are not sent one by one: jump to the first one
+                # inside the catch-up window (due again right away, if any).
+                after = now - timedelta(hours=SCHEDULE_CATCHUP_HOURS)
+            else:
+                schedules[sub_id] = (frequency, scheduled_time, tz, started[1])
+                cur.execute(HOLD_SQL, (SCHEDULE_LEASE_SECONDS, sub_id))
+                jobs.append((sub_id, email, owner, report_format, tz, slot))
+                continue
+            cur.execute(ADVANCE_SQL, (next_run_for(sub_id, frequency, scheduled_time, tz, after), sub_id))
+    conn.commit()
+
+    for (sub_id, email, owner, report_format, tz, slot), error in pipeline.run(jobs):
+        start = time.perf_counter()
+        frequency, scheduled_time, tz, attempts = schedules[sub_id]
+        with conn.cursor() as cur:
+            if error is None:
                 logging.info(f"Email sent to {email} with format: {report_format}")
-            except Exception as e:
-                logging.error(f"Failed to send email to {email}: {e}")
-
-    cur.close()
-    conn.close()
+                cur.execute(FINISH_RUN_SQL, ("sent", None, sub_id, slot))
+            else:
+                logging.error(f"Failed to send email to {email}: {error}")
+                cur.execute(FINISH_RUN_SQL, ("failed", str(error), sub_id, slot))
+            if error is not None and attempts < SCHEDULE_MAX_ATTEMPTS:
+                # Retry the same slot after a backoff, so a short SMTP outage
+                # does not use up every attempt within one invocation.
+                cur.execute(HOLD_SQL, (SCHEDULE_RETRY_SECONDS * 2 ** (attempts - 1), sub_id))
+            else:
+                cur.execute(ADVANCE_SQL, (next_run_for(sub_id, frequency, scheduled_time, tz, max(now, slot)), sub_id))
+        conn.commit()
+        metrics.record("record", time.perf_counter() - start)
+    return len(rows)
+
+
+def main():
+    logging.info("Starting scheduled report sender script...")
+    conn = psycopg.connect(DATABASE_URL)
+    metrics = StageMetrics()
+    pipeline = None
+    try:
+        apply_migrations_sync(conn)
+        schedule_unscheduled(conn, datetime.now(timezone.utc))
+        renderer = load_renderer(conn)
+        smtp_pool = SmtpPool(username=EMAIL_ADDRESS, password=EMAIL_PASSWORD, metrics=metrics)
+        pipeline = DeliveryPipeline(functools.partial(build_job, renderer), smtp_pool)
+        runs = 0
+        while runs < SCHEDULE_MAX_RUNS:
+            claimed = run_due_batch(conn, pipeline, metrics)
+            if not claimed:
+                break
+            runs += claimed
+        logging.info(f"Processed {runs} due subscriptions, rendered {renderer.cache.renders} reports "
+                     f"({renderer.cache.hits} reused)")
+        metrics.log_summary()
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+        conn.close()
     logging.info("Scheduled report sender script completed.")
 
-except Exception as e:
-    logging.error(f"Script failed due to error: {e}")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logging.error(f"Script failed due to error: {e}")
+        sys.exit(1)
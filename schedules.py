@@ -0,0 +1,160 @@
+"""Report subscription schedules.
+
+Each subscription stores its rule (repeat_frequency, scheduled_time "HH:MM",
+an IANA timezone) and the UTC instant it is next due in next_run_at. Senders
+claim due rows with FOR UPDATE SKIP LOCKED and hold them with retry_at (a
+lease while sending, a backoff after a failure), so several can run side by
+side. Every delivery is recorded in report_runs keyed by (subscription,
+scheduled slot) and committed as soon as it is sent, so a delivered slot is
+not sent again however often the sender is started; only a message in flight
+when a sender dies can go out twice.
+
+Rules are evaluated in the subscriber's timezone: daily at scheduled_time,
+weekly on Mondays, monthly on the 1st, as the original sender did. This module
+only holds SQL and date arithmetic so both the async API and the sync cron
+sender can use it.
+"""
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+FREQUENCIES = ("daily", "weekly", "monthly")
+WEEKLY_WEEKDAY = 0   # Monday
+MONTHLY_DAY = 1
+
+# A subscription is identified by who created it, what it sends and when;
+# creating the same one twice is a no-op. (The first migration keyed it
+# without the owner.)
+SUBSCRIPTION_KEY = ("created_by", "email", "repeat_frequency", "scheduled_time", "report_format", "timezone")
+_UNOWNED_KEY = SUBSCRIPTION_KEY[1:]
+
+SCHEDULE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id SERIAL PRIMARY KEY,
+        email TEXT NOT NULL,
+        repeat_frequency TEXT NOT NULL,
+        scheduled_time TEXT NOT NULL,
+        report_format TEXT NOT NULL
+    )
+    """,
+    "ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS timezone TEXT NOT NULL DEFAULT 'UTC'",
+    "ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS next_run_at TIMESTAMPTZ",
+    "CREATE INDEX IF NOT EXISTS subscriptions_next_run_at ON subscriptions (next_run_at)",
+    # Rows duplicated by the old SELECT-then-INSERT race would block the unique index.
+    f"""
+    DELETE FROM subscriptions a USING subscriptions b
+    WHERE a.id > b.id AND {" AND ".join(f"a.{column} = b.{column}" for column in _UNOWNED_KEY)}
+    """,
+    f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS subscriptions_unique
+    ON subscriptions ({", ".join(_UNOWNED_KEY)})
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS report_runs (
+        subscription_id INT NOT NULL REFERENCES subscriptions (id) ON DELETE CASCADE,
+        scheduled_for TIMESTAMPTZ NOT NULL,
+        status TEXT NOT NULL,
+        attempts INT NOT NULL DEFAULT 1,
+        error TEXT,
+        started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        finished_at TIMESTAMPTZ,
+        PRIMARY KEY (subscription_id, scheduled_for)
+    )
+    """,
+]
+
+# The user who created a subscription owns it: only they can list or delete
+# it, and its reports are scoped by their persona. Existing rows belonged to
+# whoever's login matched the address.
+SCHEDULE_OWNER_DDL = [
+    "ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS created_by TEXT",
+    "UPDATE subscriptions SET created_by = email WHERE created_by IS NULL",
+    "ALTER TABLE subscriptions ALTER COLUMN created_by SET NOT NULL",
+    "DROP INDEX IF EXISTS subscriptions_unique",
+    f"CREATE UNIQUE INDEX subscriptions_unique ON subscriptions ({', '.join(SUBSCRIPTION_KEY)})",
+]
+
+SCHEDULE_RETRY_DDL = [
+    "ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS retry_at TIMESTAMPTZ",
+]
+
+CLAIM_DUE_SQL = """
+    SELECT id, email, created_by, repeat_frequency, scheduled_time, report_format, timezone, next_run_at
+    FROM subscriptions
+    WHERE next_run_at <= now() AND (retry_at IS NULL OR retry_at <= now())
+    ORDER BY next_run_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Starts (or restarts) the run for a slot; a slot already sent comes back as 'sent'.
+START_RUN_SQL = """
+    INSERT INTO report_runs (subscription_id, scheduled_for, status)
+    VALUES (%s, %s, 'sending')
+    ON CONFLICT (subscription_id, scheduled_for) DO UPDATE
+    SET attempts = report_runs.attempts + 1, started_at = now()
+    WHERE report_runs.status <> 'sent'
+    RETURNING status, attempts
+"""
+
+FINISH_RUN_SQL = """
+    UPDATE report_runs SET status = %s, error = %s, finished_at = now()
+    WHERE subscription_id = %s AND scheduled_for = %s
+"""
+
+ADVANCE_SQL = "UPDATE subscriptions SET next_run_at = %s, retry_at = NULL WHERE id = %s"
+
+# Keeps the current slot but hides it from claims for %s seconds.
+HOLD_SQL = "UPDATE subscriptions SET retry_at = now() + make_interval(secs => %s) WHERE id = %s"
+
+UNSCHEDULED_SQL = """
+    SELECT id, repeat_frequency, scheduled_time, timezone
+    FROM subscriptions WHERE next_run_at IS NULL
+"""
+
+
+def parse_time(value: str) -> time:
+    try:
+        hour, minute = value.strip().split(":")
+        return time(int(hour), int(minute))
+    except (AttributeError, ValueError) as e:
+        raise ValueError(f"Invalid scheduled time {value!r}, expected HH:MM") from e
+
+
+def parse_timezone(name: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Unknown timezone {name!r}") from e
+
+
+def _matches(frequency: str, day) -> bool:
+    if frequency == "daily":
+        return True
+    if frequency == "weekly":
+        return day.weekday() == WEEKLY_WEEKDAY
+    return day.day == MONTHLY_DAY
+
+
+def next_run_after(frequency: str, scheduled_time: str, tz: str, after: datetime) -> datetime:
+    """Return the first occurrence of the rule strictly after ``after``, in UTC.
+
+    Raises ValueError for an unknown frequency, time or timezone.
+    """
+    frequency = frequency.strip().lower()
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown repeat frequency {frequency!r}, expected one of {', '.join(FREQUENCIES)}")
+    at = parse_time(scheduled_time)
+    zone = parse_timezone(tz)
+
+    day = after.astimezone(zone).date()
+    # Monthly rules need at most a month of days; 32 covers every case.
+    for _ in range(32):
+        if _matches(frequency, day):
+            # Wall-clock times skipped by a DST change resolve to the shifted
+            # instant and repeated ones to their first occurrence (fold=0).
+            candidate = datetime.combine(day, at, tzinfo=zone).astimezone(timezone.utc)
+            if candidate > after:
+                return candidate
+        day += timedelta(days=1)
+    raise AssertionError("no occurrence found")
@@ -0,0 +1,93 @@
+from decimal import Decimal
+from typing import Optional
+
+import orjson
+from psycopg.adapt import Loader
+from psycopg.rows import dict_row
+
+from db import connection
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow output is only offered when pyarrow is installed
+    pa = None
+
+FORMAT_RECORDS = "records"
+FORMAT_COLUMNAR = "columnar"
+FORMAT_ARROW = "arrow"
+
+MEDIA_TYPES = {
+    FORMAT_RECORDS: "application/json",
+    FORMAT_COLUMNAR: "application/vnd.bi.columnar+json",
+    FORMAT_ARROW: "application/vnd.apache.arrow.stream",
+}
+
+
+class JsonNumericLoader(Loader):
+    """Load NUMERIC straight to int/float instead of Decimal.
+
+    Mirrors what jsonable_encoder did with the Decimal afterwards: integral
+    values become ints, everything else a float.
+    """
+
+    def load(self, data):
+        text = bytes(data)
+        if b"." in text or b"e" in text or b"N" in text or b"I" in text:
+            return float(text)
+        return int(text)
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=_default)
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    accept = (accept or "").lower()
+    if MEDIA_TYPES[FORMAT_ARROW] in accept and pa is not None:
+        return FORMAT_ARROW
+    if MEDIA_TYPES[FORMAT_COLUMNAR] in accept:
+        return FORMAT_COLUMNAR
+    return FORMAT_RECORDS
+
+
+def encode_columnar(columns, rows) -> bytes:
+    return dumps({"columns": columns, "data": rows})
+
+
+def encode_arrow(columns, rows) -> bytes:
+    table = pa.Table.from_pylist([dict(zip(columns, row)) for row in rows]) if rows else pa.table({c: [] for c in columns})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+async def fetch_rows(query: str, params=None, fmt: str = FORMAT_RECORDS):
+    """Run ``query`` and return ``(columns, rows)`` shaped for ``fmt``.
+
+    Records are built as dicts by the row factory while fetching, so they can
+    go straight to orjson; the columnar formats keep the row tuples as they are.
+    """
+    async with connection() as db:
+        cur = db.cursor(row_factory=dict_row) if fmt == FORMAT_RECORDS else db.cursor()
+        if fmt != FORMAT_ARROW:
+            cur.adapters.register_loader("numeric", JsonNumericLoader)
+        await cur.execute(query, params)
+        rows = await cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
+        await cur.close()
+    return columns, rows
+
+
+def encode(columns, rows, fmt: str = FORMAT_RECORDS) -> bytes:
+    if fmt == FORMAT_COLUMNAR:
+        return encode_columnar(columns, rows)
+    if fmt == FORMAT_ARROW:
+        return encode_arrow(columns, rows)
+    return dumps(rows)
@@ -0,0 +1,58 @@
+"""Run the API with one uvicorn worker process per available core.
+
+    DATABASE_URL=postgresql://... python serve.py
+
+WEB_CONCURRENCY sets the worker count; 0 (the default) uses the cores this
+process may run on, honouring CPU affinity and a cgroup CPU quota. With more
+than one worker a shared directory is created on /dev/shm for the result
+cache, persona rules and verified session tokens (SHARED_CACHE_DIR, see
+shared.py) and for Prometheus' multiprocess files (PROMETHEUS_MULTIPROC_DIR),
+and removed again on exit.
+
+Each worker opens its own connection pool, so Postgres sees up to
+DB_POOL_MAX_SIZE connections per worker. Migrations, rollup refreshes and
+the outbox already coordinate through Postgres locks, and KPI frames and
+dimension lists are built per worker.
+"""
+import math
+import os
+import shutil
+import tempfile
+
+import uvicorn
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))
+
+
+def available_cores() -> int:
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def main():
+    workers = WEB_CONCURRENCY or available_cores()
+    shared_dir = None
+    if workers > 1 and not os.getenv("SHARED_CACHE_DIR"):
+        shared_dir = tempfile.mkdtemp(prefix="bi-api-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        os.environ["SHARED_CACHE_DIR"] = os.path.join(shared_dir, "cache")
+        os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(shared_dir, "prometheus"))
+        os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+    print(f"Starting {workers} worker(s) on {HOST}:{PORT}")
+    try:
+        uvicorn.run("main:app", host=HOST, port=PORT, workers=workers)
+    finally:
+        if shared_dir:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import jwt
+import orjson
+
+SESSION_TOKEN_TTL = float(os.getenv("SESSION_TOKEN_TTL", "300"))
+SESSION_TOKEN_CACHE_SIZE = int(os.getenv("SESSION_TOKEN_CACHE_SIZE", "10000"))
+
+
+class SessionTokenVerifier:
+    """Verify the HS256 tokens issued by /api/login, each at most once per TTL.
+
+    Verified payloads are remembered by token hash for SESSION_TOKEN_TTL
+    seconds (never past their ``exp``), so repeat requests skip jwt.decode.
+    With a ``shared`` store (several workers) a token verified by one worker
+    is a shared-memory read in the others instead of a signature check.
+    Invalid tokens are never cached.
+    """
+
+    def __init__(self, secret: str, shared=None):
+        self.secret = secret
+        self.shared = shared
+        self._verified = OrderedDict()  # sha256(token) -> (expires_at, payload)
+        self._stats = {"hits": 0, "shared_hits": 0, "decodes": 0}
+
+    def verify(self, token: str) -> dict:
+        """Return the token's payload; raises jwt.PyJWTError if it is invalid."""
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        cached = self._verified.get(digest)
+        if cached:
+            if cached[0] > now:
+                self._verified.move_to_end(digest)
+                self._stats["hits"] += 1
+                return cached[1]
+            del self._verified[digest]
+
+        payload = None
+        if self.shared is not None:
+            data = self.shared.get(("session_token", digest), ttl=SESSION_TOKEN_TTL)
+            if data is not None:
+                payload = orjson.loads(data)
+                self._stats["shared_hits"] += 1
+        if payload is None or payload.get("exp", now + 1) <= now:
+            payload = jwt.decode(token, self.secret, algorithms=["HS256"])
+            self._stats["decodes"] += 1
+            if self.shared is not None:
+                self.shared.set(("session_token", digest), orjson.dumps(payload))
+
+        self._verified[digest] = (min(now + SESSION_TOKEN_TTL, payload.get("exp", float("inf"))), payload)
+        if len(self._verified) > SESSION_TOKEN_CACHE_SIZE:
+            self._verified.popitem(last=False)
+        return payload
+
+    def get_stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["entries"] = len(self._verified)
+        return stats
@@ -0,0 +1,124 @@
+"""Cross-process store for running several workers (see serve.py).
+
+Entries are files in SHARED_CACHE_DIR, which serve.py creates on /dev/shm, so
+they live in shared memory and every worker on the host reads what any one of
+them wrote. Writes go to a temporary name and are renamed into place, so
+readers never see a partial entry. An entry expires ``ttl`` seconds after it
+was written and the oldest entries are pruned once the directory grows past
+SHARED_CACHE_MAX_BYTES.
+
+Entries can be keyed together with a generation number, kept per namespace
+(one per cache); ``bump(namespace)`` moves every worker to a new generation
+of that namespace, which is how one worker invalidates a cache in all of
+them without touching the others. When SHARED_CACHE_DIR is unset (a single
+process) ``shared_store`` is None and nothing is shared.
+"""
+import hashlib
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_DIR = os.getenv("SHARED_CACHE_DIR")
+SHARED_CACHE_TTL = float(os.getenv("SHARED_CACHE_TTL", os.getenv("RESULT_CACHE_TTL", "300")))
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SHARED_CACHE_PRUNE_EVERY = int(os.getenv("SHARED_CACHE_PRUNE_EVERY", "200"))
+
+
+class SharedStore:
+    def __init__(self, directory: str, ttl: float = SHARED_CACHE_TTL, max_bytes: int = SHARED_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._writes = 0
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "pruned": 0}
+
+    def _generation_path(self, namespace: str) -> str:
+        path = os.path.join(self.directory, f"generation.{namespace}")
+        if not os.path.exists(path):
+            open(path, "ab").close()
+        return path
+
+    def generation(self, namespace: str) -> int:
+        # The generation file's mtime; a stat is cheaper than reading a counter.
+        return os.stat(self._generation_path(namespace)).st_mtime_ns
+
+    def bump(self, namespace: str):
+        # File timestamps are coarse (a few ms), so step past the current one.
+        generation = max(time.time_ns(), self.generation(namespace) + 1)
+        os.utime(self._generation_path(namespace), ns=(generation, generation))
+
+    def path_for(self, key, generation=None) -> str:
+        if generation is not None:
+            key = (generation, key)
+        return os.path.join(self.directory, hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest())
+
+    def get(self, key, generation=None, ttl: float = None):
+        """Return the bytes stored under ``key``, or None if missing or expired.
+
+        Pass the ``generation`` the caller observed for entries that an
+        invalidation should hide; writes made under an older one are ignored.
+        """
+        path = self.path_for(key, generation)
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_mtime < time.time() - (self.ttl if ttl is None else ttl):
+                    self._stats["misses"] += 1
+                    return None
+                value = f.read()
+        except FileNotFoundError:
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        return value
+
+    def set(self, key, value: bytes, generation=None):
+        path = self.path_for(key, generation)
+        partial = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(partial, "wb") as f:
+                f.write(value)
+            os.replace(partial, path)
+        except OSError as e:
+            logger.warning("Shared cache write failed: %s", e)
+            if os.path.exists(partial):
+                os.remove(partial)
+            return
+        self._stats["writes"] += 1
+        self._writes += 1
+        if self._writes % SHARED_CACHE_PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        """Drop expired entries, then the oldest ones until under ``max_bytes``."""
+        cutoff = time.time() - self.ttl
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith("generation.") or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._stats["pruned"] += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get_stats(self) -> dict:
+        return dict(self._stats)
+
+
+shared_store = SharedStore(SHARED_CACHE_DIR) if SHARED_CACHE_DIR else None
@@ -0,0 +1,120 @@
+"""GoogleTokenVerifier against a local stand-in JWKS endpoint."""
+import asyncio
+import json
+import time
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import google_auth
+from google_auth import GoogleTokenVerifier
+
+CLIENT_ID = "test-client.apps.googleusercontent.com"
+JWKS_URL = "https://jwks.local/certs"
+
+
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update(kid=kid, alg="RS256", use="sig")
+    return private_key, jwk
+
+
+class StandInJwks:
+    """Serves ``self.keys`` as a JWKS document and counts fetches."""
+
+    def __init__(self, *jwks):
+        self.keys = list(jwks)
+        self.fetches = 0
+
+    def handler(self, request):
+        self.fetches += 1
+        return httpx.Response(200, json={"keys": self.keys}, headers={"Cache-Control": "public, max-age=3600"})
+
+
+def make_token(private_key, kid, **overrides):
+    now = int(time.time())
+    claims = {
+        "iss": "https://accounts.google.com",
+        "aud": CLIENT_ID,
+        "sub": "1234",
+        "email": "user@example.com",
+        "email_verified": True,
+        "iat": now,
+        "exp": now + 3600,
+    }
+    claims.update(overrides)
+    claims = {name: value for name, value in claims.items() if value is not None}
+    return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": kid})
+
+
+@pytest.fixture
+def key():
+    return make_key("key-1")
+
+
+@pytest.fixture
+def jwks(key):
+    return StandInJwks(key[1])
+
+
+def verify(jwks, *tokens):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(jwks.handler)) as client:
+            verifier = GoogleTokenVerifier(client, CLIENT_ID, jwks_url=JWKS_URL)
+            return [await verifier.verify(token) for token in tokens]
+
+    return asyncio.run(run())
+
+
+def test_valid_token(jwks, key):
+    assert verify(jwks, make_token(key[0], "key-1")) == ["user@example.com"]
+
+
+def test_repeat_token_uses_cached_keys(jwks, key):
+    token = make_token(key[0], "key-1")
+    assert verify(jwks, token, token) == ["user@example.com", "user@example.com"]
+    assert jwks.fetches == 1
+
+
+@pytest.mark.parametrize("overrides", [
+    {"aud": "someone-else.apps.googleusercontent.com"},
+    {"iss": "https://evil.example.com"},
+    {"exp": int(time.time()) - 60},
+    {"exp": None},
+    {"aud": None},
+    {"iss": None},
+    {"email_verified": False},
+    {"email_verified": "false"},
+])
+def test_rejected_claims(jwks, key, overrides):
+    assert verify(jwks, make_token(key[0], "key-1", **overrides)) == [None]
+
+
+def test_bad_signature(jwks):
+    other_key, _ = make_key("key-1")
+    assert verify(jwks, make_token(other_key, "key-1")) == [None]
+
+
+def test_unknown_kid_refetches_keys(jwks, key, monkeypatch):
+    monkeypatch.setattr(google_auth, "JWKS_MIN_REFRESH", 0)
+    rotated_key, rotated_jwk = make_key("key-2")
+
+    def rotate(request):
+        response = StandInJwks.handler(jwks, request)
+        jwks.keys = [rotated_jwk]
+        return response
+
+    jwks.handler = rotate
+    old_token = make_token(key[0], "key-1")
+    new_token = make_token(rotated_key, "key-2")
+    assert verify(jwks, old_token, new_token) == ["user@example.com", "user@example.com"]
+    assert jwks.fetches == 2
+
+
+def test_unknown_kid_refetch_is_rate_limited(jwks, key):
+    tokens = [make_token(key[0], "key-1")] + [make_token(key[0], f"junk-{n}") for n in range(5)]
+    assert verify(jwks, *tokens) == ["user@example.com"] + [None] * 5
+    assert jwks.fetches == 1
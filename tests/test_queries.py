@@ -0,0 +1,127 @@
+"""Keyset pagination in queries.build_data_query and main.load_page."""
+import asyncio
+import sqlite3
+from datetime import date
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+import main
+from queries import STAR_SCHEMA, build_data_query, decode_cursor, encode_cursor
+from serialization import FORMAT_COLUMNAR, FORMAT_RECORDS
+
+
+def options(**overrides):
+    return {"date_from": None, "date_to": None, "filters": {}, "group_by": None, "limit": 100, "cursor": None,
+            **overrides}
+
+
+def normalize(sql):
+    return " ".join(sql.split())
+
+
+def test_keyset_predicate_and_parameter_order():
+    cursor = encode_cursor(["2024-01-02", "Widget", "Tools", "S1"])
+    sql, params, keys = build_data_query(
+        STAR_SCHEMA,
+        options(group_by=["category", "date", "product_name", "store_name"], cursor=cursor, limit=10,
+                date_from=date(2024, 1, 1), filters={"city": ["LA"]}),
+        persona_filters=[("state", ["CA"])],
+    )
+    assert keys == ["date", "product_name", "category", "store_name"]
+    sql = normalize(sql)
+    assert (
+        "WHERE s.state = ANY(%s) AND d.date >= %s AND s.city = ANY(%s) AND ("
+        "(d.date < %s)"
+        " OR (d.date = %s AND p.product_name > %s)"
+        " OR (d.date = %s AND p.product_name = %s AND p.category > %s)"
+        " OR (d.date = %s AND p.product_name = %s AND p.category = %s AND s.store_name > %s))"
+    ) in sql
+    assert "ORDER BY d.date DESC, p.product_name, p.category, s.store_name LIMIT %s" in sql
+    assert params == [
+        ["CA"], date(2024, 1, 1), ["LA"],
+        "2024-01-02",
+        "2024-01-02", "Widget",
+        "2024-01-02", "Widget", "Tools",
+        "2024-01-02", "Widget", "Tools", "S1",
+        11,
+    ]
+    assert sql.count("%s") == len(params)
+
+
+def test_cursor_must_match_group_by():
+    cursor = encode_cursor(["2024-01-02", "Widget"])
+    with pytest.raises(HTTPException) as raised:
+        build_data_query(STAR_SCHEMA, options(group_by=["date", "product_name", "category"], cursor=cursor))
+    assert raised.value.status_code == 400
+
+
+@pytest.fixture
+def star(monkeypatch):
+    """An in-memory star schema with ties on every leading key, behind fetch_rows."""
+    db = sqlite3.connect(":memory:")
+    db.executescript("""
+        CREATE TABLE dim_date (date_id INTEGER, date TEXT);
+        CREATE TABLE dim_product (product_id INTEGER, product_name TEXT, category TEXT, brand TEXT);
+        CREATE TABLE dim_customer (customer_id INTEGER, customer_name TEXT);
+        CREATE TABLE dim_store (store_id INTEGER, store_name TEXT, city TEXT, state TEXT);
+        CREATE TABLE fact_sales (date_id INTEGER, product_id INTEGER, customer_id INTEGER, store_id INTEGER,
+                                 units_sold INTEGER, revenue REAL, profit REAL);
+    """)
+    db.executemany("INSERT INTO dim_date VALUES (?, ?)", [(1, "2024-01-01"), (2, "2024-01-02"), (3, "2024-01-03")])
+    # Two products share a name, so pages also break ties on category.
+    db.executemany("INSERT INTO dim_product VALUES (?, ?, ?, 'b')",
+                   [(1, "A", "x"), (2, "A", "y"), (3, "B", "x"), (4, "C", "x")])
+    db.execute("INSERT INTO dim_customer VALUES (1, 'c')")
+    db.executemany("INSERT INTO dim_store VALUES (?, ?, 'LA', 'CA')", [(1, "S1"), (2, "S2")])
+    db.executemany(
+        "INSERT INTO fact_sales VALUES (?, ?, 1, ?, 1, 2.0, 1.0)",
+        [(d, p, s) for d in (1, 2, 3) for p in (1, 2, 3, 4) for s in (1, 2)],
+    )
+
+    async def fetch_rows(query, params=None, fmt=FORMAT_RECORDS):
+        cur = db.execute(query.replace("%s", "?"), params or [])
+        columns = [desc[0] for desc in cur.description]
+        rows = cur.fetchall()
+        if fmt == FORMAT_RECORDS:
+            rows = [dict(zip(columns, row)) for row in rows]
+        return columns, rows
+
+    monkeypatch.setattr(main, "fetch_rows", fetch_rows)
+    return fetch_rows
+
+
+def page_through(fmt, limit):
+    """Return ``(pages, cursors)`` from following X-Next-Cursor to the end."""
+    group_by = ["date", "product_name", "category", "store_name"]
+    pages, cursors, cursor = [], [], None
+    while True:
+        sql, params, keys = build_data_query(STAR_SCHEMA, options(group_by=group_by, limit=limit, cursor=cursor))
+        body, headers = asyncio.run(main.load_page(sql, params, fmt, keys, limit))
+        pages.append(orjson.loads(body))
+        cursor = headers.get("X-Next-Cursor")
+        cursors.append(cursor)
+        if cursor is None:
+            return pages, cursors
+        assert len(decode_cursor(cursor, len(keys))) == len(keys)
+
+
+@pytest.mark.parametrize("limit", [1, 4, 5, 7, 24, 25])
+def test_pages_neither_skip_nor_repeat_rows(star, limit):
+    sql, params, _ = build_data_query(
+        STAR_SCHEMA, options(group_by=["date", "product_name", "category", "store_name"], limit=None))
+    _, expected = asyncio.run(star(sql, params))
+    assert len(expected) == 24
+
+    pages, _ = page_through(FORMAT_RECORDS, limit)
+    assert all(len(page) == limit for page in pages[:-1])
+    assert 0 < len(pages[-1]) <= limit
+    assert [row for page in pages for row in page] == expected
+
+
+def test_columnar_pages_get_the_same_cursors(star):
+    _, records = page_through(FORMAT_RECORDS, 5)
+    _, columnar = page_through(FORMAT_COLUMNAR, 5)
+    assert len(records) == 5
+    assert records == columnar
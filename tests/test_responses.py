@@ -0,0 +1,48 @@
+"""ETag, 304 and encoding negotiation in responses.json_response."""
+import pytest
+from starlette.requests import Request
+
+from responses import json_response, make_etag, negotiate_encoding
+
+BODY = b'{"rows": [' + b",".join(b'{"n": %d}' % n for n in range(500)) + b"]}"
+
+
+def make_request(**headers):
+    return Request({"type": "http", "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]})
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("gzip;q=0, br;q=0", None),
+    ("*;q=0.3, br;q=0", "gzip"),
+    ("identity, gzip;q=0.5", None),
+    ("gzip;level=1;q=0.2, br;q=0.1", "gzip"),
+    (None, None),
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+def test_not_modified_carries_the_encoded_etag():
+    response = json_response(make_request(accept_encoding="gzip"), BODY)
+    assert response.headers["content-encoding"] == "gzip"
+    etag = response.headers["etag"]
+    assert etag == make_etag(BODY)[:-1] + '-gzip"'
+
+    revalidated = json_response(make_request(accept_encoding="gzip", if_none_match=etag), BODY)
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+
+
+def test_other_representation_is_not_a_match():
+    etag = json_response(make_request(accept_encoding="gzip"), BODY).headers["etag"]
+    response = json_response(make_request(accept_encoding="br", if_none_match=etag), BODY)
+    assert response.status_code == 200
+    assert response.headers["etag"] == make_etag(BODY)[:-1] + '-br"'
+
+
+def test_precomputed_etag_is_used():
+    response = json_response(make_request(if_none_match='"cached"'), BODY, etag='"cached"')
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"cached"'
@@ -0,0 +1,211 @@
+"""Schedule rules in schedules.py and the claim/advance flow of the cron sender.
+
+The run_due_batch tests need a scratch Postgres database in TEST_DATABASE_URL
+(its subscriptions are truncated) and are skipped without one.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from schedules import next_run_after
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_daily_later_the_same_day():
+    assert next_run_after("daily", "09:00", "UTC", utc(2026, 10, 17, 8, 0)) == utc(2026, 10, 17, 9, 0)
+
+
+def test_daily_is_strictly_after():
+    assert next_run_after("daily", "09:00", "UTC", utc(2026, 10, 17, 9, 0)) == utc(2026, 10, 18, 9, 0)
+
+
+def test_local_time_in_the_subscriber_zone():
+    # 08:00 in Los Angeles (PDT, UTC-7) is 15:00 UTC.
+    assert next_run_after("Daily", "08:00", "America/Los_Angeles", utc(2026, 10, 17, 3, 0)) == utc(2026, 10, 17, 15, 0)
+
+
+def test_dst_gap_runs_at_the_shifted_instant():
+    # 02:30 does not exist in New York on 2026-03-08; it resolves with the
+    # pre-transition offset to 07:30 UTC, i.e. 03:30 EDT.
+    assert next_run_after("daily", "02:30", "America/New_York", utc(2026, 3, 8, 0, 0)) == utc(2026, 3, 8, 7, 30)
+    assert next_run_after("daily", "02:30", "America/New_York", utc(2026, 3, 8, 7, 30)) == utc(2026, 3, 9, 6, 30)
+
+
+def test_dst_fold_runs_once_at_the_first_occurrence():
+    # 01:30 happens twice in New York on 2026-11-01 (EDT, then EST).
+    first = next_run_after("daily", "01:30", "America/New_York", utc(2026, 11, 1, 0, 0))
+    assert first == utc(2026, 11, 1, 5, 30)
+    # The repeated 01:30 EST (06:30 UTC) is not a second run that day.
+    assert next_run_after("daily", "01:30", "America/New_York", first) == utc(2026, 11, 2, 6, 30)
+
+
+def test_weekly_on_monday():
+    monday = utc(2026, 10, 19, 9, 0)
+    assert monday.weekday() == 0
+    assert next_run_after("weekly", "09:00", "UTC", utc(2026, 10, 17, 12, 0)) == monday
+    assert next_run_after("weekly", "09:00", "UTC", utc(2026, 10, 19, 8, 59)) == monday
+    assert next_run_after("weekly", "09:00", "UTC", monday) == utc(2026, 10, 26, 9, 0)
+
+
+def test_weekly_uses_the_local_monday():
+    # Monday 00:30 in Tokyo is still Sunday in UTC.
+    assert next_run_after("weekly", "00:30", "Asia/Tokyo", utc(2026, 10, 17, 0, 0)) == utc(2026, 10, 18, 15, 30)
+
+
+@pytest.mark.parametrize("after, expected", [
+    (utc(2026, 1, 31, 12, 0), utc(2026, 2, 1, 9, 0)),
+    (utc(2026, 3, 31, 12, 0), utc(2026, 4, 1, 9, 0)),
+    (utc(2026, 12, 31, 12, 0), utc(2027, 1, 1, 9, 0)),
+    (utc(2026, 10, 1, 9, 0), utc(2026, 11, 1, 9, 0)),
+])
+def test_monthly_on_the_first(after, expected):
+    assert next_run_after("monthly", "09:00", "UTC", after) == expected
+
+
+@pytest.mark.parametrize("frequency, scheduled_time, tz", [
+    ("daily", "09:00", "Mars/Olympus_Mons"),
+    ("daily", "09:00", ""),
+    ("daily", "09:00", "../../etc/passwd"),
+    ("daily", "25:00", "UTC"),
+    ("daily", "09:60", "UTC"),
+    ("daily", "9am", "UTC"),
+    ("daily", "", "UTC"),
+    ("hourly", "09:00", "UTC"),
+])
+def test_invalid_rule_is_rejected(frequency, scheduled_time, tz):
+    with pytest.raises(ValueError):
+        next_run_after(frequency, scheduled_time, tz, utc(2026, 10, 17))
+
+
+class StubPipeline:
+    """Delivers every job, failing the subscription ids in ``errors``."""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.delivered = []
+
+    def run(self, jobs):
+        for job in jobs:
+            self.delivered.append(job)
+            yield job, self.errors.get(job[0])
+
+
+@pytest.fixture
+def sender():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    import psycopg
+
+    import scheduled_report_sender
+    from migrations import apply_migrations_sync
+
+    conn = psycopg.connect(TEST_DATABASE_URL)
+    # Part of the existing schema the migrations build on.
+    conn.execute("CREATE TABLE IF NOT EXISTS persona_users (username TEXT PRIMARY KEY, persona TEXT NOT NULL)")
+    conn.commit()
+    apply_migrations_sync(conn)
+    conn.execute("TRUNCATE subscriptions CASCADE")
+    conn.commit()
+    yield scheduled_report_sender, conn
+    conn.close()
+
+
+def subscribe(conn, next_run_at, frequency="daily", scheduled_time="09:00", tz="UTC"):
+    sub_id = conn.execute("""
+        INSERT INTO subscriptions (email, created_by, repeat_frequency, scheduled_time, report_format, timezone, next_run_at)
+        VALUES ('to@example.com', 'owner', %s, %s, 'pdf', %s, %s)
+        RETURNING id
+    """, (frequency, scheduled_time, tz, next_run_at)).fetchone()[0]
+    conn.commit()
+    return sub_id
+
+
+def state(conn, sub_id):
+    row = conn.execute("SELECT next_run_at, retry_at FROM subscriptions WHERE id = %s", (sub_id,)).fetchone()
+    runs = conn.execute("""
+        SELECT scheduled_for, status, attempts FROM report_runs WHERE subscription_id = %s ORDER BY scheduled_for
+    """, (sub_id,)).fetchall()
+    conn.commit()
+    return row, runs
+
+
+def run_batch(module, conn, pipeline):
+    from report_pipeline import StageMetrics
+
+    return module.run_due_batch(conn, pipeline, StageMetrics())
+
+
+def test_sent_slot_advances(sender):
+    module, conn = sender
+    slot = datetime.now(timezone.utc) - timedelta(hours=1)
+    sub_id = subscribe(conn, slot)
+    pipeline = StubPipeline()
+    assert run_batch(module, conn, pipeline) == 1
+    (next_run_at, retry_at), runs = state(conn, sub_id)
+    assert [job[0] for job in pipeline.delivered] == [sub_id]
+    assert runs == [(slot, "sent", 1)]
+    assert next_run_at == next_run_after("daily", "09:00", "UTC", datetime.now(timezone.utc))
+    assert retry_at is None
+    assert run_batch(module, conn, StubPipeline()) == 0
+
+
+def test_failed_slot_is_held_then_advanced_after_the_last_attempt(sender):
+    module, conn = sender
+    slot = datetime.now(timezone.utc) - timedelta(hours=1)
+    sub_id = subscribe(conn, slot)
+    pipeline = StubPipeline({sub_id: RuntimeError("smtp down")})
+    assert run_batch(module, conn, pipeline) == 1
+    (next_run_at, retry_at), runs = state(conn, sub_id)
+    assert runs == [(slot, "failed", 1)]
+    assert next_run_at == slot
+    assert retry_at > datetime.now(timezone.utc) + timedelta(seconds=module.SCHEDULE_RETRY_SECONDS - 60)
+    # Held: not claimed again until the backoff has passed.
+    assert run_batch(module, conn, pipeline) == 0
+
+    conn.execute("UPDATE report_runs SET attempts = %s WHERE subscription_id = %s", (module.SCHEDULE_MAX_ATTEMPTS - 1, sub_id))
+    conn.execute("UPDATE subscriptions SET retry_at = NULL WHERE id = %s", (sub_id,))
+    conn.commit()
+    assert run_batch(module, conn, pipeline) == 1
+    (next_run_at, retry_at), runs = state(conn, sub_id)
+    assert runs == [(slot, "failed", module.SCHEDULE_MAX_ATTEMPTS)]
+    assert next_run_at > datetime.now(timezone.utc)
+    assert retry_at is None
+
+
+def test_already_sent_slot_is_not_sent_again(sender):
+    module, conn = sender
+    slot = datetime.now(timezone.utc) - timedelta(hours=1)
+    sub_id = subscribe(conn, slot)
+    conn.execute("INSERT INTO report_runs (subscription_id, scheduled_for, status) VALUES (%s, %s, 'sent')", (sub_id, slot))
+    conn.commit()
+    pipeline = StubPipeline()
+    assert run_batch(module, conn, pipeline) == 1
+    (next_run_at, _), runs = state(conn, sub_id)
+    assert pipeline.delivered == []
+    assert runs == [(slot, "sent", 1)]
+    assert next_run_at > datetime.now(timezone.utc)
+
+
+def test_missed_slots_are_skipped_to_the_catch_up_window(sender):
+    module, conn = sender
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(hours=module.SCHEDULE_CATCHUP_HOURS + 48)
+    sub_id = subscribe(conn, stale, scheduled_time=(now - timedelta(hours=1)).strftime("%H:%M"))
+    pipeline = StubPipeline()
+    assert run_batch(module, conn, pipeline) == 1
+    (next_run_at, _), runs = state(conn, sub_id)
+    assert pipeline.delivered == []
+    assert runs == [(stale, "skipped", 1)]
+    # The first slot inside the window is due right away and sent once.
+    assert now - timedelta(hours=module.SCHEDULE_CATCHUP_HOURS) < next_run_at <= now
+    assert run_batch(module, conn, pipeline) == 1
+    assert [job[0] for job in pipeline.delivered] == [sub_id]
+    (next_run_at, _), runs = state(conn, sub_id)
+    assert [status for _, status, _ in runs] == ["skipped", "sent"]
+    assert next_run_at > now